@@ -0,0 +1,313 @@
+import datetime
+import re
+import threading
+from decimal import Decimal
+from itertools import combinations
+from csv_loader import DEFAULT_CHUNK_SIZE, TEMPORAL_KINDS, TEMPORAL_STORAGE_FORMATS, iter_loaded_chunks
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Groupings with more groups than this are dropped: they save little over scanning the table
+MAX_CUBE_GROUPS = 10000
+# MySQL returns AVG of exact numeric columns with four more decimal places than the column
+AVG_EXTRA_SCALE = 4
+ROWS_COLUMN = "*"
+TOTAL_GROUPING = ()
+
+CUBE_QUERY_PATTERN = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+`?(?P<table>\w+)`?"
+    r"(?:\s+WHERE\s+`?(?P<not_null>\w+)`?\s+IS\s+NOT\s+NULL)?"
+    r"(?:\s+GROUP\s+BY\s+(?P<group>`?\w+`?(?:\s*,\s*`?\w+`?)*))?"
+    r"(?:\s+LIMIT\s+(?P<limit>\d+))?\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+SELECT_ITEM_PATTERN = re.compile(
+    r"^(?:(?P<function>SUM|COUNT|AVG|MIN|MAX)\(\s*(?P<argument>\*|`?\w+`?)\s*\)|`?(?P<column>\w+)`?)"
+    r"(?:\s+AS\s+`?(?P<alias>\w+)`?)?$", re.IGNORECASE)
+
+
+# Pre-aggregated SUM/COUNT/MIN/MAX of a table's numeric columns per value of each column (a dimension)
+# and, with pairs=True, per pair of columns, plus the whole-table totals. Every statistic is mergeable,
+# so the cube is updated chunk by chunk as CSV files are loaded and appended; AVG is SUM/COUNT.
+# Exact numeric columns are summed as scaled integers so results match the database's DECIMAL sums.
+# Text columns are not dimensions: MySQL groups text ignoring case and trailing spaces, pandas does not.
+class AggregateCube:
+    def __init__(self, table_name, columns, profiles, pairs=False, max_groups=MAX_CUBE_GROUPS):
+        self.table_name = table_name
+        self.columns = list(columns)
+        self.max_groups = max_groups
+        self.kinds = {col: profiles[col].kind if col in profiles else "str" for col in self.columns}
+        # Number of decimal places per measure: 0 for integers, None for DOUBLE columns
+        self.scales = {}
+        for col in self.columns:
+            if self.kinds[col] == "int":
+                self.scales[col] = 0
+            elif self.kinds[col] == "float":
+                self.scales[col] = profiles[col].scale
+        dimensions = [col for col in self.columns if self.kinds[col] != "str"]
+        groupings = [TOTAL_GROUPING] + [(col,) for col in dimensions]
+        if pairs:
+            groupings += list(combinations(dimensions, 2))
+        self.groups = {grouping: None for grouping in groupings}
+        self.dropped = set()
+        self.row_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def measures(self):
+        return list(self.scales)
+
+    # Per-row values the statistics are computed from: scaled measures and one non-null flag per column
+    def _chunk_values(self, chunk):
+        values = {}
+        for col, scale in self.scales.items():
+            numbers = pd.to_numeric(chunk[col], errors="coerce").astype("float64")
+            values[col] = numbers if scale is None else (numbers * 10 ** scale).round()
+        for col in self.columns:
+            values[f"count:{col}"] = chunk[col].notna().astype("int64")
+        values[f"count:{ROWS_COLUMN}"] = np.ones(len(chunk), dtype="int64")
+        return pd.DataFrame(values, index=chunk.index)
+
+    def _aggregate(self, values, keys):
+        grouped = values.groupby(keys, dropna=False, sort=False)
+        count_columns = [f"count:{col}" for col in self.columns + [ROWS_COLUMN]]
+        parts = [grouped[count_columns].sum()]
+        if self.measures:
+            parts += [grouped[self.measures].sum().add_prefix("sum:"),
+                      grouped[self.measures].min().add_prefix("min:"),
+                      grouped[self.measures].max().add_prefix("max:")]
+        return pd.concat(parts, axis=1)
+
+    @staticmethod
+    def _merge(existing, partial):
+        if existing is None:
+            return partial
+        combined = pd.concat([existing, partial])
+        functions = {column: column.split(":", 1)[0].replace("count", "sum") for column in combined.columns}
+        return combined.groupby(level=list(range(combined.index.nlevels)), dropna=False, sort=False).agg(functions)
+
+    # Fold one chunk of converted rows (as inserted into the table) into every grouping
+    def update(self, chunk):
+        if chunk.empty:
+            return
+        values = self._chunk_values(chunk)
+        with self._lock:
+            for grouping in list(self.groups):
+                if grouping in self.dropped:
+                    continue
+                keys = [chunk[col] for col in grouping] if grouping else np.zeros(len(chunk), dtype="int8")
+                merged = self._merge(self.groups[grouping], self._aggregate(values, keys))
+                if len(merged) > self.max_groups:
+                    self.dropped.add(grouping)
+                    self.groups[grouping] = None
+                else:
+                    self.groups[grouping] = merged
+            self.row_count += len(chunk)
+
+    def update_from_csv(self, csv_path, profiles, constants=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        for chunk in iter_loaded_chunks(csv_path, profiles, self.columns, constants, chunk_size):
+            self.update(chunk)
+
+    def grouping_for(self, group_columns):
+        for grouping, frame in self.groups.items():
+            if frame is not None and sorted(grouping) == sorted(group_columns):
+                return grouping, frame
+        return None, None
+
+    # Python values as the embedded backends return them: DECIMAL sums and averages as Decimal, dates as
+    # date/time/datetime objects, integers (and sums of integers) as int
+    def _key_value(self, col, value):
+        if value is None or (not isinstance(value, str) and pd.isna(value)):
+            return None
+        kind = self.kinds[col]
+        if kind in TEMPORAL_KINDS:
+            parsed = datetime.datetime.strptime(value, TEMPORAL_STORAGE_FORMATS[kind])
+            return parsed.date() if kind == "date" else parsed.time() if kind == "time" else parsed
+        if kind == "int" and col in self.scales:
+            return int(value)
+        if kind == "float" and col in self.scales:
+            return self._measure_value(col, float(value) * 10 ** (self.scales[col] or 0))
+        return value.item() if isinstance(value, np.generic) else value
+
+    def _measure_value(self, col, scaled, exact_type=None):
+        scale = self.scales[col]
+        if scale is None:
+            return float(scaled)
+        if exact_type is int:
+            return int(scaled)
+        return Decimal(int(round(scaled))).scaleb(-scale)
+
+    def aggregate_value(self, function, col, count, value):
+        if function == "COUNT":
+            return int(count)
+        if count == 0:
+            return None
+        if function == "SUM":
+            return self._measure_value(col, value, exact_type=int if self.kinds[col] == "int" else None)
+        if function == "AVG":
+            if self.scales[col] is None:
+                return float(value) / count
+            average = Decimal(int(round(value))).scaleb(-self.scales[col]) / int(count)
+            return average.quantize(Decimal(1).scaleb(-(self.scales[col] + AVG_EXTRA_SCALE)))
+        return self._measure_value(col, value, exact_type=int if self.kinds[col] == "int" else None)
+
+    # One value per group of a grouping's frame: the group's key for a column, or an aggregate
+    def key_values(self, grouping, frame, col):
+        return [self._key_value(col, value) for value in frame.index.get_level_values(grouping.index(col)).tolist()]
+
+    def aggregate_values(self, frame, function, col):
+        counts = frame[f"count:{col}"].tolist()
+        if function == "COUNT":
+            return [int(count) for count in counts]
+        values = frame[f"{'sum' if function == 'AVG' else function.lower()}:{col}"].tolist()
+        return [self.aggregate_value(function, col, count, value) for count, value in zip(counts, values)]
+
+
+# Parse the aggregate queries the cube can answer: aggregates of single columns with an optional GROUP BY
+# over one or two columns and an optional LIMIT. A WHERE clause is only accepted in the form
+# "WHERE c IS NOT NULL" without GROUP BY, when it cannot change the aggregates of c.
+def parse_cube_query(query):
+    match = CUBE_QUERY_PATTERN.match(query)
+    if not match:
+        return None
+    group_columns = [col.strip().strip("`") for col in match.group("group").split(",")] if match.group("group") else []
+    items = []
+    for part in match.group("select").split(","):
+        item = SELECT_ITEM_PATTERN.match(part.strip())
+        if not item:
+            return None
+        if item.group("function"):
+            argument = item.group("argument").strip("`")
+            items.append((item.group("function").upper(), argument, item.group("alias") or part.strip()))
+        else:
+            items.append((None, item.group("column"), item.group("alias") or item.group("column")))
+
+    not_null = match.group("not_null")
+    if not_null and (group_columns or any(function is None or argument not in (not_null, ROWS_COLUMN)
+                                          for function, argument, _ in items)):
+        return None
+    if not_null:
+        items = [(function, not_null if argument == ROWS_COLUMN else argument, name) for function, argument, name in items]
+    limit = int(match.group("limit")) if match.group("limit") else None
+    return match.group("table"), items, group_columns, limit
+
+
+def sort_key(key):
+    return tuple((value is not None, value) for value in key)
+
+
+# Cubes by table name. Loads register and update cubes; queries are answered from a table's cube when
+# its shape matches, and otherwise run as SQL.
+class CubeRegistry:
+    def __init__(self, pairs=False, max_groups=MAX_CUBE_GROUPS):
+        self.pairs = pairs
+        self.max_groups = max_groups
+        self.enabled = True
+        self._cubes = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, table_name):
+        with self._lock:
+            return self._cubes.get(table_name.lower())
+
+    def register(self, cube):
+        with self._lock:
+            self._cubes[cube.table_name.lower()] = cube
+
+    def drop(self, table_name):
+        with self._lock:
+            self._cubes.pop(table_name.lower(), None)
+
+    def clear(self):
+        with self._lock:
+            self._cubes.clear()
+
+    # The cube a load into table_name should update: a new cube for a new table, the existing one when
+    # rows with the same columns are appended, or None when the cube cannot stay consistent (rows
+    # loaded before this process started, or different columns), in which case it is dropped.
+    def cube_for_load(self, table_name, columns, profiles, table_existed):
+        if not self.enabled:
+            return None
+        cube = self.get(table_name)
+        if not table_existed:
+            return AggregateCube(table_name, columns, profiles, self.pairs, self.max_groups)
+        if cube is not None and cube.columns == list(columns):
+            return cube
+        self.drop(table_name)
+        return None
+
+    # The table's cube and the parsed query, or None if no registered cube can be asked
+    def _lookup(self, query, params):
+        if not self.enabled or params or not query.lstrip().upper().startswith("SELECT"):
+            return None
+        parsed = parse_cube_query(query)
+        cube = self.get(parsed[0]) if parsed else None
+        return (cube, parsed) if cube is not None else None
+
+    # Whether answer() would return rows for query; nothing is computed or counted
+    def can_answer(self, query, params=None):
+        found = self._lookup(query, params)
+        return found is not None and self._resolve(found[0], *found[1][1:3]) is not None
+
+    # Rows for query as the database would return them (sorted by the GROUP BY columns), or None if the
+    # query is not one the table's cube can answer
+    def answer(self, query, params=None, dict_rows=False):
+        if not self.enabled or params or not query.lstrip().upper().startswith("SELECT"):
+            return None
+        found = self._lookup(query, params)
+        rows = self._answer(found[0], *found[1][1:]) if found is not None else None
+        with self._lock:
+            if rows is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if rows is not None and dict_rows:
+            names = [name for _, _, name in found[1][1]]
+            return [dict(zip(names, row)) for row in rows]
+        return rows
+
+    # The cube's grouping for the query's GROUP BY columns, with the columns and (function, argument)
+    # items resolved to the cube's names, or None if the cube cannot answer it
+    def _resolve(self, cube, items, group_columns):
+        known = {col.lower(): col for col in cube.columns}
+        if any(col.lower() not in known for col in group_columns):
+            return None
+        group_columns = [known[col.lower()] for col in group_columns]
+        resolved = []
+        for function, argument, name in items:
+            if argument != ROWS_COLUMN and argument.lower() not in known:
+                return None
+            argument = argument if argument == ROWS_COLUMN else known[argument.lower()]
+            if function is None and argument not in group_columns:
+                return None
+            if function not in (None, "COUNT") and argument not in cube.scales:
+                return None
+            resolved.append((function, argument))
+
+        grouping, frame = cube.grouping_for(group_columns)
+        if frame is None:
+            return None
+        return group_columns, resolved, grouping, frame
+
+    def _answer(self, cube, items, group_columns, limit):
+        resolution = self._resolve(cube, items, group_columns)
+        if resolution is None:
+            return None
+        group_columns, resolved, grouping, frame = resolution
+        keys = list(zip(*[cube.key_values(grouping, frame, col) for col in group_columns])) or [()] * len(frame)
+        columns = [cube.key_values(grouping, frame, argument) if function is None
+                   else cube.aggregate_values(frame, function, argument) for function, argument in resolved]
+        rows = [row for _, row in sorted(zip(keys, zip(*columns)), key=lambda entry: sort_key(entry[0]))]
+        return rows[:limit] if limit is not None else rows
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "tables": len(self._cubes),
+                    "groupings": sum(sum(frame is not None for frame in cube.groups.values())
+                                     for cube in self._cubes.values())}
+
+
+# Shared registry fed by the CSV loaders and consulted by query_executor.execute_plan
+cube_registry = CubeRegistry()
@@ -0,0 +1,211 @@
+import math
+import os
+import tempfile
+import pymysql
+from aggregate_cube import parse_cube_query
+from csv_loader import build_insert_query, bulk_load, insert_batches, iter_row_batches
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+DEFAULT_SAMPLE_ROWS = 100000
+SAMPLE_TABLE_SUFFIX = "_sample"
+# One row per sampled table: the sample table, how many rows it holds and how many the table had
+SAMPLES_TABLE = "chatdb_samples"
+# Normal quantile for the 95% confidence intervals reported with each estimate
+CONFIDENCE_LEVEL = 0.95
+CONFIDENCE_Z = 1.96
+APPROXIMATE_FUNCTIONS = {"SUM", "COUNT", "AVG"}
+
+
+def sample_table_name(table_name):
+    return f"{table_name}{SAMPLE_TABLE_SUFFIX}"
+
+
+# Uniform random sample of a fixed number of rows from a stream of DataFrame chunks (reservoir
+# sampling, algorithm R, applied to a whole chunk at a time). seen is the number of rows the sample
+# was drawn from, so a sample loaded back from the database keeps being maintained as rows are appended.
+class ReservoirSample:
+    def __init__(self, size=DEFAULT_SAMPLE_ROWS, rows=None, seen=0, seed=None):
+        self.size = size
+        self.rows = rows.reset_index(drop=True) if rows is not None else None
+        self.seen = seen
+        self._random = np.random.default_rng(seed)
+
+    def add(self, chunk):
+        chunk = chunk.reset_index(drop=True)
+        filled = 0 if self.rows is None else len(self.rows)
+        fill = min(max(self.size - filled, 0), len(chunk))
+        if fill:
+            head = chunk.iloc[:fill]
+            self.rows = head.copy() if self.rows is None else pd.concat([self.rows, head], ignore_index=True)
+        rest = chunk.iloc[fill:]
+        if len(rest):
+            # The i-th row seen (0-based) replaces a random sampled row with probability size / (i + 1)
+            positions = self.seen + fill + np.arange(len(rest))
+            accepted = np.flatnonzero(self._random.random(len(rest)) * (positions + 1) < self.size)
+            slots = self._random.integers(0, self.size, len(accepted))
+            # When several rows pick the same slot the last one wins, as if they were applied in order
+            _, last = np.unique(slots[::-1], return_index=True)
+            keep = len(slots) - 1 - last
+            self.rows.iloc[slots[keep]] = rest.iloc[accepted[keep]].to_numpy()
+        self.seen += len(chunk)
+
+
+def load_sample_info(connection, table_name):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT sample_table, sample_rows, population_rows FROM {SAMPLES_TABLE} "
+                           f"WHERE table_name = %s;", (table_name.lower(),))
+            return cursor.fetchone()
+    except pymysql.MySQLError:
+        return None
+
+
+# The sample maintained for table_name as a ReservoirSample, or None if the table has no sample yet
+def load_reservoir(connection, table_name, columns, size=DEFAULT_SAMPLE_ROWS):
+    info = load_sample_info(connection, table_name)
+    if info is None:
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {info[0]};")
+            rows = pd.DataFrame(list(cursor.fetchall()), columns=columns)
+    except pymysql.MySQLError:
+        # The sample no longer matches the table's columns
+        return None
+    return ReservoirSample(size, rows, info[2])
+
+
+# Sample a whole table by streaming it through a reservoir, for tables loaded before they had a sample
+def sample_table(connection, table_name, columns, size=DEFAULT_SAMPLE_ROWS, fetch_size=50000):
+    reservoir = ReservoirSample(size)
+    with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+        cursor.execute(f"SELECT {', '.join(columns)} FROM {table_name};")
+        while True:
+            batch = cursor.fetchmany(fetch_size)
+            if not batch:
+                break
+            reservoir.add(pd.DataFrame(list(batch), columns=columns))
+    return reservoir
+
+
+# Replace the rows of table_name's sample table with the reservoir, then record its sizes
+def save_sample(connection, table_name, column_definitions, columns, reservoir):
+    sample_table = sample_table_name(table_name)
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {sample_table} ({', '.join(column_definitions)});")
+        cursor.execute(f"DELETE FROM {sample_table};")
+    connection.commit()
+    # The sample goes through the bulk loader like any CSV file; its dates are already in ISO format
+    with tempfile.TemporaryDirectory() as work_dir:
+        csv_path = os.path.join(work_dir, f"{sample_table}.csv")
+        reservoir.rows[columns].to_csv(csv_path, index=False)
+        if bulk_load(connection, csv_path, sample_table, columns) is None:
+            insert_batches(connection, build_insert_query(sample_table, columns), iter_row_batches([reservoir.rows[columns]]))
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {SAMPLES_TABLE} (table_name VARCHAR(64) PRIMARY KEY, "
+                       f"sample_table VARCHAR(64) NOT NULL, sample_rows BIGINT NOT NULL, population_rows BIGINT NOT NULL);")
+        cursor.execute(f"DELETE FROM {SAMPLES_TABLE} WHERE table_name = %s;", (table_name.lower(),))
+        cursor.execute(f"INSERT INTO {SAMPLES_TABLE} (table_name, sample_table, sample_rows, population_rows) "
+                       f"VALUES (%s, %s, %s, %s);", (table_name.lower(), sample_table, len(reservoir.rows), reservoir.seen))
+    connection.commit()
+    print(f"Kept a sample of {len(reservoir.rows)} of {reservoir.seen} rows in '{sample_table}' for approximate queries.")
+
+
+# A SUM/COUNT/AVG query (optionally grouped) rewritten to run on a table's sample. The sample query
+# returns, per group, the counts, sums and sums of squares the estimates and their standard errors
+# are computed from; run() scales them to the whole table.
+class SampleEstimate:
+    def __init__(self, items, group_columns, limit, sample_table, sample_rows, population_rows):
+        self.items = items
+        self.group_columns = group_columns
+        self.limit = limit
+        self.sample_table = sample_table
+        self.sample_rows = sample_rows
+        self.population_rows = population_rows
+        select = list(group_columns)
+        for position, (function, argument, _) in enumerate(items):
+            if function is None:
+                continue
+            select.append(f"COUNT({argument}) AS count_{position}")
+            if function in ("SUM", "AVG"):
+                # Multiplying by 1.0 first keeps the square from overflowing narrow integer types
+                select += [f"SUM({argument}) AS sum_{position}",
+                           f"SUM(({argument} * 1.0) * {argument}) AS square_sum_{position}"]
+        group_by = f" GROUP BY {', '.join(group_columns)}" if group_columns else ""
+        self.sample_query = f"SELECT {', '.join(select)} FROM {sample_table}{group_by};"
+
+    @property
+    def column_names(self):
+        names = []
+        for function, _, name in self.items:
+            names += [name] if function is None else [name, f"{name}_low", f"{name}_high"]
+        return names
+
+    # Estimate and 95% interval of one aggregate in one group, with the finite population correction
+    def estimate(self, function, count, total, square_total):
+        n, population = self.sample_rows, self.population_rows
+        correction = math.sqrt(max(0.0, 1 - n / population)) if population else 0.0
+        if function == "AVG":
+            if not count:
+                return None, None, None
+            mean = total / count
+            variance = max(0.0, (square_total - count * mean * mean) / (count - 1)) if count > 1 else 0.0
+            estimate, error = mean, math.sqrt(variance / count) * correction
+        elif function == "COUNT":
+            share = count / n
+            estimate, error = population * share, population * math.sqrt(share * (1 - share) / n) * correction
+        else:
+            mean = total / n
+            variance = max(0.0, square_total / n - mean * mean)
+            estimate, error = population * mean, population * math.sqrt(variance / n) * correction
+        margin = CONFIDENCE_Z * error
+        if function == "COUNT":
+            return round(estimate), max(0, math.floor(estimate - margin)), math.ceil(estimate + margin)
+        return round(estimate, 4), round(estimate - margin, 4), round(estimate + margin, 4)
+
+    def run(self, connection, dict_rows=False):
+        with connection.cursor() as cursor:
+            cursor.execute(self.sample_query)
+            sample_rows = cursor.fetchall()
+            names = [column[0] for column in cursor.description]
+        rows = []
+        for sample_row in sample_rows:
+            keys = dict(zip(self.group_columns, sample_row))
+            values = dict(zip(names, sample_row))
+            row = []
+            for position, (function, argument, _) in enumerate(self.items):
+                if function is None:
+                    row.append(keys[argument])
+                    continue
+                total = values.get(f"sum_{position}")
+                square_total = values.get(f"square_sum_{position}")
+                row += self.estimate(function, int(values[f"count_{position}"] or 0),
+                                     float(total) if total is not None else 0.0,
+                                     float(square_total) if square_total is not None else 0.0)
+            rows.append(tuple(row))
+        rows = rows[:self.limit] if self.limit is not None else rows
+        if dict_rows:
+            return [dict(zip(self.column_names, row)) for row in rows]
+        return rows
+
+
+# The sample-based estimate for a query, or None if the query is not a SUM/COUNT/AVG aggregate (with
+# an optional GROUP BY) or its table has no sample
+def plan_estimate(connection, query, params=None):
+    parsed = parse_cube_query(query) if not params else None
+    if parsed is None:
+        return None
+    table_name, items, group_columns, limit = parsed
+    aggregates = [(function, argument) for function, argument, _ in items if function is not None]
+    if not aggregates or any(function not in APPROXIMATE_FUNCTIONS or (argument == "*" and function != "COUNT")
+                             for function, argument in aggregates):
+        return None
+    if any(function is None and argument not in group_columns for function, argument, _ in items):
+        return None
+    info = load_sample_info(connection, table_name)
+    if info is None or not info[1]:
+        return None
+    return SampleEstimate(items, group_columns, limit, info[0], int(info[1]), int(info[2]))
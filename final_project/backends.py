@@ -0,0 +1,59 @@
+import os
+import pymysql
+import duckdb_engine
+import sqlite_standin
+from connection_pool import ConnectionPool
+
+DEFAULT_BACKEND = "mysql"
+DEFAULT_DATABASE_FILES = {"sqlite": "chatdb.sqlite", "duckdb": "chatdb.duckdb"}
+
+
+# A database ChatDB can run against: how to open a connection and whether it runs in-process.
+# Every backend's connections accept the pymysql-style statements ChatDB issues (DESCRIBE, SHOW TABLES,
+# %s parameters, AUTO_INCREMENT ids), so the rest of the code is backend-agnostic. connect_function and
+# connect_kwargs are kept separate so worker processes can open their own connections.
+class Backend:
+    def __init__(self, name, connect_function, connect_kwargs, embedded):
+        self.name = name
+        self.connect_function = connect_function
+        self.connect_kwargs = connect_kwargs
+        self.embedded = embedded
+
+    def connect(self):
+        return self.connect_function(**self.connect_kwargs)
+
+    def pool(self, **pool_options):
+        return ConnectionPool(self.connect_function, self.connect_kwargs, **pool_options)
+
+    def __repr__(self):
+        return f"Backend({self.name!r}, {self.connect_kwargs.get('path', self.connect_kwargs.get('host'))!r})"
+
+
+# mysql uses db_config (or connect_kwargs); sqlite and duckdb store the database in a local file,
+# or in memory with database=":memory:"
+def get_backend(name=None, database=None, connect_kwargs=None):
+    name = (name or os.environ.get("CHATDB_BACKEND") or DEFAULT_BACKEND).lower()
+    database = database or os.environ.get("CHATDB_DATABASE")
+    if name == "mysql":
+        if connect_kwargs is None:
+            from simple_chatdb import db_config
+            connect_kwargs = dict(db_config)
+            if database:
+                connect_kwargs["database"] = database
+        return Backend("mysql", pymysql.connect, connect_kwargs, embedded=False)
+    if name == "sqlite":
+        return Backend("sqlite", sqlite_standin.connect, {"path": database or DEFAULT_DATABASE_FILES["sqlite"]},
+                       embedded=True)
+    if name == "duckdb":
+        if duckdb_engine.duckdb is None:
+            raise ImportError("The duckdb backend needs the duckdb package (pip install duckdb).")
+        return Backend("duckdb", duckdb_engine.connect, {"path": database or DEFAULT_DATABASE_FILES["duckdb"]},
+                       embedded=True)
+    raise ValueError(f"Unknown backend '{name}'. Choose one of: mysql, sqlite, duckdb.")
+
+
+def add_backend_arguments(parser):
+    parser.add_argument("--backend", choices=["mysql", "sqlite", "duckdb"], default=None,
+                        help="Database to use (default: $CHATDB_BACKEND or mysql)")
+    parser.add_argument("--database", default=None,
+                        help="Database file for sqlite/duckdb, or the MySQL schema name (default: $CHATDB_DATABASE)")
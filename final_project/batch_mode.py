@@ -0,0 +1,170 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from backends import add_backend_arguments, get_backend
+from generate_sample_queries import generate_keyword_query, generate_sample_queries
+from handle_natural_language import plan_natural_language_query
+from query_executor import execute_plan, plan_from_generated
+
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_ROWS = 1000
+
+
+# Read batch entries from a .jsonl file (one object per line) or a .csv file with a header row.
+# Each entry has a "question" (natural language) or a "keyword" (see VALID_KEYWORDS) and an optional
+# "table" that falls back to default_table; an optional "id" is carried through to the output.
+def read_batch_file(path, default_table=None):
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            entries = [dict(row) for row in csv.DictReader(f)]
+    else:
+        with open(path, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+    for position, entry in enumerate(entries):
+        entry.setdefault("id", position)
+        if not entry.get("table"):
+            entry["table"] = default_table
+    return entries
+
+
+# Translate every entry on one warm connection. The translator and translation cache are shared, so
+# each table's translator is compiled once and repeated questions are not translated again.
+def plan_batch(connection, entries):
+    plans = []
+    for entry in entries:
+        start = time.perf_counter()
+        plan, error = None, None
+        try:
+            if not entry["table"]:
+                error = "No table given for this entry."
+            elif entry.get("question"):
+                plan = plan_natural_language_query(connection, entry["question"], entry["table"])
+            elif entry.get("keyword"):
+                plan = plan_from_generated(generate_keyword_query(connection, entry["table"], entry["keyword"]),
+                                           source="keyword")
+            else:
+                plan = plan_from_generated(generate_sample_queries(connection, entry["table"]), source="random")
+            if plan is None and error is None:
+                error = "Failed to generate a query."
+        except Exception as e:
+            error = f"Error generating query: {e}"
+        plans.append((plan, error, time.perf_counter() - start))
+    return plans
+
+
+def plan_key(plan):
+    return plan.sql, tuple(plan.params), plan.source == "natural_language"
+
+
+# Execute a plan on a pooled connection and materialize its rows
+def execute_on_pool(pool, plan, max_rows):
+    start = time.perf_counter()
+    try:
+        with pool.connection() as connection:
+            dict_rows = plan.source == "natural_language"
+            result = execute_plan(connection, plan, dict_rows=dict_rows, max_rows=max_rows)
+            rows = [row if dict_rows else list(row) for row in result]
+        return {"rows": rows, "row_count": len(rows), "truncated": result.truncated,
+                "from_cache": result.from_cache, "execute_ms": (time.perf_counter() - start) * 1000,
+                "error": None}
+    except Exception as e:
+        return {"rows": [], "row_count": 0, "truncated": False, "from_cache": False,
+                "execute_ms": (time.perf_counter() - start) * 1000, "error": f"Error executing query: {e}"}
+
+
+# Translate all entries, run each distinct query once across a thread pool and return one record
+# per entry. Entries whose SQL and parameters match an earlier entry reuse that execution.
+def run_batch(pool, entries, workers=DEFAULT_WORKERS, max_rows=DEFAULT_MAX_ROWS):
+    with pool.connection() as connection:
+        plans = plan_batch(connection, entries)
+
+    unique_plans = {}
+    for plan, _, _ in plans:
+        if plan is not None:
+            unique_plans.setdefault(plan_key(plan), plan)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {key: executor.submit(execute_on_pool, pool, plan, max_rows) for key, plan in unique_plans.items()}
+        executions = {key: future.result() for key, future in futures.items()}
+
+    records = []
+    executed = set()
+    for entry, (plan, error, translate_time) in zip(entries, plans):
+        record = {"id": entry["id"], "table": entry["table"], "question": entry.get("question"),
+                  "keyword": entry.get("keyword"), "sql": None, "params": None, "rows": [], "row_count": 0,
+                  "truncated": False, "deduplicated": False, "translate_ms": round(translate_time * 1000, 3),
+                  "execute_ms": None, "error": error}
+        if plan is not None:
+            key = plan_key(plan)
+            execution = executions[key]
+            record.update(sql=plan.sql, params=plan.params, rows=execution["rows"],
+                          row_count=execution["row_count"], truncated=execution["truncated"],
+                          deduplicated=key in executed, execute_ms=round(execution["execute_ms"], 3),
+                          error=execution["error"])
+            executed.add(key)
+        records.append(record)
+    return records, len(unique_plans)
+
+
+def write_jsonl(records, output_path):
+    with open(output_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, default=str) + "\n")
+
+
+# Parquet needs a fixed schema, so rows and parameters are stored as JSON text columns
+def write_parquet(records, output_path):
+    import pandas as pd
+    frame = pd.DataFrame([dict(record, rows=json.dumps(record["rows"], default=str),
+                               params=json.dumps(record["params"], default=str)) for record in records])
+    try:
+        frame.to_parquet(output_path, index=False)
+        return output_path
+    except ImportError:
+        fallback_path = os.path.splitext(output_path)[0] + ".jsonl"
+        print(f"Parquet output needs pyarrow or fastparquet; writing JSONL to {fallback_path} instead.")
+        write_jsonl(records, fallback_path)
+        return fallback_path
+
+
+def write_results(records, output_path):
+    if output_path.lower().endswith(".parquet"):
+        return write_parquet(records, output_path)
+    write_jsonl(records, output_path)
+    return output_path
+
+
+def run_batch_file(pool, input_path, output_path, default_table=None, workers=DEFAULT_WORKERS,
+                   max_rows=DEFAULT_MAX_ROWS):
+    start = time.perf_counter()
+    entries = read_batch_file(input_path, default_table)
+    records, unique_queries = run_batch(pool, entries, workers, max_rows)
+    output_path = write_results(records, output_path)
+    elapsed = time.perf_counter() - start
+
+    failed = sum(1 for record in records if record["error"])
+    print(f"Processed {len(records)} entries ({unique_queries} distinct queries, {failed} failed) "
+          f"in {elapsed:.2f} s: {len(records) / elapsed if elapsed else 0:,.1f} entries/s.")
+    print(f"Results written to {output_path}")
+    return records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Translate and run a file of ChatDB questions or keywords")
+    parser.add_argument("input", help="A .jsonl or .csv file with 'question' or 'keyword' and optional 'table' fields")
+    parser.add_argument("--output", default="batch_results.jsonl", help="A .jsonl or .parquet output file")
+    parser.add_argument("--table", default=None, help="Table for entries that do not name one")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS)
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    pool = get_backend(args.backend, args.database).pool(max_size=args.workers + 1)
+    try:
+        run_batch_file(pool, args.input, args.output, args.table, args.workers, args.max_rows)
+    finally:
+        pool.close()
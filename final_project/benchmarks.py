@@ -0,0 +1,1290 @@
+import argparse
+import glob
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import pandas as pd
+import sqlite_standin
+from csv_loader import (build_insert_query, dataframe_rows, insert_rows_in_batches, insert_rows_individually,
+                        report_throughput, timed)
+from handle_natural_language import (AGGREGATE_FUNCTIONS, OPERATOR_MAP, SUPERLATIVE_MAP, SYNONYMS, CompiledTranslator,
+                                     detect_pattern, generate_aggregate_query, get_stop_words, normalize,
+                                     word_tokenize)
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "costco_dataset")
+COSTCO_COLUMNS = ["id", "product_id", "purchase_date", "purchase_time", "country_code", "price_per_unit",
+                  "units_sold", "currency"]
+
+# Natural-language questions used by the translator benchmarks
+SAMPLE_QUESTIONS = [
+    "What is the total units sold by country?",
+    "total units sold per country code",
+    "sum of price per unit for each currency",
+    "What is the number of units by country?",
+    "count of product id per country",
+    "average of price per unit by country",
+    "avg of units sold per currency",
+    "number of records by country",
+    "count by currency",
+    "number of rows per country code",
+    "list product_id grouped by purchase_date",
+    "list of units grouped by currency",
+    "show price where country is US",
+    "show units sold where price is greater than 500",
+    "list products with price per unit less than 100",
+    "products with units sold more than 50",
+    "show product id where units sold is between 10 and 20",
+    "show all sales where currency is CAD",
+    "price per unit higher than 900",
+    "find units sold fewer than 5",
+    "what is the highest price per unit?",
+    "which product has the lowest price",
+    "show the latest purchase date",
+    "show the earliest purchase time",
+    "which country has the most units sold",
+    "the smallest units sold",
+    "maximum price per unit",
+    "minimum units sold for each country",
+    "total price for each currency",
+    "average price per unit",
+    "count product id",
+    "show everything",
+    "show country and currency",
+    "list all product ids",
+    "units sold equals 10",
+    "country code not equal to MX",
+    "purchase date after 2022-01-01",
+    "purchase date before 2021-06-30",
+    "price greater than or equal to 250",
+    "units less than or equal to 3",
+    "What is the total revenue by region?",
+    "show the newest purchase date for each country",
+]
+
+
+# Build a DataFrame of the requested size by repeating the costco_dataset rows
+def scaled_dataset(rows):
+    frames = [pd.read_csv(path) for path in sorted(glob.glob(os.path.join(DATASET_DIR, "*.csv")))]
+    base = pd.concat(frames, ignore_index=True)
+    repeats = rows // len(base) + 1
+    return pd.concat([base] * repeats, ignore_index=True).head(rows)
+
+
+# Write a scaled copy of the dataset in slices so the benchmark process itself stays small
+def write_scaled_csv(csv_path, rows):
+    base = scaled_dataset(min(rows, 30000))
+    written = 0
+    while written < rows:
+        part = base.head(rows - written)
+        part.to_csv(csv_path, mode="a" if written else "w", header=not written, index=False)
+        written += len(part)
+
+
+def open_connection(use_mysql):
+    if use_mysql:
+        import pymysql
+        from simple_chatdb import db_config
+        return pymysql.connect(**db_config)
+    return sqlite_standin.connect(os.path.join(tempfile.mkdtemp(), "bench.db"))
+
+
+# The original upload type mapping
+def legacy_column_type(series):
+    if pd.api.types.is_integer_dtype(series):
+        return "INT"
+    elif pd.api.types.is_float_dtype(series):
+        return "DECIMAL(10, 2)"
+    return "VARCHAR(255)"
+
+
+def create_bench_table(connection, table_name, df):
+    column_definitions = ["id INT AUTO_INCREMENT PRIMARY KEY"]
+    for col in df.columns:
+        column_definitions.append(f"{col} {legacy_column_type(df[col])}")
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+        cursor.execute(f"CREATE TABLE {table_name} ({', '.join(column_definitions)});")
+    connection.commit()
+
+
+# Compare the original row-by-row insert loop with the batched executemany engine
+def bench_ingest(args):
+    df = scaled_dataset(args.rows)
+    rows = dataframe_rows(df)
+    connection = open_connection(args.mysql)
+    try:
+        results = {}
+        for label, function, extra in [("row_by_row", insert_rows_individually, ()),
+                                       ("batched", insert_rows_in_batches, (args.batch_size,))]:
+            table_name = f"bench_ingest_{label}"
+            create_bench_table(connection, table_name, df)
+            insert_query = build_insert_query(table_name, df.columns)
+            (rows_inserted, _), elapsed = timed(function, connection, insert_query, rows, *extra)
+            results[label] = report_throughput(rows_inserted, elapsed, label=f"[{label}] Inserted")
+        print(f"Speedup: {results['batched'] / results['row_by_row']:.1f}x")
+    finally:
+        connection.close()
+
+
+# Today's whole-file load: read everything, copy every string column to measure it, insert all rows
+def whole_file_load(connection, csv_path, table_name):
+    df = pd.read_csv(csv_path)
+    for col in df.columns:
+        if not pd.api.types.is_numeric_dtype(df[col]):
+            df[col].astype(str).map(len).max()
+    create_bench_table(connection, table_name, df)
+    return insert_rows_in_batches(connection, build_insert_query(table_name, df.columns), dataframe_rows(df))
+
+
+def memory_worker(args):
+    from simple_chatdb import upload_csv_to_database
+    connection = sqlite_standin.connect(os.path.join(tempfile.mkdtemp(), "bench.db"))
+    if args.mode == "whole_file":
+        whole_file_load(connection, args.csv, "bench_memory")
+    else:
+        upload_csv_to_database(connection, args.csv, "bench_memory", chunk_size=args.chunk_size)
+    connection.close()
+    # ru_maxrss is reported in kilobytes on Linux
+    print(json.dumps({"mode": args.mode, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+# Each mode runs in a fresh interpreter so its peak RSS is measured in isolation. Linux carries
+# ru_maxrss across exec, which is why the parent never holds the full dataset in memory.
+def bench_memory(args):
+    csv_path = os.path.join(tempfile.mkdtemp(), "bench_memory.csv")
+    write_scaled_csv(csv_path, args.rows)
+    print(f"Generated {args.rows} rows ({os.path.getsize(csv_path) / 2 ** 20:.1f} MB) at {csv_path}")
+    for mode in ["whole_file", "streaming"]:
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "memory-worker", "--mode", mode,
+                                 "--csv", csv_path, "--chunk-size", str(args.chunk_size)],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"[{mode}] Peak RSS: {result['peak_rss_mb']:.1f} MB")
+    os.remove(csv_path)
+
+
+# Original uncompiled translator from handle_natural_language. It rebuilds every regex and lookup on each
+# call and is kept here as the reference the compiled translator is benchmarked and checked against.
+def translate_to_sql_reference(sentence, table_columns, selected_table):
+    synonyms = SYNONYMS
+
+    # Tokenize the sentence
+    tokens = word_tokenize(sentence.lower())
+
+    # Join tokens back to a string for pattern matching
+    sentence_lower = ' '.join(tokens)
+
+    # Attempt to detect if the sentence matches a known pattern
+    pattern_name, components = detect_pattern(sentence_lower)
+    if pattern_name:
+        # Map components to columns
+        mapped_columns = map_components_to_columns(components, table_columns, synonyms)
+        query, params = generate_aggregate_query(mapped_columns, selected_table, pattern_name)
+        if query:
+            return query, params  # Return the generated query
+
+    # Initialize query components
+    select_columns = []
+    conditions = []
+    action = "SELECT"
+    params = []
+
+    # Function to normalize text
+    def normalize(text):
+        return re.sub(r'\s+|_', '', text.lower())
+
+    # Identify columns mentioned in the sentence
+    attributes = extract_attributes(tokens, table_columns, synonyms)
+    if attributes:
+        select_columns = attributes
+    else:
+        select_columns = ["*"]
+
+
+    operator_map = OPERATOR_MAP
+
+    # Build patterns for operators, sorted by length to match longer phrases first
+    operator_phrases = sorted(operator_map.keys(), key=lambda x: -len(x))
+    operator_pattern = '|'.join(map(re.escape, operator_phrases))
+
+    # Extract conditions from the sentence
+    stop_words = get_stop_words()
+    for column in table_columns:
+        column_variants = [column.lower().replace('_', ' ')]
+        # Include synonyms
+        for key, value in synonyms.items():
+            if value == column:
+                column_variants.append(key)
+
+        # Build a regex pattern for each operator
+        patterns = []
+
+        # BETWEEN operator
+        patterns.append(
+            rf"({'|'.join(map(re.escape, column_variants))})\s+(?:is\s+)?between\s+(\S+)\s+and\s+(\S+)"
+        )
+
+        # Other operators
+        for op_phrase in operator_phrases:
+            if op_phrase != 'between':
+                patterns.append(
+                    rf"({'|'.join(map(re.escape, column_variants))})\s+(?:is\s+)?{op_phrase}\s+(\S+)"
+                )
+
+        # Equality without operator phrases
+        patterns.append(
+            rf"({'|'.join(map(re.escape, column_variants))})\s+(?:is\s+)?(\S+)"
+        )
+
+        # Try matching patterns
+        for pattern in patterns:
+            regex = re.compile(pattern, re.IGNORECASE)
+            matches = regex.findall(sentence_lower)
+            if matches:
+                for match in matches:
+                    col_match = match[0]
+                    groups = match[1:]
+                    if 'between' in pattern:
+                        value1, value2 = groups
+                        conditions.append(f"{column} BETWEEN %s AND %s")
+                        params.extend([value1, value2])
+                    else:
+                        value = groups[-1]
+                        # Skip if value is a stopword
+                        if value.lower() in stop_words:
+                            continue
+                        # Extract the operator from the matched string
+                        op_match = re.search(operator_pattern, pattern, re.IGNORECASE)
+                        if op_match:
+                            op_phrase = op_match.group()
+                            op_symbol = operator_map.get(op_phrase.lower(), '=')
+                        else:
+                            op_symbol = '='
+                        conditions.append(f"{column} {op_symbol} %s")
+                        params.append(value)
+                break  # Stop after the first match for this column
+
+    # Check for aggregate functions in the sentence
+    aggregate_functions = AGGREGATE_FUNCTIONS
+
+    # Detect if an aggregate function is used
+    agg_func = None
+    for word in tokens:
+        if word in aggregate_functions:
+            agg_func = aggregate_functions[word]
+            break
+
+    # Handle grouping if necessary
+    group_by_columns = []
+    group_by_clause = ''
+    if 'each' in tokens or 'per' in tokens or 'by' in tokens:
+        # Attempt to find the grouping column
+        for idx, token in enumerate(tokens):
+            if token in ['each', 'per', 'by']:
+                next_tokens = tokens[idx + 1:idx + 4]  # Get the next few tokens
+                possible_column = ' '.join(next_tokens)
+                normalized_column = synonyms.get(possible_column, possible_column)
+                for column in table_columns:
+                    if normalize(column) == normalize(normalized_column):
+                        group_by_columns.append(column)
+                        break
+        if group_by_columns:
+            group_by_clause = f" GROUP BY {', '.join(group_by_columns)}"
+
+    # Adjust select columns based on aggregate function and grouping
+    if agg_func and select_columns != ["*"]:
+        if group_by_columns:
+            select_clause = ', '.join(
+                group_by_columns +
+                [f"{agg_func}({col}) AS {agg_func.lower()}_{col}" for col in select_columns if col not in group_by_columns]
+            )
+        else:
+            select_clause = ', '.join([f"{agg_func}({col}) AS {agg_func.lower()}_{col}" for col in select_columns])
+    elif group_by_columns:
+        select_clause = ', '.join(set(select_columns + group_by_columns))
+    else:
+        select_clause = ', '.join(set(select_columns))
+
+    # Build the SQL query
+    query = f"{action} {select_clause} FROM {selected_table}"
+
+    if conditions:
+        query += f" WHERE {' AND '.join(conditions)}"
+
+    query += group_by_clause
+
+    # Handle ordering if superlative adjectives are found
+    order_by_clause = ''
+    limit_clause = ''
+    superlative_map = SUPERLATIVE_MAP
+
+    for idx, word in enumerate(tokens):
+        if word in superlative_map:
+            order_direction, limit = superlative_map[word]
+            # Assume the next word is the column to order by
+            next_tokens = tokens[idx + 1:idx + 4]
+            possible_column = ' '.join(next_tokens)
+            normalized_column = synonyms.get(possible_column, possible_column)
+            for column in table_columns:
+                if normalize(column) == normalize(normalized_column):
+                    order_by_clause = f" ORDER BY {column} {order_direction}"
+                    limit_clause = f" LIMIT {limit}"
+                    break
+            if order_by_clause:
+                break
+    query += order_by_clause + limit_clause
+    query += ";"
+    return query, params
+
+def map_components_to_columns(components, table_columns, synonyms):
+    def normalize(text):
+        return re.sub(r'\s+|_', '', text.lower())
+
+    mapped_columns = {}
+    for key, value in components.items():
+        normalized_value = value.strip().lower()
+        normalized_value = synonyms.get(normalized_value, normalized_value)
+
+        for column in table_columns:
+            if normalize(column) == normalize(normalized_value):
+                mapped_columns[key] = column
+                break
+        else:
+            if key == 'A' and value in ['records', 'entries', 'rows']:
+                mapped_columns[key] = '*'  # For COUNT(*) cases
+            else:
+                mapped_columns[key] = None
+    return mapped_columns
+
+def extract_attributes(tokens, table_columns, synonyms):
+    attributes = []
+    token_text = ' '.join(tokens)
+    possible_attributes = []
+
+    # Create a list of possible column names including synonyms
+    possible_columns = set(table_columns)
+    possible_columns.update(synonyms.keys())
+
+    # Iterate over possible n-grams in the tokenized text
+    for n in range(1, 4):  # Adjust n for longer attributes if necessary
+        for i in range(len(tokens) - n + 1):
+            gram = ' '.join(tokens[i:i + n])
+            normalized_gram = synonyms.get(gram, gram)
+            for column in possible_columns:
+                if normalize(column) == normalize(normalized_gram):
+                    attributes.append(synonyms.get(column, column))
+                    break
+
+    # Remove duplicates and return
+    return list(set(attributes))
+
+
+# Compare the original per-call translator with the compiled one and check the SQL is byte-identical
+def bench_translator(args):
+    start = time.perf_counter()
+    translator = CompiledTranslator("costco", COSTCO_COLUMNS)
+    build_time = time.perf_counter() - start
+
+    mismatches = 0
+    for question in SAMPLE_QUESTIONS:
+        expected = translate_to_sql_reference(question, COSTCO_COLUMNS, "costco")
+        actual = translator.translate(question)
+        if actual != expected:
+            mismatches += 1
+            print(f"MISMATCH for {question!r}:\n  reference: {expected}\n  compiled:  {actual}")
+
+    timings = {}
+    for label, translate in [("reference", lambda q: translate_to_sql_reference(q, COSTCO_COLUMNS, "costco")),
+                             ("compiled", translator.translate)]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for question in SAMPLE_QUESTIONS:
+                translate(question)
+        timings[label] = (time.perf_counter() - start) / (args.repeat * len(SAMPLE_QUESTIONS))
+        print(f"[{label}] {timings[label] * 1e6:,.1f} us per question")
+    print(f"Translator build time: {build_time * 1e3:.2f} ms")
+    print(f"Speedup: {timings['reference'] / timings['compiled']:.1f}x, "
+          f"{len(SAMPLE_QUESTIONS) - mismatches}/{len(SAMPLE_QUESTIONS)} queries byte-identical")
+    if mismatches:
+        sys.exit(1)
+
+
+# Setup for scripts that tokenize SAMPLE_QUESTIONS in a fresh interpreter and print its RSS
+TOKENIZER_MEMORY_SCRIPTS = {
+    "built-in": "from handle_natural_language import FAST_TOKEN_PATTERN as p\ntokenize = p.findall",
+    "nltk": "import nltk\ntokenize = lambda q: nltk.word_tokenize(q, preserve_line=True)",
+}
+
+
+# Compare the built-in regex tokenizer with nltk.word_tokenize on the question corpus: identical
+# tokens, time per question and the RSS of a process that only tokenizes questions
+def bench_tokenizer(args):
+    import nltk
+    from handle_natural_language import FAST_TOKEN_PATTERN, FAST_TOKEN_UNSUPPORTED_PATTERN
+
+    questions = [question.lower() for question in SAMPLE_QUESTIONS]
+    try:
+        nltk.word_tokenize("warm up.")
+        nltk_tokenize = nltk.word_tokenize
+    except LookupError:
+        # Without the punkt data NLTK can only split single sentences, which every question here is
+        print("NLTK punkt data is not installed; comparing against nltk.word_tokenize(preserve_line=True)")
+        nltk_tokenize = lambda question: nltk.word_tokenize(question, preserve_line=True)
+
+    mismatches = 0
+    for question in questions:
+        if FAST_TOKEN_UNSUPPORTED_PATTERN.search(question):
+            print(f"Not handled by the built-in tokenizer: {question!r}")
+        elif FAST_TOKEN_PATTERN.findall(question) != nltk_tokenize(question):
+            mismatches += 1
+            print(f"MISMATCH for {question!r}:\n  nltk:     {nltk_tokenize(question)}\n"
+                  f"  built-in: {FAST_TOKEN_PATTERN.findall(question)}")
+
+    timings = {}
+    for label, tokenize in [("nltk", nltk_tokenize), ("built-in", FAST_TOKEN_PATTERN.findall)]:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            for question in questions:
+                tokenize(question)
+        timings[label] = (time.perf_counter() - start) / (args.repeat * len(questions))
+        print(f"[{label}] {timings[label] * 1e6:,.1f} us per question")
+    for label, setup in TOKENIZER_MEMORY_SCRIPTS.items():
+        # VmRSS rather than ru_maxrss, which Linux carries over from this (larger) parent process
+        script = (f"{setup}\nfor question in {questions!r}:\n    tokenize(question)\n"
+                  f"print([line.split()[1] for line in open('/proc/self/status') if line.startswith('VmRSS:')][0])")
+        output = subprocess.run([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout
+        print(f"[{label}] RSS after tokenizing: {int(output.strip().splitlines()[-1]) / 1024:.1f} MB")
+    print(f"Speedup: {timings['nltk'] / timings['built-in']:.1f}x, "
+          f"{len(questions) - mismatches}/{len(questions)} questions tokenized identically")
+    if mismatches:
+        sys.exit(1)
+
+
+# Queries shaped like the ones the generators and translator produce for the costco table
+INDEX_WORKLOAD = [
+    "SELECT * FROM bench_indexes WHERE country_code = 'CA' LIMIT 10;",
+    "SELECT * FROM bench_indexes WHERE country_code = %s AND price_per_unit > %s;",
+    "SELECT product_id, COUNT(units_sold) as count FROM bench_indexes GROUP BY product_id;",
+    "SELECT * FROM bench_indexes ORDER BY price_per_unit DESC LIMIT 1;",
+    "SELECT MAX(units_sold) AS max_value FROM bench_indexes;",
+    "SELECT * FROM bench_indexes WHERE purchase_date > '2022-06-01' LIMIT 10;",
+]
+INDEX_WORKLOAD_PARAMS = {1: ("MX", 900)}
+
+
+def time_workload(connection, repeat):
+    from query_executor import stream_query
+    timings = []
+    for position, query in enumerate(INDEX_WORKLOAD):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for _ in stream_query(connection, query, INDEX_WORKLOAD_PARAMS.get(position), use_cache=False):
+                pass
+        timings.append((time.perf_counter() - start) / repeat)
+    return timings
+
+
+# Log the workload, let the index advisor create its recommended indexes and compare EXPLAIN output and
+# wall-clock time per query before and after
+def bench_indexes(args):
+    from index_advisor import QueryUsageLog, advise_indexes, explain_query, summarize_explain
+    from simple_chatdb import upload_csv_to_database
+
+    csv_path = os.path.join(tempfile.mkdtemp(), "bench_indexes.csv")
+    write_scaled_csv(csv_path, args.rows)
+    connection = open_connection(args.mysql)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS bench_indexes;")
+        upload_csv_to_database(connection, csv_path, "bench_indexes")
+        usage_log = QueryUsageLog()
+        for query in INDEX_WORKLOAD:
+            usage_log.record(query)
+
+        explains = [[summarize_explain(explain_query(connection, query, INDEX_WORKLOAD_PARAMS.get(position)))]
+                    for position, query in enumerate(INDEX_WORKLOAD)]
+        before = time_workload(connection, args.repeat)
+        advise_indexes(connection, "bench_indexes", create=True, usage_log=usage_log)
+        for position, query in enumerate(INDEX_WORKLOAD):
+            explains[position].append(summarize_explain(explain_query(connection, query,
+                                                                      INDEX_WORKLOAD_PARAMS.get(position))))
+        after = time_workload(connection, args.repeat)
+
+        for query, (plan_before, plan_after), time_before, time_after in zip(INDEX_WORKLOAD, explains, before, after):
+            print(f"\n{query}\n  before: {time_before * 1000:8.2f} ms  {plan_before}"
+                  f"\n  after:  {time_after * 1000:8.2f} ms  {plan_after}\n  speedup: {time_before / time_after:.1f}x")
+        print(f"\nWorkload total: {sum(before) * 1000:.1f} ms -> {sum(after) * 1000:.1f} ms "
+              f"({sum(before) / sum(after):.1f}x)")
+    finally:
+        connection.close()
+        os.remove(csv_path)
+
+
+# Upper bound of the bytes a column takes in MySQL sort buffers and in-memory temporary tables, where
+# VARCHAR and CHAR are stored at their declared width (utf8mb4: up to 4 bytes per character)
+def column_width(column_type):
+    column_type = column_type.upper()
+    fixed_widths = {"TINYINT": 1, "SMALLINT": 2, "MEDIUMINT": 3, "INT": 4, "BIGINT": 8, "DOUBLE": 8, "DATE": 3,
+                    "TIME": 3, "DATETIME": 5}
+    base_type = column_type.split("(")[0].split()[0]
+    if base_type in fixed_widths:
+        return fixed_widths[base_type]
+    if base_type == "DECIMAL":
+        precision, scale = (int(part) for part in column_type[column_type.index("(") + 1:-1].split(","))
+        # Packed decimal: 4 bytes per 9 digits on each side of the point, fewer for the leftover digits
+        leftover_bytes = [0, 1, 1, 2, 2, 3, 3, 4, 4, 4]
+        digits_width = lambda digits: digits // 9 * 4 + leftover_bytes[digits % 9]
+        return digits_width(precision - scale) + digits_width(scale)
+    if base_type == "ENUM":
+        return 1 if column_type.count("'") // 2 < 256 else 2
+    length = int(column_type[column_type.index("(") + 1:column_type.index(")")])
+    return length * 4 + (2 if base_type == "VARCHAR" else 0)
+
+
+# Compare the original type mapping (INT / DECIMAL(10, 2) / VARCHAR(255)) with the inferred column
+# types: estimated row width, and the result and speed of the date range and ordering queries the
+# generators emit, which compare text lexicographically when dates are stored as strings
+def bench_schema(args):
+    from csv_loader import infer_column_definitions
+    from simple_chatdb import upload_csv_to_database
+
+    csv_path = os.path.join(tempfile.mkdtemp(), "bench_schema.csv")
+    write_scaled_csv(csv_path, args.rows)
+    df = pd.read_csv(csv_path, nrows=1000)
+    connection = open_connection(args.mysql)
+    try:
+        create_bench_table(connection, "bench_schema_legacy", df)
+        insert_rows_in_batches(connection, build_insert_query("bench_schema_legacy", df.columns),
+                               dataframe_rows(pd.read_csv(csv_path)))
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS bench_schema_inferred;")
+        upload_csv_to_database(connection, csv_path, "bench_schema_inferred")
+
+        legacy = [["id", "INT"]] + [[col, legacy_column_type(df[col])] for col in df.columns]
+        inferred = [definition.split(" ", 1) for definition in infer_column_definitions(csv_path)[1]]
+        inferred[0][1] = "INT"
+        print(f"{'column':<16}{'original':<18}{'inferred':<18}")
+        for (col, legacy_type), (_, inferred_type) in zip(legacy, inferred):
+            print(f"{col:<16}{legacy_type:<18}{inferred_type:<18}")
+        legacy_width = sum(column_width(column_type) for _, column_type in legacy)
+        inferred_width = sum(column_width(column_type) for _, column_type in inferred)
+        print(f"Estimated row width: {legacy_width} -> {inferred_width} bytes")
+
+        for label, query in [("date range", "SELECT COUNT(*) FROM {table} WHERE purchase_date >= '2022-01-01'"),
+                             ("latest date", "SELECT purchase_date FROM {table} ORDER BY purchase_date DESC LIMIT 1"),
+                             ("earliest time", "SELECT purchase_time FROM {table} ORDER BY purchase_time ASC LIMIT 1")]:
+            for table in ["bench_schema_legacy", "bench_schema_inferred"]:
+                with connection.cursor() as cursor:
+                    start = time.perf_counter()
+                    cursor.execute(query.format(table=table))
+                    result = cursor.fetchall()
+                    elapsed = time.perf_counter() - start
+                print(f"[{label}] {table}: {result[0][0]} in {elapsed * 1000:.1f} ms")
+    finally:
+        connection.close()
+        os.remove(csv_path)
+
+
+def query_kind(query):
+    from index_advisor import QueryShape
+    shape = QueryShape(query)
+    if shape.group_columns:
+        return "group_by"
+    if shape.order_columns:
+        return "order_by"
+    if shape.aggregates:
+        return "aggregation"
+    if shape.equality_columns or shape.range_columns or " WHERE " in query.upper():
+        return "where"
+    return "simple_select"
+
+
+# Build a seeded query corpus with generate_sample_queries (plus translated natural-language questions
+# when the NLTK data is installed), then run the same corpus on every backend
+def bench_backends(args):
+    import contextlib
+    import io
+    import random
+    import statistics
+    from backends import get_backend
+    from handle_natural_language import translate_to_sql
+    from query_executor import stream_query
+    from generate_sample_queries import generate_sample_queries
+    from simple_chatdb import upload_csv_to_database
+
+    names = args.backends.split(",")
+    work_dir = tempfile.mkdtemp()
+    csv_path = os.path.join(work_dir, "bench_backends.csv")
+    write_scaled_csv(csv_path, args.rows)
+
+    connections = {}
+    for name in names:
+        backend = get_backend(name, None if name == "mysql" else os.path.join(work_dir, f"bench.{name}"))
+        connection = backend.connect()
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TABLE IF EXISTS bench_backends;")
+        connection.commit()
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, load_time = timed(upload_csv_to_database, connection, csv_path, "bench_backends")
+        print(f"[{name}] loaded {args.rows} rows in {load_time:.2f} s")
+        connections[name] = connection
+
+    random.seed(args.seed)
+    corpus = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(args.queries):
+            query_result = generate_sample_queries(connections[names[0]], "bench_backends")
+            if query_result:
+                corpus.append((query_result[0], None))
+    try:
+        for question in SAMPLE_QUESTIONS:
+            query, params = translate_to_sql(question, connections[names[0]], "bench_backends")
+            if query:
+                corpus.append((query, params or None))
+    except LookupError:
+        print("NLTK data is not installed; the corpus has generated queries only.")
+
+    timings = {name: {} for name in names}
+    errors = {name: 0 for name in names}
+    row_count_mismatches = 0
+    for query, params in corpus:
+        row_counts = set()
+        for name in names:
+            start = time.perf_counter()
+            try:
+                row_counts.add(sum(1 for _ in stream_query(connections[name], query, params, use_cache=False)))
+            except Exception:
+                errors[name] += 1
+                continue
+            timings[name].setdefault(query_kind(query), []).append(time.perf_counter() - start)
+        row_count_mismatches += len(row_counts) > 1
+
+    print(f"\n{len(corpus)} queries; median ms per query")
+    print(f"{'kind':<16}" + "".join(f"{name:>12}" for name in names))
+    for kind in ["simple_select", "where", "group_by", "order_by", "aggregation"]:
+        medians = [statistics.median(timings[name][kind]) * 1000 if timings[name].get(kind) else float("nan")
+                   for name in names]
+        print(f"{kind:<16}" + "".join(f"{median:>12.2f}" for median in medians))
+    totals = [sum(sum(values) for values in timings[name].values()) for name in names]
+    print(f"{'total (s)':<16}" + "".join(f"{total:>12.3f}" for total in totals))
+    print("Errors: " + ", ".join(f"{name}={errors[name]}" for name in names)
+          + f"; queries with differing row counts: {row_count_mismatches}")
+    for connection in connections.values():
+        connection.close()
+    os.remove(csv_path)
+
+
+# Rows in a backend-neutral form: numbers rounded (MySQL returns AVG with four decimals), dates as text
+def comparable_rows(rows):
+    from decimal import Decimal
+    values = [tuple(round(float(value), 3) if isinstance(value, (int, float, Decimal))
+                    else str(value) if value is not None else None for value in row)
+              for row in rows]
+    return sorted(values, key=lambda row: tuple((value is not None, str(value)) for value in row))
+
+
+# Answer the group-by and aggregation queries ChatDB generates (and translated questions when the
+# NLTK data is installed) from the aggregate cube and from SQL, and check both give the same rows
+def bench_cube(args):
+    import contextlib
+    import io
+    import random
+    from aggregate_cube import AggregateCube, cube_registry
+    from csv_loader import infer_column_profiles
+    from generate_sample_queries import generate_sample_queries
+    from handle_natural_language import translate_to_sql
+    from query_executor import stream_query
+    from simple_chatdb import upload_csv_to_database
+
+    connection = open_connection(args.mysql)
+    csv_path = os.path.join(tempfile.mkdtemp(), "bench_cube.csv")
+    write_scaled_csv(csv_path, args.rows)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS bench_cube;")
+    connection.commit()
+    cube_registry.pairs = args.pairs
+    with contextlib.redirect_stdout(io.StringIO()):
+        upload_csv_to_database(connection, csv_path, "bench_cube")
+    columns, profiles = infer_column_profiles(csv_path)
+    cube = AggregateCube("bench_cube", columns, profiles, args.pairs)
+    _, build_time = timed(cube.update_from_csv, csv_path, profiles)
+    print(f"Built the cube over {args.rows} rows in {build_time:.2f} s "
+          f"({sum(frame is not None for frame in cube.groups.values())} groupings kept, {len(cube.dropped)} dropped).")
+
+    random.seed(args.seed)
+    corpus = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(args.queries):
+            query_result = generate_sample_queries(connection, "bench_cube", random.choice(["group_by", "aggregation"]))
+            if query_result:
+                corpus.append((query_result[0], None))
+    try:
+        for question in SAMPLE_QUESTIONS:
+            query, params = translate_to_sql(question, connection, "bench_cube")
+            if query:
+                corpus.append((query, params or None))
+    except LookupError:
+        print("NLTK data is not installed; the corpus has generated queries only.")
+
+    sql_time = cube_time = answered_sql_time = answered_cube_time = 0.0
+    answered = mismatches = errors = 0
+    for query, params in corpus:
+        start = time.perf_counter()
+        try:
+            sql_rows = list(stream_query(connection, query, params, use_cache=False, use_cube=False))
+        except Exception:
+            errors += 1
+            continue
+        query_sql_time = time.perf_counter() - start
+        start = time.perf_counter()
+        result = stream_query(connection, query, params, use_cache=False)
+        cube_rows = list(result)
+        query_cube_time = time.perf_counter() - start
+        sql_time += query_sql_time
+        cube_time += query_cube_time
+        if result.from_cube:
+            answered += 1
+            answered_sql_time += query_sql_time
+            answered_cube_time += query_cube_time
+        mismatches += comparable_rows(cube_rows) != comparable_rows(sql_rows)
+    print(f"{len(corpus) - errors} queries, {answered} answered from the cube, {mismatches} with different rows "
+          f"({errors} invalid queries skipped)")
+    print(f"Cube-answerable queries: SQL {answered_sql_time * 1000:.1f} ms, cube {answered_cube_time * 1000:.1f} ms")
+    print(f"Whole corpus: SQL only {sql_time * 1000:.1f} ms, cube with SQL fallback {cube_time * 1000:.1f} ms "
+          f"({sql_time / cube_time if cube_time else 0:.1f}x)")
+    connection.close()
+    os.remove(csv_path)
+
+
+# Exact vs sample-estimated SUM/COUNT/AVG queries: time, relative error and how often the 95%
+# confidence interval contains the exact value. The aggregate cube is disabled so both read the tables.
+def bench_approximate(args):
+    import contextlib
+    import io
+    from aggregate_cube import cube_registry
+    from query_executor import QueryPlan, execute_plan
+    from simple_chatdb import upload_csv_to_database
+
+    connection = open_connection(args.mysql)
+    csv_path = os.path.join(tempfile.mkdtemp(), "bench_approximate.csv")
+    write_scaled_csv(csv_path, args.rows)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS bench_approximate;")
+    connection.commit()
+    cube_registry.enabled = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        upload_csv_to_database(connection, csv_path, "bench_approximate", sample_rows=args.sample_rows)
+
+    queries = [f"SELECT {group}, {function}({column}) AS value FROM bench_approximate GROUP BY {group};"
+               for group in ("country_code", "currency", "product_id")
+               for function, column in (("SUM", "units_sold"), ("AVG", "price_per_unit"), ("COUNT", "*"))]
+    queries += [f"SELECT {function}({column}) AS value FROM bench_approximate;"
+                for function, column in (("SUM", "price_per_unit"), ("AVG", "units_sold"))]
+    exact_time = approximate_time = 0.0
+    estimates = covered = 0
+    errors = []
+    for query in queries:
+        start = time.perf_counter()
+        exact = {row[:-1]: float(row[-1]) for row in execute_plan(connection, QueryPlan(query), use_cache=False)}
+        exact_time += time.perf_counter() - start
+        start = time.perf_counter()
+        approximate = list(execute_plan(connection, QueryPlan(query), approximate=True))
+        approximate_time += time.perf_counter() - start
+        for row in approximate:
+            key, (estimate, low, high) = row[:-3], row[-3:]
+            if key in exact and estimate is not None:
+                estimates += 1
+                covered += low <= exact[key] <= high
+                errors.append(abs(estimate - exact[key]) / abs(exact[key]) if exact[key] else 0.0)
+    errors.sort()
+    print(f"{len(queries)} queries on {args.rows} rows, sample of {args.sample_rows} rows")
+    print(f"Exact:       {exact_time * 1000:10.1f} ms")
+    print(f"Approximate: {approximate_time * 1000:10.1f} ms ({exact_time / approximate_time if approximate_time else 0:.1f}x)")
+    print(f"{estimates} estimates: median relative error {errors[len(errors) // 2]:.2%}, "
+          f"max {errors[-1]:.2%}; {covered / estimates:.1%} of exact values inside the 95% interval")
+    connection.close()
+    os.remove(csv_path)
+
+
+# Refresh a table after rows were appended to its CSV file: a full reload of the file against an
+# incremental load of the new rows (from the watermark), and of a rewritten copy of the file (every
+# row hashed and the ones already loaded skipped)
+def bench_incremental(args):
+    import contextlib
+    import io
+    import shutil
+    from aggregate_cube import cube_registry
+    from incremental_ingest import incremental_load
+    from simple_chatdb import upload_csv_to_database
+
+    connection = open_connection(args.mysql)
+    work_dir = tempfile.mkdtemp()
+    csv_path = os.path.join(work_dir, "bench_incremental.csv")
+    write_scaled_csv(csv_path, args.rows)
+    with connection.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS bench_full;")
+        cursor.execute("DROP TABLE IF EXISTS bench_incremental;")
+        cursor.execute("DROP TABLE IF EXISTS bench_incremental_row_hashes;")
+    connection.commit()
+    cube_registry.enabled = False
+    with contextlib.redirect_stdout(io.StringIO()):
+        incremental_load(connection, csv_path, "bench_incremental")
+    scaled_dataset(args.delta_rows).to_csv(csv_path, mode="a", header=False, index=False)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        upload_csv_to_database(connection, csv_path, "bench_full")
+        full_time = time.perf_counter() - start
+        start = time.perf_counter()
+        appended = incremental_load(connection, csv_path, "bench_incremental")
+        append_time = time.perf_counter() - start
+        rewritten_path = os.path.join(work_dir, "bench_incremental_rewritten.csv")
+        shutil.copyfile(csv_path, rewritten_path)
+        start = time.perf_counter()
+        rewritten = incremental_load(connection, rewritten_path, "bench_incremental")
+        rewrite_time = time.perf_counter() - start
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM bench_full;")
+        full_rows = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM bench_incremental;")
+        incremental_rows = cursor.fetchone()[0]
+
+    print(f"{args.rows} rows loaded, then {args.delta_rows} rows appended to the file")
+    print(f"Full reload:          {full_time * 1000:10.1f} ms")
+    print(f"Incremental (append): {append_time * 1000:10.1f} ms ({full_time / append_time:.1f}x), "
+          f"{appended['rows_inserted']} inserted, {appended['rows_skipped']} skipped")
+    print(f"Incremental (copy):   {rewrite_time * 1000:10.1f} ms ({full_time / rewrite_time:.1f}x), "
+          f"{rewritten['rows_inserted']} inserted, {rewritten['rows_skipped']} skipped")
+    print(f"Rows in the table: {full_rows} after the full reload, {incremental_rows} after the incremental loads")
+    connection.close()
+    shutil.rmtree(work_dir)
+
+
+# Row counts such as "1M,10M,100M" or "250000"
+def parse_row_counts(text):
+    multipliers = {"K": 1000, "M": 1000000, "B": 1000000000}
+    counts = []
+    for part in text.split(","):
+        part = part.strip().upper()
+        multiplier = multipliers.get(part[-1:], 1)
+        counts.append(int(float(part[:-1] if multiplier > 1 else part) * multiplier))
+    return counts
+
+
+# Write rows drawn at random (with a seed) from all costco_dataset files, a slice at a time so memory
+# stays flat at any size. Values keep their original text, so the file is loaded like the real ones.
+def write_synthetic_csv(csv_path, rows, seed, slice_rows=1000000):
+    import numpy as np
+    base = pd.concat([pd.read_csv(path, dtype=str) for path in sorted(glob.glob(os.path.join(DATASET_DIR, "*.csv")))],
+                     ignore_index=True)
+    rng = np.random.default_rng(seed)
+    written = 0
+    while written < rows:
+        size = min(slice_rows, rows - written)
+        base.iloc[rng.integers(0, len(base), size)].to_csv(csv_path, mode="a" if written else "w",
+                                                           header=not written, index=False)
+        written += size
+
+
+# Nearest-rank percentiles, mean and max of a list of durations in seconds, in milliseconds
+def latency_summary(durations):
+    if not durations:
+        return {"count": 0}
+    values = sorted(durations)
+    summary = {"count": len(values), "mean_ms": round(sum(values) / len(values) * 1000, 3)}
+    for name, fraction in [("p50", 0.5), ("p90", 0.9), ("p95", 0.95), ("p99", 0.99)]:
+        summary[f"{name}_ms"] = round(values[min(len(values) - 1, int(len(values) * fraction))] * 1000, 3)
+    summary["max_ms"] = round(values[-1] * 1000, 3)
+    return summary
+
+
+# Run every workload query once across concurrency threads, each on its own pooled connection.
+# Returns (query_type, seconds, rows, error) per query and the wall-clock time of the whole replay.
+def replay_workload(pool, workload, concurrency, use_cache, use_cube):
+    from concurrent.futures import ThreadPoolExecutor
+    from query_executor import stream_query
+
+    def run(entry):
+        query_type, query, _ = entry
+        start = time.perf_counter()
+        try:
+            with pool.connection() as connection:
+                rows = sum(1 for _ in stream_query(connection, query, use_cache=use_cache, use_cube=use_cube))
+            return query_type, time.perf_counter() - start, rows, None
+        except Exception as e:
+            return query_type, time.perf_counter() - start, 0, type(e).__name__
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(run, workload))
+    return results, time.perf_counter() - start
+
+
+# Throughput, errors and latency percentiles (overall and per query type) of one replay
+def summarize_replay(replayed, elapsed):
+    by_type = {}
+    errors = {}
+    for query_type, seconds, _, error in replayed:
+        if error is None:
+            by_type.setdefault(query_type, []).append(seconds)
+        else:
+            errors[error] = errors.get(error, 0) + 1
+    return {"queries": len(replayed), "errors": errors, "seconds": round(elapsed, 3),
+            "qps": round(len(replayed) / elapsed, 1), "rows_returned": sum(result[2] for result in replayed),
+            "latency_ms": latency_summary([seconds for values in by_type.values() for seconds in values]),
+            "by_type": {query_type: latency_summary(values) for query_type, values in sorted(by_type.items())}}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_key(run):
+    return run["backend"], run["rows"], run["indexes"], run["concurrency"]
+
+
+# Print p50/p99 latency and throughput of each run against the matching run of a baseline results file
+def compare_workload_results(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {run_key(run): run for run in json.load(f)["runs"]}
+    print(f"\nCompared with {baseline_path}:")
+    for run in results["runs"]:
+        before = baseline.get(run_key(run))
+        if before is None:
+            continue
+        changes = []
+        for label, now, then in [("p50", run["latency_ms"]["p50_ms"], before["latency_ms"]["p50_ms"]),
+                                 ("p99", run["latency_ms"]["p99_ms"], before["latency_ms"]["p99_ms"]),
+                                 ("QPS", run["qps"], before["qps"])]:
+            changes.append(f"{label} {then:g} -> {now:g} ({(now - then) / then * 100 if then else 0:+.1f}%)")
+        print(f"  [{'/'.join(str(part) for part in run_key(run))}] " + ", ".join(changes))
+
+
+# Load csv_path into one backend, generate the seeded workload on it and replay it at each concurrency
+# level for each indexing choice; appends the ingest and replay results to results
+def run_backend_workload(args, name, rows, csv_path, data_dir, mix, results):
+    import contextlib
+    import io
+    from backends import get_backend
+    from generate_sample_queries import generate_workload
+    from index_advisor import QueryUsageLog, advise_indexes
+    from query_executor import stream_query
+    from simple_chatdb import upload_csv_to_database
+
+    concurrency_levels = [int(level) for level in args.concurrency.split(",")]
+    database = None if name == "mysql" else os.path.join(data_dir, f"workload_{rows}.{name}")
+    if database is not None and os.path.exists(database):
+        os.remove(database)
+    pool = get_backend(name, database).pool(max_size=max(concurrency_levels))
+    try:
+        with pool.connection() as connection, contextlib.redirect_stdout(io.StringIO()):
+            with connection.cursor() as cursor:
+                cursor.execute("DROP TABLE IF EXISTS bench_workload;")
+            connection.commit()
+            rows_inserted, ingest_time = timed(upload_csv_to_database, connection, csv_path, "bench_workload")
+            workload = generate_workload(connection, "bench_workload", args.queries, mix, args.seed)
+        ingest = {"backend": name, "rows": rows, "rows_inserted": rows_inserted, "seconds": round(ingest_time, 3),
+                  "rows_per_sec": round((rows_inserted or 0) / ingest_time)}
+        results["ingest"].append(ingest)
+        print(f"[{name}] ingested {rows_inserted} rows in {ingest_time:.2f} s ({ingest['rows_per_sec']:,} rows/sec); "
+              f"{len(workload)} workload queries")
+
+        for indexes in args.indexes.split(","):
+            with pool.connection() as connection, contextlib.redirect_stdout(io.StringIO()):
+                if indexes == "advisor":
+                    usage_log = QueryUsageLog()
+                    for _, query, _ in workload:
+                        usage_log.record(query)
+                    advise_indexes(connection, "bench_workload", create=True, usage_log=usage_log)
+                for _, query, _ in workload[:args.warmup]:
+                    for _ in stream_query(connection, query, use_cache=False, use_cube=args.cube):
+                        pass
+            for concurrency in concurrency_levels:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    replayed, elapsed = replay_workload(pool, workload, concurrency, args.cache, args.cube)
+                run = dict({"backend": name, "rows": rows, "indexes": indexes, "concurrency": concurrency},
+                           **summarize_replay(replayed, elapsed))
+                results["runs"].append(run)
+                print(f"[{name} {rows} rows, indexes={indexes}, concurrency={concurrency}] {run['qps']:,} QPS, "
+                      f"p50 {run['latency_ms'].get('p50_ms', 0):.2f} ms, p99 {run['latency_ms'].get('p99_ms', 0):.2f} ms, "
+                      f"{sum(run['errors'].values())} errors")
+    finally:
+        pool.close()
+
+
+# Reproducible end-to-end benchmark: a synthetic scale-up of costco_dataset is loaded into each backend
+# (ingest rows/sec), a seeded workload with the requested query mix is generated once, and it is replayed
+# at each concurrency level, before and after the index advisor creates indexes for it. Latency
+# percentiles (overall and per query type) and throughput go to a JSON results file that
+# --compare reads back to compare releases, backends or indexing choices.
+def bench_workload(args):
+    import platform
+    import shutil
+    from generate_sample_queries import parse_query_mix
+
+    mix = parse_query_mix(args.mix) if args.mix else None
+    data_dir = args.data_dir or tempfile.mkdtemp()
+    os.makedirs(data_dir, exist_ok=True)
+    results = {"benchmark": "workload", "started": time.strftime("%Y-%m-%dT%H:%M:%S"), "git_commit": git_commit(),
+               "python": platform.python_version(), "seed": args.seed, "queries": args.queries, "mix": mix,
+               "cache": args.cache, "cube": args.cube, "ingest": [], "runs": []}
+    try:
+        for rows in parse_row_counts(args.rows):
+            csv_path = os.path.join(data_dir, f"costco_synthetic_{rows}_{args.seed}.csv")
+            if not os.path.exists(csv_path):
+                start = time.perf_counter()
+                write_synthetic_csv(csv_path, rows, args.seed)
+                print(f"Wrote {rows} synthetic rows to {csv_path} in {time.perf_counter() - start:.1f} s")
+            for name in args.backends.split(","):
+                run_backend_workload(args, name, rows, csv_path, data_dir, mix, results)
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(data_dir)
+
+    if args.output == "-":
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    if args.compare:
+        compare_workload_results(results, args.compare)
+
+
+# Minimal keep-alive HTTP/1.1 JSON client used by the service load test
+async def http_json_request(reader, writer, method, path, payload=None):
+    body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+    writer.write((f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                  f"Content-Length: {len(body)}\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+SERVICE_REQUESTS = {
+    "tables": ("GET", "/tables", None),
+    "explore": ("GET", "/tables/bench_service", None),
+    "random": ("POST", "/query/random", {"table": "bench_service"}),
+    "keyword": ("POST", "/query/keyword", {"table": "bench_service", "keyword": "group by"}),
+    "natural": ("POST", "/query/natural", {"table": "bench_service", "question": "total units sold by country"}),
+}
+
+
+# Start the HTTP service in-process against a SQLite copy of the dataset and drive it with
+# concurrent keep-alive clients; reports throughput and latency percentiles per endpoint.
+# Modules that should not be imported just to start the CLI or the service
+HEAVY_MODULES = ["pandas", "numpy", "nltk", "duckdb"]
+
+
+# Parse the stderr of python -X importtime: (module, self us, cumulative us, nesting depth) per import
+def parse_importtime(output):
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((name.strip(), int(self_us), int(cumulative_us), (len(name) - len(name.lstrip())) // 2))
+    return imports
+
+
+# Import time of each entry module in a fresh interpreter (median of --repeat runs), the slowest
+# top-level imports and any heavy dependency that got imported eagerly. Fails above --max-ms.
+def bench_startup(args):
+    failed = False
+    for module in args.modules.split(","):
+        runs = []
+        for _ in range(args.repeat):
+            output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                                    capture_output=True, text=True, check=True).stderr
+            imports = parse_importtime(output)
+            runs.append((sum(cumulative for _, _, cumulative, depth in imports if depth == 0), imports))
+        runs.sort(key=lambda run: run[0])
+        total_us, imports = runs[len(runs) // 2]
+        print(f"[{module}] {total_us / 1000:.1f} ms to import ({len(imports)} modules)")
+        top_level = sorted((entry for entry in imports if entry[3] <= 1), key=lambda entry: -entry[2])
+        for name, _, cumulative, _ in top_level[:args.top]:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+        loaded = {name for name, _, _, _ in imports}
+        eager = [name for name in HEAVY_MODULES if name in loaded]
+        print(f"  Heavy modules imported at startup: {', '.join(eager) if eager else 'none'}")
+        if args.max_ms is not None and total_us / 1000 > args.max_ms:
+            print(f"  Startup regression: {total_us / 1000:.1f} ms is over the {args.max_ms:g} ms budget")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+
+def bench_service(args):
+    import asyncio
+    from chatdb_service import ChatDBService
+    from connection_pool import ConnectionPool
+
+    csv_path = os.path.join(tempfile.mkdtemp(), "bench_service.csv")
+    write_scaled_csv(csv_path, args.rows)
+    if args.mysql:
+        import pymysql
+        from simple_chatdb import db_config
+        pool = ConnectionPool(pymysql.connect, db_config, max_size=args.max_concurrency)
+    else:
+        pool = ConnectionPool(sqlite_standin.connect, {"path": csv_path[:-4] + ".db"}, max_size=args.max_concurrency)
+    from simple_chatdb import upload_csv_to_database
+    upload_csv_to_database(pool, csv_path, "bench_service")
+    endpoints = args.endpoints.split(",")
+
+    async def client(port, count, latencies, statuses):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        try:
+            for i in range(count):
+                endpoint = endpoints[i % len(endpoints)]
+                method, path, payload = SERVICE_REQUESTS[endpoint]
+                start = time.perf_counter()
+                status, _ = await http_json_request(reader, writer, method, path, payload)
+                latencies.setdefault(endpoint, []).append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    async def run():
+        service = ChatDBService(pool, max_concurrency=args.max_concurrency)
+        server = await service.start("127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        latencies, statuses = {}, {}
+        per_client = args.requests // args.concurrency
+        start = time.perf_counter()
+        await asyncio.gather(*(client(port, per_client, latencies, statuses) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+        await service.stop()
+        return latencies, statuses, elapsed
+
+    try:
+        latencies, statuses, elapsed = asyncio.run(run())
+    finally:
+        pool.close()
+        os.remove(csv_path)
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{total} requests from {args.concurrency} clients in {elapsed:.2f} s: {total / elapsed:,.0f} QPS")
+    print(f"Status codes: {statuses}")
+    for endpoint, values in sorted(latencies.items()):
+        values.sort()
+        p50 = values[len(values) // 2] * 1000
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))] * 1000
+        print(f"[{endpoint}] {len(values)} requests, p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ChatDB benchmarks")
+    parser.add_argument("--mysql", action="store_true", help="Run against the MySQL server in db_config instead of SQLite")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    ingest_parser = subparsers.add_parser("ingest", help="Row-by-row vs batched CSV ingestion")
+    ingest_parser.add_argument("--rows", type=int, default=30000)
+    ingest_parser.add_argument("--batch-size", type=int, default=1000)
+    ingest_parser.set_defaults(func=bench_ingest)
+
+    memory_parser = subparsers.add_parser("memory", help="Peak RSS of whole-file vs streaming CSV ingestion")
+    memory_parser.add_argument("--rows", type=int, default=1000000)
+    memory_parser.add_argument("--chunk-size", type=int, default=50000)
+    memory_parser.set_defaults(func=bench_memory)
+
+    worker_parser = subparsers.add_parser("memory-worker")
+    worker_parser.add_argument("--mode", choices=["whole_file", "streaming"], required=True)
+    worker_parser.add_argument("--csv", required=True)
+    worker_parser.add_argument("--chunk-size", type=int, default=50000)
+    worker_parser.set_defaults(func=memory_worker)
+
+    translator_parser = subparsers.add_parser("translator", help="Original vs compiled NL-to-SQL translator")
+    translator_parser.add_argument("--repeat", type=int, default=20)
+    translator_parser.set_defaults(func=bench_translator)
+
+    tokenizer_parser = subparsers.add_parser("tokenizer", help="Built-in regex tokenizer vs nltk.word_tokenize")
+    tokenizer_parser.add_argument("--repeat", type=int, default=200)
+    tokenizer_parser.set_defaults(func=bench_tokenizer)
+
+    indexes_parser = subparsers.add_parser("indexes", help="EXPLAIN and timings before/after the index advisor")
+    indexes_parser.add_argument("--rows", type=int, default=200000)
+    indexes_parser.add_argument("--repeat", type=int, default=5)
+    indexes_parser.set_defaults(func=bench_indexes)
+
+    schema_parser = subparsers.add_parser("schema", help="Original vs inferred column types")
+    schema_parser.add_argument("--rows", type=int, default=100000)
+    schema_parser.set_defaults(func=bench_schema)
+
+    backends_parser = subparsers.add_parser("backends", help="The same generated query corpus on several backends")
+    backends_parser.add_argument("--backends", default="sqlite,duckdb", help="Comma-separated: mysql, sqlite, duckdb")
+    backends_parser.add_argument("--rows", type=int, default=300000)
+    backends_parser.add_argument("--queries", type=int, default=200)
+    backends_parser.add_argument("--seed", type=int, default=7)
+    backends_parser.set_defaults(func=bench_backends)
+
+    service_parser = subparsers.add_parser("service", help="Load test of the HTTP/JSON service")
+    service_parser.add_argument("--rows", type=int, default=30000)
+    service_parser.add_argument("--requests", type=int, default=2000)
+    service_parser.add_argument("--concurrency", type=int, default=20)
+    service_parser.add_argument("--max-concurrency", type=int, default=8)
+    service_parser.add_argument("--endpoints", default="random,tables,explore,keyword",
+                                help=f"Comma-separated mix of: {', '.join(SERVICE_REQUESTS)}")
+    service_parser.set_defaults(func=bench_service)
+
+    cube_parser = subparsers.add_parser("cube", help="Aggregate queries answered from the cube vs SQL")
+    cube_parser.add_argument("--rows", type=int, default=300000)
+    cube_parser.add_argument("--queries", type=int, default=200)
+    cube_parser.add_argument("--seed", type=int, default=7)
+    cube_parser.add_argument("--pairs", action="store_true", help="Also pre-aggregate every pair of columns")
+    cube_parser.set_defaults(func=bench_cube)
+
+    approximate_parser = subparsers.add_parser("approximate", help="Exact vs sample-estimated aggregates")
+    approximate_parser.add_argument("--rows", type=int, default=1000000)
+    approximate_parser.add_argument("--sample-rows", type=int, default=20000)
+    approximate_parser.set_defaults(func=bench_approximate)
+
+    incremental_parser = subparsers.add_parser("incremental", help="Full reload vs incremental load of appended rows")
+    incremental_parser.add_argument("--rows", type=int, default=1000000)
+    incremental_parser.add_argument("--delta-rows", type=int, default=10000)
+    incremental_parser.set_defaults(func=bench_incremental)
+
+    workload_parser = subparsers.add_parser("workload", help="Seeded generated workload replayed on scaled-up data")
+    workload_parser.add_argument("--backends", default="sqlite,duckdb", help="Comma-separated: mysql, sqlite, duckdb")
+    workload_parser.add_argument("--rows", default="1M", help="Comma-separated row counts, e.g. 1M,10M,100M")
+    workload_parser.add_argument("--queries", type=int, default=500)
+    workload_parser.add_argument("--mix", default=None, help="Query type weights, e.g. where=3,group_by=1,aggregation=1")
+    workload_parser.add_argument("--seed", type=int, default=7)
+    workload_parser.add_argument("--concurrency", default="1,8", help="Comma-separated client thread counts")
+    workload_parser.add_argument("--indexes", default="none,advisor",
+                                 help="none, advisor (indexes the advisor recommends for the workload) or both")
+    workload_parser.add_argument("--warmup", type=int, default=20, help="Queries run once before measuring")
+    workload_parser.add_argument("--cache", action="store_true", help="Let the result cache answer repeated queries")
+    workload_parser.add_argument("--cube", action="store_true", help="Let the aggregate cube answer queries")
+    workload_parser.add_argument("--data-dir", default=None, help="Keep (and reuse) the synthetic CSV files here")
+    workload_parser.add_argument("--output", default="workload_results.json", help="JSON results file, or - for stdout")
+    workload_parser.add_argument("--compare", default=None, help="Results file of an earlier run to compare with")
+    workload_parser.set_defaults(func=bench_workload)
+
+    startup_parser = subparsers.add_parser("startup", help="Import time of the CLI and service entry modules")
+    startup_parser.add_argument("--modules", default="simple_chatdb,chatdb_service")
+    startup_parser.add_argument("--repeat", type=int, default=5)
+    startup_parser.add_argument("--top", type=int, default=8)
+    startup_parser.add_argument("--max-ms", type=float, default=None, help="Exit with an error above this import time")
+    startup_parser.set_defaults(func=bench_startup)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,327 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+import pymysql
+from aggregate_cube import cube_registry
+from backends import add_backend_arguments, get_backend
+from column_stats import column_statistics
+from connection_pool import PoolTimeoutError
+from csv_loader import table_exists
+from generate_sample_queries import VALID_KEYWORDS, generate_keyword_query, generate_sample_queries
+from handle_natural_language import plan_natural_language_query
+from incremental_ingest import incremental_load, is_tracked
+from instrumentation import PROFILERS, metrics
+from query_cache import result_cache, translation_cache
+from query_executor import execute_plan, plan_from_generated, stream_query
+from query_guard import QueryRejected, QueryTimeout, query_guard
+from schema_catalog import schema_catalog, visible_tables
+from simple_chatdb import upload_csv_to_database
+from snapshot_cache import snapshot_cache
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_QUEUE_TIMEOUT = 5
+DEFAULT_MAX_ROWS = 1000
+MAX_BODY_BYTES = 1024 * 1024
+
+TABLE_NAME_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+               503: "Service Unavailable", 504: "Gateway Timeout"}
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def require_table_name(value):
+    if not value or not TABLE_NAME_PATTERN.match(value):
+        raise RequestError(400, "A valid 'table' name is required.")
+    return value
+
+
+# Asyncio HTTP/JSON front end for ChatDB. Requests are parsed on the event loop; the existing blocking
+# functions (upload, query generation, translation, execution) run in a thread pool, each call holding a
+# pooled connection. At most max_concurrency requests run at once; others wait up to queue_timeout
+# seconds and then get a 503.
+class ChatDBService:
+    def __init__(self, pool, max_concurrency=DEFAULT_MAX_CONCURRENCY, queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 max_rows=DEFAULT_MAX_ROWS, upload_root=None):
+        self.pool = pool
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.max_rows = max_rows
+        self.upload_root = os.path.realpath(upload_root or os.getcwd())
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self.semaphore = None
+        self.server = None
+        self.routes = {
+            ("GET", "/tables"): self.list_tables,
+            ("GET", "/stats"): self.get_stats,
+            ("GET", "/metrics"): self.get_metrics,
+            ("POST", "/upload"): self.upload,
+            ("POST", "/query/random"): self.random_query,
+            ("POST", "/query/keyword"): self.keyword_query,
+            ("POST", "/query/natural"): self.natural_language_query,
+        }
+
+    async def start(self, host="127.0.0.1", port=8080):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=False)
+
+    # --- HTTP handling -------------------------------------------------------------------------
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line or request_line in (b"\r\n", b"\n"):
+                    break
+                method, target, version = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = headers.get("connection", "").lower() != "close" and version.strip() == "HTTP/1.1"
+                length = headers.get("content-length", "0")
+                # A body that is not read leaves the connection unusable, so it is closed after the error
+                if not length.isdigit():
+                    status, payload, keep_alive = 400, {"error": "Invalid Content-Length."}, False
+                elif int(length) > MAX_BODY_BYTES:
+                    status, payload, keep_alive = 413, {"error": "Request body too large."}, False
+                else:
+                    body = await reader.readexactly(int(length)) if int(length) else b""
+                    status, payload = await self.dispatch(method.upper(), target, body)
+
+                self.write_response(writer, status, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    # Payloads are sent as JSON, except text (the /metrics exposition) which is sent as is
+    def write_response(self, writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload, default=str).encode("utf-8"), "application/json"
+        headers = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                   f"Content-Type: {content_type}",
+                   f"Content-Length: {len(body)}",
+                   f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        writer.write(("\r\n".join(headers) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        try:
+            if body:
+                fields = json.loads(body)
+                if not isinstance(fields, dict):
+                    raise RequestError(400, "Request body must be a JSON object.")
+                params.update(fields)
+            handler = self.routes.get((method, path))
+            if handler is None and method == "GET" and path.startswith("/tables/"):
+                params["table"] = unquote(path[len("/tables/"):])
+                handler = self.explore_table
+            if handler is None:
+                known_paths = {route_path for _, route_path in self.routes}
+                return (405, {"error": f"{method} is not allowed on {path}."}) if path in known_paths \
+                    else (404, {"error": f"Unknown endpoint {path}."})
+            return 200, await self.run_blocking(handler, params)
+        except RequestError as e:
+            return e.status, {"error": str(e)}
+        except json.JSONDecodeError:
+            return 400, {"error": "Request body must be JSON."}
+        except PoolTimeoutError as e:
+            return 503, {"error": str(e)}
+        except QueryRejected as e:
+            return 422, {"error": str(e)}
+        except QueryTimeout as e:
+            return 504, {"error": str(e)}
+        except pymysql.MySQLError as e:
+            return 500, {"error": f"Database error: {e}"}
+        except Exception as e:
+            return 500, {"error": f"Error occurred: {e}"}
+
+    async def run_blocking(self, handler, params):
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise RequestError(503, "Too many concurrent requests; try again later.")
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self.run_traced, handler, params)
+        finally:
+            self.semaphore.release()
+
+    # Each call is one request in the metrics log (scrapes of /metrics excepted). A "profile" parameter
+    # of cprofile or pyinstrument profiles the call.
+    def run_traced(self, handler, params):
+        if handler == self.get_metrics:
+            return handler(params)
+        profile = params.get("profile")
+        with metrics.request(handler.__name__, profile=profile if profile in PROFILERS else None):
+            return handler(params)
+
+    # --- Endpoints (run in worker threads) -----------------------------------------------------
+
+    def list_tables(self, params):
+        with self.pool.connection() as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SHOW TABLES;")
+                return {"tables": visible_tables([row[0] for row in cursor.fetchall()])}
+
+    def explore_table(self, params):
+        table_name = require_table_name(params.get("table"))
+        with self.pool.connection() as connection:
+            table_schema = schema_catalog.get_table_schema(connection, table_name)
+            if not table_schema.columns:
+                raise RequestError(404, f"No columns found in the table {table_name}.")
+            # Read from the table's columnar snapshot when it has an up-to-date one
+            sample_rows = list(stream_query(connection, f"SELECT * FROM {table_name} LIMIT 5;", use_cache=False))
+        return {"table": table_name,
+                "columns": [{"name": column, "type": table_schema.column_types[column],
+                             "nullable": table_schema.nullable[column]} for column in table_schema.columns],
+                "indexes": table_schema.indexes,
+                "sample_rows": [list(row) for row in sample_rows]}
+
+    def upload(self, params):
+        table_name = require_table_name(params.get("table"))
+        csv_path = os.path.realpath(params.get("csv_path") or "")
+        if os.path.commonpath([csv_path, self.upload_root]) != self.upload_root or not os.path.isfile(csv_path):
+            raise RequestError(400, f"'csv_path' must be an existing CSV file under {self.upload_root}.")
+        # An optional sample_size keeps a sample of that many rows for approximate queries
+        sample_size = params.get("sample_size")
+        if sample_size is not None and (not isinstance(sample_size, int) or sample_size <= 0):
+            raise RequestError(400, "'sample_size' must be a positive integer.")
+        # "snapshot": true also writes a columnar snapshot of the table for fast exploration
+        snapshot = params.get("snapshot", False)
+        if not isinstance(snapshot, bool):
+            raise RequestError(400, "'snapshot' must be true or false.")
+        # "incremental": true loads only the rows not loaded from the file yet; rows matching an existing
+        # row on the optional key_columns replace it
+        if params.get("incremental"):
+            key_columns = params.get("key_columns") or []
+            if not isinstance(key_columns, list) or not all(TABLE_NAME_PATTERN.match(str(col)) for col in key_columns):
+                raise RequestError(400, "'key_columns' must be a list of column names.")
+            with self.pool.connection() as connection:
+                if table_exists(connection, table_name) and not is_tracked(connection, table_name):
+                    raise RequestError(422, f"'{table_name}' has rows that were not recorded when they were loaded, "
+                                            f"so an incremental load cannot tell which rows are new.")
+            result = incremental_load(self.pool, csv_path, table_name, key_columns or None)
+            if result is None:
+                raise RequestError(500, "Upload failed; see the server log for details.")
+            return dict(result, table=table_name)
+        rows_inserted = upload_csv_to_database(self.pool, csv_path, table_name, sample_rows=sample_size,
+                                               snapshot=snapshot)
+        if rows_inserted is None:
+            raise RequestError(500, "Upload failed; see the server log for details.")
+        return {"table": table_name, "rows_inserted": rows_inserted}
+
+    def random_query(self, params):
+        table_name = require_table_name(params.get("table"))
+        with self.pool.connection() as connection:
+            query_result = generate_sample_queries(connection, table_name, params.get("query_type"),
+                                                   params.get("aggregation_function"))
+            return self.execute(connection, plan_from_generated(query_result, source="random"),
+                                approximate=bool(params.get("approximate")))
+
+    def keyword_query(self, params):
+        table_name = require_table_name(params.get("table"))
+        keyword = (params.get("keyword") or "").lower()
+        if keyword not in VALID_KEYWORDS:
+            raise RequestError(400, f"'keyword' must be one of: {', '.join(VALID_KEYWORDS)}.")
+        with self.pool.connection() as connection:
+            query_result = generate_keyword_query(connection, table_name, keyword)
+            return self.execute(connection, plan_from_generated(query_result, source="keyword"),
+                                approximate=bool(params.get("approximate")))
+
+    def natural_language_query(self, params):
+        table_name = require_table_name(params.get("table"))
+        question = params.get("question")
+        if not question:
+            raise RequestError(400, "A 'question' is required.")
+        with self.pool.connection() as connection:
+            return self.execute(connection, plan_natural_language_query(connection, question, table_name),
+                                dict_rows=True, approximate=bool(params.get("approximate")))
+
+    # With approximate=True, SUM/COUNT/AVG queries on sampled tables return estimates with confidence
+    # intervals; clients repeat the request without it for the exact result
+    def execute(self, connection, plan, dict_rows=False, approximate=False):
+        if plan is None:
+            raise RequestError(400, "Failed to generate a query.")
+        result = execute_plan(connection, plan, dict_rows=dict_rows, max_rows=self.max_rows, approximate=approximate)
+        rows = [row if dict_rows else list(row) for row in result]
+        return {"sql": plan.sql, "params": plan.params, "description": plan.description, "rows": rows,
+                "row_count": result.rows_returned, "truncated": result.truncated, "from_cache": result.from_cache,
+                "from_cube": result.from_cube, "from_snapshot": result.from_snapshot,
+                "elapsed_ms": round(result.elapsed * 1000, 3),
+                "time_to_first_row_ms": round(result.time_to_first_row * 1000, 3) if rows else None,
+                "approximate": result.approximate,
+                "guard": result.guard_decision.action if result.guard_decision else None,
+                "estimated_rows": result.guard_decision.estimated_rows if result.guard_decision else None,
+                "sample_size": result.estimate.sample_rows if result.approximate else None,
+                "population_rows": result.estimate.population_rows if result.approximate else None}
+
+    def component_stats(self):
+        return {"pool": self.pool.stats(), "schema_catalog": schema_catalog.stats(),
+                "result_cache": result_cache.stats(), "translation_cache": translation_cache.stats(),
+                "aggregate_cube": cube_registry.stats(), "query_guard": query_guard.stats(),
+                "column_statistics": column_statistics.stats(),
+                "snapshot_cache": snapshot_cache.stats()}
+
+    def get_stats(self, params):
+        return dict(self.component_stats(), metrics=metrics.snapshot())
+
+    # Prometheus text format: request and stage latency histograms, counters and the component stats
+    def get_metrics(self, params):
+        return metrics.prometheus_text(self.component_stats())
+
+
+async def serve(pool, host, port, **service_options):
+    service = ChatDBService(pool, **service_options)
+    server = await service.start(host, port)
+    print(f"ChatDB service listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve ChatDB over HTTP/JSON")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY)
+    parser.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS)
+    parser.add_argument("--upload-root", default=None, help="Only CSV files under this directory can be uploaded")
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    pool = get_backend(args.backend, args.database).pool(max_size=args.max_concurrency)
+    try:
+        asyncio.run(serve(pool, args.host, args.port, max_concurrency=args.max_concurrency,
+                          max_rows=args.max_rows, upload_root=args.upload_root))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.close()
@@ -0,0 +1,427 @@
+import argparse
+import base64
+import copy
+import json
+import math
+import threading
+import time
+import pymysql
+from csv_loader import DEFAULT_CHUNK_SIZE, TEMPORAL_KINDS, TEMPORAL_STORAGE_FORMATS
+from instrumentation import metrics
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# One row per table column: counts, bounds, histogram, frequent values and distinct-count sketch
+STATS_TABLE = "chatdb_column_stats"
+# 2^12 HyperLogLog registers: about 1.6% standard error on distinct counts, 4 KB per column
+HLL_PRECISION = 12
+HISTOGRAM_BUCKETS = 16
+FREQUENT_VALUES = 10
+DEFAULT_TTL_SECONDS = 300
+# Generated and translated GROUP BYs expected to return more groups than this are avoided or limited
+MAX_GROUPS = 100
+ORDERED_KINDS = ["int", "float"] + TEMPORAL_KINDS
+
+
+# Column kind (as csv_loader profiles name them) of a type DESCRIBE reports, for tables profiled by the database
+def column_kind(column_type):
+    column_type = column_type.lower()
+    if column_type.startswith(("datetime", "timestamp")):
+        return "datetime"
+    if column_type.startswith("date"):
+        return "date"
+    if column_type.startswith("time"):
+        return "time"
+    if "int" in column_type:
+        return "int"
+    if column_type.startswith(("decimal", "numeric", "float", "double", "real")):
+        return "float"
+    return "str"
+
+
+# Values of an ordered column as float64 keys (dates and times in seconds), NaN for nulls. Accepts
+# loaded CSV chunks (dates as text) and rows read back from any backend (date, time and timedelta objects).
+def value_keys(values, kind):
+    if kind in ("int", "float"):
+        return pd.to_numeric(values, errors="coerce").astype("float64")
+    text = values.astype(str).where(values.notna())
+    if kind == "time":
+        # Clock times parse much faster as times of day; durations (MySQL's TIME as timedelta) are parsed apart
+        parsed = pd.to_datetime(text, errors="coerce", format="%H:%M:%S")
+        seconds = (parsed - parsed.dt.normalize()).dt.total_seconds()
+        durations = seconds.isna() & text.notna()
+        if durations.any():
+            seconds[durations] = pd.to_timedelta(text[durations], errors="coerce").dt.total_seconds()
+        return seconds
+    parsed = pd.to_datetime(text, errors="coerce", format="ISO8601")
+    return (parsed - pd.Timestamp(0)).dt.total_seconds()
+
+
+# Inverse of value_keys for one key: the value as it is written in SQL
+def key_value(key, kind):
+    if kind == "int":
+        return int(round(key))
+    if kind == "float":
+        return round(float(key), 6)
+    if kind == "time":
+        seconds = int(round(key))
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return (pd.Timestamp(0) + pd.Timedelta(seconds=round(key))).strftime(TEMPORAL_STORAGE_FORMATS[kind])
+
+
+# Distinct-count sketch: each value's 64-bit hash picks a register with its top bits and the register
+# keeps the longest run of leading zeros seen in the remaining bits. Sketches merge by taking the
+# maximum of each register, so the count stays correct across chunks and appended files.
+class HyperLogLog:
+    def __init__(self, precision=HLL_PRECISION, registers=None):
+        self.precision = precision
+        self.registers = registers if registers is not None else np.zeros(1 << precision, dtype="uint8")
+
+    def add_hashes(self, hashes):
+        if not len(hashes):
+            return
+        rest_bits = 64 - self.precision
+        index = (hashes >> np.uint64(rest_bits)).astype("int64")
+        rest = hashes & np.uint64((1 << rest_bits) - 1)
+        # frexp gives the bit length of the rest, which fits a float64 exactly; 0 gets the longest run
+        _, bit_length = np.frexp(rest.astype("float64"))
+        np.maximum.at(self.registers, index, (rest_bits - bit_length + 1).astype("uint8"))
+
+    def merge(self, other):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self):
+        registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / registers)
+        raw = alpha * registers * registers / np.sum(np.ldexp(1.0, -self.registers.astype("int64")))
+        empty = int(np.count_nonzero(self.registers == 0))
+        # Small counts leave registers empty; linear counting is more accurate for them
+        if raw <= 2.5 * registers and empty:
+            return int(round(registers * math.log(registers / empty)))
+        return int(round(raw))
+
+    def to_text(self):
+        return base64.b64encode(self.registers.tobytes()).decode("ascii")
+
+    @classmethod
+    def from_text(cls, text, precision=HLL_PRECISION):
+        return cls(precision, np.frombuffer(base64.b64decode(text), dtype="uint8").copy())
+
+
+# Cut an equi-depth histogram (bucket bounds holding the same number of values each) from keys
+def histogram_bounds(keys, buckets=HISTOGRAM_BUCKETS):
+    return np.quantile(keys, np.linspace(0, 1, buckets + 1), method="inverted_cdf")
+
+
+# Merge two equi-depth histograms of first_count and second_count values. Each histogram's CDF is
+# taken as linear inside its buckets; the combined CDF is weighted by the counts and cut again.
+def merge_histograms(first, first_count, second, second_count, buckets=HISTOGRAM_BUCKETS):
+    if first is None or not first_count:
+        return second
+    if second is None or not second_count:
+        return first
+    points = np.union1d(first, second)
+    depths = np.linspace(0, 1, buckets + 1)
+    cdf = (first_count * np.interp(points, first, depths)
+           + second_count * np.interp(points, second, depths)) / (first_count + second_count)
+    return np.interp(depths, cdf, points)
+
+
+# Statistics of one column: row and null counts, min/max, an equi-depth histogram (ordered kinds), the
+# most frequent values and a HyperLogLog distinct count. Bounds and histogram are held as value_keys.
+class ColumnStats:
+    def __init__(self, column, kind):
+        self.column = column
+        self.kind = kind if kind in ORDERED_KINDS else "str"
+        self.row_count = 0
+        self.null_count = 0
+        self.min_key = None
+        self.max_key = None
+        self.histogram = None
+        self.frequent = {}
+        self.sketch = HyperLogLog()
+
+    @property
+    def ordered(self):
+        return self.kind in ORDERED_KINDS
+
+    @property
+    def distinct_count(self):
+        return min(self.sketch.estimate(), self.row_count - self.null_count)
+
+    @property
+    def min_value(self):
+        return self.value(self.min_key)
+
+    @property
+    def max_value(self):
+        return self.value(self.max_key)
+
+    def value(self, key):
+        if key is None or not self.ordered:
+            return key
+        return key_value(key, self.kind)
+
+    # Fold one chunk of the column's values (a Series) into the statistics
+    def update(self, values):
+        keys = value_keys(values, self.kind) if self.ordered else values.astype(str).where(values.notna())
+        present = keys.dropna()
+        self.row_count += len(keys)
+        self.null_count += len(keys) - len(present)
+        if present.empty:
+            return
+        self.sketch.add_hashes(pd.util.hash_array(present.to_numpy()))
+        if self.ordered:
+            chunk_histogram = histogram_bounds(present.to_numpy())
+            self.histogram = merge_histograms(self.histogram, self.row_count - self.null_count - len(present),
+                                              chunk_histogram, len(present))
+        low, high = present.min(), present.max()
+        self.min_key = low if self.min_key is None else min(self.min_key, low)
+        self.max_key = high if self.max_key is None else max(self.max_key, high)
+        # Counts of values that fall out of the top list in one chunk are lost, so they are approximate
+        for key, count in present.value_counts().head(FREQUENT_VALUES).items():
+            self.frequent[key] = self.frequent.get(key, 0) + int(count)
+        self.frequent = dict(sorted(self.frequent.items(), key=lambda item: -item[1])[:FREQUENT_VALUES])
+
+    # Value at quantile q (0..1) of the non-null values, read off the histogram
+    def quantile_value(self, q):
+        if self.histogram is None:
+            return None
+        return self.value(float(np.interp(q, np.linspace(0, 1, len(self.histogram)), self.histogram)))
+
+    def frequent_values(self):
+        return [self.value(key) for key in self.frequent]
+
+    # Selectivity of "column = value": the value's share when it is a frequent one, otherwise an even
+    # share of the rows the frequent values leave
+    def equality_selectivity(self, value):
+        present = self.row_count - self.null_count
+        if not present:
+            return 0.0
+        for key, count in self.frequent.items():
+            if self.value(key) == value:
+                return count / self.row_count
+        others = max(self.distinct_count - len(self.frequent), 1)
+        return max(present - sum(self.frequent.values()), 0) / others / self.row_count
+
+    # The stored spelling of a value typed in a question: string comparisons are case-sensitive on some
+    # backends and questions are lowercased before they are translated
+    def stored_value(self, value):
+        if self.ordered or not isinstance(value, str):
+            return value
+        for key in self.frequent:
+            if key.lower() == value.lower():
+                return key
+        return value
+
+    # A realistic comparison value for operator: frequent values for (in)equality and LIKE prefixes,
+    # values from the upper or lower quarter of the histogram for range operators, so generated
+    # predicates match a modest share of rows instead of none or all of them
+    def predicate_value(self, operator, rng):
+        frequent = self.frequent_values()
+        if operator in ("=", "!=") and frequent:
+            return rng.choice(frequent)
+        if operator == "LIKE" and frequent:
+            value = str(rng.choice(frequent))
+            return value[:max(1, len(value) // 2)] + "%"
+        if operator in (">", ">="):
+            return self.quantile_value(rng.uniform(0.75, 0.95))
+        if operator in ("<", "<="):
+            return self.quantile_value(rng.uniform(0.05, 0.25))
+        return self.quantile_value(rng.random())
+
+    def as_row(self, table_name):
+        histogram = [self.value(key) for key in self.histogram] if self.histogram is not None else None
+        frequent = [[self.value(key), count] for key, count in self.frequent.items()]
+        return (table_name.lower(), self.column, self.kind, self.row_count, self.null_count, self.distinct_count,
+                None if self.min_key is None else str(self.min_value)[:255],
+                None if self.max_key is None else str(self.max_value)[:255],
+                json.dumps(histogram), json.dumps(frequent), self.sketch.to_text())
+
+    @classmethod
+    def from_row(cls, row):
+        column, kind, row_count, null_count, _, min_value, max_value, histogram, frequent, sketch = row
+        stats = cls(column, kind)
+        stats.row_count, stats.null_count = int(row_count), int(null_count)
+        keys = (lambda values: value_keys(pd.Series(values, dtype=object), stats.kind).tolist()) if stats.ordered \
+            else (lambda values: list(values))
+        if min_value is not None:
+            stats.min_key, stats.max_key = keys([min_value, max_value])
+        histogram = json.loads(histogram) if histogram else None
+        if histogram:
+            stats.histogram = np.array(keys(histogram), dtype="float64")
+        frequent = json.loads(frequent) if frequent else []
+        stats.frequent = dict(zip(keys([value for value, _ in frequent]), [count for _, count in frequent]))
+        stats.sketch = HyperLogLog.from_text(sketch)
+        return stats
+
+
+# Statistics of every column of a table, updated chunk by chunk as rows are loaded
+class TableStats:
+    def __init__(self, table_name, kinds):
+        self.table_name = table_name
+        self.columns = {col: ColumnStats(col, kind) for col, kind in kinds.items()}
+        self.updated_at = None
+
+    @property
+    def row_count(self):
+        return max((stats.row_count for stats in self.columns.values()), default=0)
+
+    # Changes whenever the statistics are saved, so translations made with older ones are not reused
+    @property
+    def version(self):
+        return f"{self.row_count}:{self.updated_at}"
+
+    def get(self, column):
+        return self.columns.get(column)
+
+    # An independent copy a load can update while readers keep using this one
+    def copy(self):
+        return copy.deepcopy(self)
+
+    def update(self, chunk):
+        for col, stats in self.columns.items():
+            if col in chunk:
+                stats.update(chunk[col])
+
+    # Expected number of groups of a GROUP BY over columns: the product of their distinct counts,
+    # at most one group per row
+    def group_count(self, columns):
+        counts = [self.columns[col].distinct_count for col in columns if col in self.columns]
+        if len(counts) < len(columns):
+            return None
+        return min(math.prod(counts), self.row_count)
+
+
+def load_table_stats(connection, table_name):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT column_name, kind, row_count, null_count, distinct_count, min_value, max_value, "
+                           f"histogram, frequent_values, sketch, updated_at FROM {STATS_TABLE} "
+                           f"WHERE table_name = %s;", (table_name.lower(),))
+            rows = cursor.fetchall()
+    except pymysql.MySQLError:
+        return None
+    if not rows:
+        return None
+    table_stats = TableStats(table_name, {})
+    table_stats.columns = {row[0]: ColumnStats.from_row(row[:10]) for row in rows}
+    table_stats.updated_at = float(rows[0][10])
+    return table_stats
+
+
+def save_table_stats(connection, table_stats):
+    table_stats.updated_at = round(time.time(), 3)
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {STATS_TABLE} (table_name VARCHAR(64) NOT NULL, "
+                       f"column_name VARCHAR(64) NOT NULL, kind VARCHAR(16) NOT NULL, row_count BIGINT NOT NULL, "
+                       f"null_count BIGINT NOT NULL, distinct_count BIGINT NOT NULL, min_value VARCHAR(255), "
+                       f"max_value VARCHAR(255), histogram TEXT, frequent_values TEXT, sketch TEXT NOT NULL, "
+                       f"updated_at DOUBLE NOT NULL, PRIMARY KEY (table_name, column_name));")
+        cursor.execute(f"DELETE FROM {STATS_TABLE} WHERE table_name = %s;", (table_stats.table_name.lower(),))
+        cursor.executemany(f"INSERT INTO {STATS_TABLE} (table_name, column_name, kind, row_count, null_count, "
+                           f"distinct_count, min_value, max_value, histogram, frequent_values, sketch, updated_at) "
+                           f"VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);",
+                           [stats.as_row(table_stats.table_name) + (table_stats.updated_at,)
+                            for stats in table_stats.columns.values()])
+    connection.commit()
+
+
+# Caches each table's statistics (with a TTL, like the schema catalog) for the query generators and
+# the translator, and keeps the sidecar table up to date as rows are loaded
+class StatisticsCatalog:
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # The table's statistics, or None if they were never collected
+    def get_table_stats(self, connection, table_name):
+        key = table_name.lower()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        table_stats = load_table_stats(connection, table_name)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), table_stats)
+        return table_stats
+
+    # The statistics a load into table_name should update: new ones for a new table, a copy of the saved
+    # ones when rows with the same columns are appended, or None when they have to be collected from the
+    # table. The cached statistics are never changed in place, so other threads never see them half
+    # updated; save() swaps in the updated copy.
+    def stats_for_load(self, connection, table_name, columns, profiles, table_existed):
+        if not table_existed:
+            return TableStats(table_name, {col: profiles[col].kind if col in profiles else "str" for col in columns})
+        table_stats = self.get_table_stats(connection, table_name)
+        if table_stats is not None and all(col in table_stats.columns for col in columns):
+            return table_stats.copy()
+        return None
+
+    def save(self, connection, table_stats):
+        with metrics.stage("stats.save"):
+            save_table_stats(connection, table_stats)
+        with self._lock:
+            self._entries[table_stats.table_name.lower()] = (time.monotonic(), table_stats)
+
+    # Recompute a table's statistics from all of its rows, for tables loaded before statistics were
+    # kept and after rows were replaced
+    def collect(self, connection, table_name, fetch_size=DEFAULT_CHUNK_SIZE):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DESCRIBE {table_name}")
+            kinds = {row[0]: column_kind(row[1]) for row in cursor.fetchall()}
+        table_stats = TableStats(table_name, kinds)
+        columns = list(kinds)
+        with metrics.stage("stats.collect"):
+            with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute(f"SELECT {', '.join(columns)} FROM {table_name};")
+                while True:
+                    batch = cursor.fetchmany(fetch_size)
+                    if not batch:
+                        break
+                    table_stats.update(pd.DataFrame(list(batch), columns=columns))
+        self.save(connection, table_stats)
+        return table_stats
+
+    def invalidate(self, table_name=None):
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(table_name.lower(), None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "cached_tables": len(self._entries)}
+
+
+# Shared catalog fed by the CSV loaders and read by generate_sample_queries and handle_natural_language
+column_statistics = StatisticsCatalog()
+
+
+def print_table_stats(table_stats):
+    print(f"Statistics of '{table_stats.table_name}' ({table_stats.row_count} rows):")
+    for col, stats in table_stats.columns.items():
+        print(f"  {col} ({stats.kind}): {stats.null_count} nulls, ~{stats.distinct_count} distinct, "
+              f"min {stats.min_value}, max {stats.max_value}")
+
+
+# Recollect a table's statistics, e.g. python column_stats.py costco --backend duckdb --database costco.duckdb
+if __name__ == "__main__":
+    from backends import add_backend_arguments, get_backend
+    parser = argparse.ArgumentParser(description="Collect ChatDB column statistics for a table.")
+    parser.add_argument("table")
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+    connection = get_backend(args.backend, args.database).connect()
+    try:
+        print_table_stats(column_statistics.collect(connection, args.table))
+    finally:
+        connection.close()
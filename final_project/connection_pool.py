@@ -0,0 +1,173 @@
+import functools
+import inspect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from lazy_imports import lazy_import
+
+# Loaded on first use, so importing the pool (e.g. for pool_aware) does not import the MySQL driver
+pymysql = lazy_import("pymysql")
+
+DEFAULT_MIN_SIZE = 1
+DEFAULT_MAX_SIZE = 10
+DEFAULT_CHECKOUT_TIMEOUT = 30
+# Idle connections older than this are pinged before being handed out
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+# Thread-safe pool of database connections. Connections are created lazily up to max_size, kept
+# open between checkouts, pinged (with reconnect) when they have been idle for a while, and rolled
+# back on release so no transaction leaks into the next checkout. init_statements run once per
+# physical connection (e.g. session settings), so they are reused by every checkout instead of
+# being sent per request; pymysql has no server-side prepared statements to reuse beyond that.
+# connect_function defaults to pymysql.connect.
+class ConnectionPool:
+    def __init__(self, connect_function=None, connect_kwargs=None, min_size=DEFAULT_MIN_SIZE,
+                 max_size=DEFAULT_MAX_SIZE, checkout_timeout=DEFAULT_CHECKOUT_TIMEOUT,
+                 health_check_interval=DEFAULT_HEALTH_CHECK_INTERVAL, init_statements=()):
+        self.connect_function = connect_function or pymysql.connect
+        self.connect_kwargs = connect_kwargs or {}
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self.init_statements = list(init_statements)
+        self._idle = deque()
+        self._size = 0
+        self._condition = threading.Condition()
+        self._closed = False
+        self.created = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+
+        for _ in range(min_size):
+            self._idle.append((self._create(), time.monotonic()))
+            self._size += 1
+
+    def _create(self):
+        connection = self.connect_function(**self.connect_kwargs)
+        if self.init_statements:
+            with connection.cursor() as cursor:
+                for statement in self.init_statements:
+                    cursor.execute(statement)
+            connection.commit()
+        self.created += 1
+        return connection
+
+    def _is_healthy(self, connection, idle_since):
+        if not getattr(connection, "open", True):
+            return False
+        if time.monotonic() - idle_since < self.health_check_interval:
+            return True
+        try:
+            connection.ping(reconnect=True)
+            return True
+        except pymysql.MySQLError:
+            return False
+
+    def acquire(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("The connection pool is closed.")
+                if self._idle:
+                    connection, idle_since = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    connection, idle_since = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeoutError(f"No connection available within {timeout} seconds.")
+                self._condition.wait(remaining)
+            self.checkouts += 1
+
+        try:
+            if connection is not None and not self._is_healthy(connection, idle_since):
+                self._close_quietly(connection)
+                self.discarded += 1
+                connection = None
+            if connection is None:
+                connection = self._create()
+        except Exception:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        return connection
+
+    def release(self, connection, discard=False):
+        if not discard:
+            try:
+                connection.rollback()
+            except pymysql.MySQLError:
+                discard = True
+        with self._condition:
+            if discard or self._closed:
+                self._size -= 1
+                self.discarded += 1
+                self._close_quietly(connection)
+            else:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        connection = self.acquire(timeout)
+        discard = False
+        try:
+            yield connection
+        except pymysql.err.OperationalError:
+            # Lost or broken connections are not returned to the pool
+            discard = True
+            raise
+        finally:
+            self.release(connection, discard)
+
+    def _close_quietly(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                connection, _ = self._idle.pop()
+                self._size -= 1
+                self._close_quietly(connection)
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            return {"size": self._size, "idle": len(self._idle), "in_use": self._size - len(self._idle),
+                    "max_size": self.max_size, "created": self.created, "checkouts": self.checkouts,
+                    "timeouts": self.timeouts, "discarded": self.discarded}
+
+
+# Lets a function that takes a `connection` argument also be called with a ConnectionPool: a
+# connection is checked out for the duration of the call and returned afterwards.
+def pool_aware(function):
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        pool = bound.arguments.get("connection")
+        if not isinstance(pool, ConnectionPool):
+            return function(*args, **kwargs)
+        with pool.connection() as connection:
+            bound.arguments["connection"] = connection
+            return function(*bound.args, **bound.kwargs)
+    return wrapper
@@ -0,0 +1,435 @@
+import re
+import time
+import pymysql
+from lazy_imports import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_CHUNK_SIZE = 50000
+SCHEMA_SAMPLE_ROWS = 10000
+
+# Column kinds ordered from narrowest to widest; a column is only ever widened while scanning
+KIND_ORDER = ["int", "float", "str"]
+TEMPORAL_KINDS = ["date", "time", "datetime"]
+
+# Text formats recognised as dates and times, tried in order on a sample of each text column. The
+# MySQL STR_TO_DATE spelling of each format is derived for LOAD DATA.
+TEMPORAL_FORMATS = [
+    ("datetime", "%Y-%m-%d %H:%M:%S"), ("datetime", "%Y-%m-%dT%H:%M:%S"), ("datetime", "%m/%d/%Y %H:%M:%S"),
+    ("datetime", "%m/%d/%Y %H:%M"), ("datetime", "%m/%d/%y %H:%M"),
+    ("date", "%Y-%m-%d"), ("date", "%m/%d/%Y"), ("date", "%m/%d/%y"), ("date", "%d/%m/%Y"), ("date", "%d/%m/%y"),
+    ("date", "%d.%m.%Y"), ("date", "%Y/%m/%d"),
+    ("time", "%H:%M:%S"), ("time", "%H:%M"),
+]
+TEMPORAL_STORAGE_FORMATS = {"date": "%Y-%m-%d", "time": "%H:%M:%S", "datetime": "%Y-%m-%d %H:%M:%S"}
+MYSQL_FORMAT_CODES = {"%M": "%i", "%S": "%s"}
+FORMAT_DETECTION_VALUES = 1000
+
+# Signed integer types from narrowest to widest with their bit widths
+INTEGER_TYPES = [("TINYINT", 8), ("SMALLINT", 16), ("MEDIUMINT", 24), ("INT", 32), ("BIGINT", 64)]
+# Integer columns are at least INT and decimals keep at least this many integer digits, so rows appended
+# later with larger values than the first file's still fit
+MIN_INTEGER_TYPE = "INT"
+MIN_DECIMAL_INTEGER_DIGITS = 10
+MAX_DECIMAL_SCALE = 6
+MAX_DECIMAL_PRECISION = 65
+# Text columns whose values all have the same short length become CHAR(n); ones with only a few
+# distinct values (relative to the row count) become ENUMs
+MAX_CHAR_LENGTH = 16
+ENUM_MAX_VALUES = 16
+ENUM_MIN_ROWS_PER_VALUE = 10
+MIN_VARCHAR_LENGTH = 32
+
+
+def detect_temporal_format(strings):
+    sample = strings.drop_duplicates().head(FORMAT_DETECTION_VALUES)
+    for kind, value_format in TEMPORAL_FORMATS:
+        if pd.to_datetime(sample, format=value_format, errors="coerce").notna().all():
+            return kind, value_format
+    return None, None
+
+
+def matches_format(strings, value_format):
+    return bool(pd.to_datetime(strings, format=value_format, errors="coerce").notna().all())
+
+
+def mysql_date_format(value_format):
+    return re.sub(r"%\w", lambda match: MYSQL_FORMAT_CODES.get(match.group(), match.group()), value_format)
+
+
+# Smallest number of decimal places that represents every value exactly, or None for more than
+# MAX_DECIMAL_SCALE (such columns are stored as DOUBLE)
+def decimal_scale(values):
+    for scale in range(MAX_DECIMAL_SCALE + 1):
+        scaled = values * 10 ** scale
+        if ((scaled - scaled.round()).abs() < 1e-6).all():
+            return scale
+    return None
+
+
+# Running statistics for one CSV column, updated chunk by chunk: the widest kind seen, the date/time
+# format, numeric range and scale, string lengths and the distinct values while there are few of them.
+class ColumnProfile:
+    def __init__(self):
+        self.kind = None
+        self.value_format = None
+        self.min_value = None
+        self.max_value = None
+        self.integer_digits = 0
+        self.scale = 0
+        self.min_length = None
+        self.max_length = 0
+        self.distinct_values = set()
+        self.row_count = 0
+        self.null_count = 0
+
+    def observe(self, series):
+        self.row_count += len(series)
+        values = series.dropna()
+        self.null_count += len(series) - len(values)
+        if values.empty:
+            return
+        if pd.api.types.is_bool_dtype(values):
+            self._observe_strings(values.astype(str))
+        elif pd.api.types.is_integer_dtype(values):
+            self._observe_numbers(values, "int")
+        elif pd.api.types.is_float_dtype(values):
+            # Integer columns with missing values are read as floats
+            is_integral = bool((values == values.round()).all()) and values.abs().max() < 2 ** 63
+            self._observe_numbers(values, "int" if is_integral else "float")
+        else:
+            self._observe_strings(values.astype(str))
+
+    def _observe_numbers(self, values, kind):
+        low, high = values.min(), values.max()
+        self.min_value = low if self.min_value is None else min(self.min_value, low)
+        self.max_value = high if self.max_value is None else max(self.max_value, high)
+        self.integer_digits = max(self.integer_digits, len(str(int(max(abs(low), abs(high))))))
+        if kind == "float" and self.scale is not None:
+            scale = decimal_scale(values)
+            self.scale = None if scale is None else max(self.scale, scale)
+        self._widen(kind)
+
+    def _observe_strings(self, strings):
+        lengths = strings.str.len()
+        self.max_length = max(self.max_length, int(lengths.max()))
+        self.min_length = int(lengths.min()) if self.min_length is None else min(self.min_length, int(lengths.min()))
+        if self.distinct_values is not None:
+            self.distinct_values.update(strings.unique())
+            if len(self.distinct_values) > ENUM_MAX_VALUES:
+                self.distinct_values = None
+
+        if self.kind is None:
+            kind, self.value_format = detect_temporal_format(strings)
+            if kind and matches_format(strings, self.value_format):
+                self.kind = kind
+                return
+        elif self.kind in TEMPORAL_KINDS and matches_format(strings, self.value_format):
+            return
+        self._widen("str")
+
+    def _widen(self, observed):
+        if self.kind is None or self.kind == observed:
+            self.kind = observed
+        elif self.kind in TEMPORAL_KINDS or observed in TEMPORAL_KINDS:
+            self.kind = "str"
+        else:
+            self.kind = max(self.kind, observed, key=KIND_ORDER.index)
+        if self.kind == "str":
+            self.value_format = None
+
+    # Combine with the profile of the same column in another file
+    def merge(self, other):
+        merged = ColumnProfile()
+        for profile in (self, other):
+            if profile.kind is None:
+                continue
+            if merged.kind is None:
+                merged.kind, merged.value_format = profile.kind, profile.value_format
+            elif merged.kind in TEMPORAL_KINDS and merged.value_format != profile.value_format:
+                merged._widen("str")
+            else:
+                merged._widen(profile.kind)
+        numeric = [profile for profile in (self, other) if profile.min_value is not None]
+        if numeric:
+            merged.min_value = min(profile.min_value for profile in numeric)
+            merged.max_value = max(profile.max_value for profile in numeric)
+        merged.integer_digits = max(self.integer_digits, other.integer_digits)
+        merged.scale = None if self.scale is None or other.scale is None else max(self.scale, other.scale)
+        lengths = [profile.min_length for profile in (self, other) if profile.min_length is not None]
+        merged.min_length = min(lengths) if lengths else None
+        merged.max_length = max(self.max_length, other.max_length)
+        if self.distinct_values is None or other.distinct_values is None:
+            merged.distinct_values = None
+        else:
+            merged.distinct_values = self.distinct_values | other.distinct_values
+            if len(merged.distinct_values) > ENUM_MAX_VALUES:
+                merged.distinct_values = None
+        merged.row_count = self.row_count + other.row_count
+        merged.null_count = self.null_count + other.null_count
+        return merged
+
+    def column_type(self):
+        if self.kind == "int":
+            return integer_type(self.min_value, self.max_value)
+        if self.kind == "float":
+            precision = max(self.integer_digits, MIN_DECIMAL_INTEGER_DIGITS) + (self.scale or 0)
+            if self.scale is None or precision > MAX_DECIMAL_PRECISION:
+                return "DOUBLE"
+            return f"DECIMAL({precision}, {self.scale})"
+        if self.kind in TEMPORAL_KINDS:
+            return self.kind.upper()
+        if self.kind is None:
+            return "VARCHAR(255)"
+
+        max_length = self.max_length
+        if self.min_value is not None:
+            # Numbers seen before the column turned out to be text
+            max_length = max(max_length, self.integer_digits + (self.scale or 0) + 2)
+        non_null_count = self.row_count - self.null_count
+        if self.min_length == max_length and max_length <= MAX_CHAR_LENGTH:
+            return f"CHAR({max_length})"
+        if (self.distinct_values is not None and self.min_value is None
+                and len(self.distinct_values) * ENUM_MIN_ROWS_PER_VALUE <= non_null_count):
+            # Declared in sorted order so ORDER BY on the ENUM matches the text order
+            values = ", ".join("'" + value.replace("\\", "\\\\").replace("'", "''") + "'"
+                               for value in sorted(self.distinct_values))
+            return f"ENUM({values})"
+        return f"VARCHAR({max(MIN_VARCHAR_LENGTH, 1 << (max_length - 1).bit_length())})"
+
+
+def integer_type(min_value, max_value):
+    start = [type_name for type_name, _ in INTEGER_TYPES].index(MIN_INTEGER_TYPE)
+    for type_name, bits in INTEGER_TYPES[start:]:
+        if -(2 ** (bits - 1)) <= min_value and max_value < 2 ** (bits - 1):
+            return type_name
+    return "BIGINT"
+
+
+def iter_csv_chunks(csv_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    yield from pd.read_csv(csv_path, chunksize=chunk_size)
+
+
+# Read the header from a bounded sample, then stream the file once, updating a ColumnProfile per
+# column chunk by chunk, so memory stays flat regardless of file size.
+def infer_column_profiles(csv_path, sample_rows=SCHEMA_SAMPLE_ROWS, chunk_size=DEFAULT_CHUNK_SIZE):
+    sample = pd.read_csv(csv_path, nrows=sample_rows)
+    if sample.empty:
+        return None, None
+
+    columns = list(sample.columns)
+    profiles = {col: ColumnProfile() for col in columns}
+    for chunk in iter_csv_chunks(csv_path, chunk_size):
+        for col in columns:
+            profiles[col].observe(chunk[col])
+    return columns, profiles
+
+
+# Combine the inferred schemas of several files that load into the same table
+def merge_column_profiles(schemas):
+    columns, profiles = [], {}
+    for file_columns, file_profiles in schemas:
+        for col in file_columns:
+            if col not in profiles:
+                columns.append(col)
+                profiles[col] = file_profiles[col]
+            else:
+                profiles[col] = profiles[col].merge(file_profiles[col])
+    return columns, profiles
+
+
+def build_column_definitions(columns, profiles):
+    column_definitions = ["id INT AUTO_INCREMENT PRIMARY KEY"]
+    for col in columns:
+        column_definitions.append(f"{col} {profiles[col].column_type()}")
+    return column_definitions
+
+
+def infer_column_definitions(csv_path, sample_rows=SCHEMA_SAMPLE_ROWS, chunk_size=DEFAULT_CHUNK_SIZE):
+    columns, profiles = infer_column_profiles(csv_path, sample_rows, chunk_size)
+    if not columns:
+        return None, None, None
+    return columns, build_column_definitions(columns, profiles), profiles
+
+
+# Rewrite date/time text into the canonical form the inferred DATE/TIME/DATETIME columns expect
+# Parsed dates and times as TEMPORAL_STORAGE_FORMATS text, cut from NumPy's ISO 8601 rendering
+# (YYYY-MM-DDTHH:MM:SS), which is much faster than strftime. Unparseable values become None.
+def format_temporal(parsed, kind):
+    iso = parsed.to_numpy(dtype="datetime64[s]").astype(str)
+    if kind == "date":
+        text = iso.astype("U10")
+    elif kind == "time":
+        text = np.char.partition(iso, "T")[:, 2]
+    else:
+        text = np.char.replace(iso, "T", " ")
+    return np.where(parsed.isna().to_numpy(), None, text.astype(object))
+
+
+# Date/time text is parsed and reformatted once per distinct value, which is far fewer than the rows
+def convert_chunk(chunk, profiles):
+    for col, profile in profiles.items():
+        if profile.kind in TEMPORAL_KINDS and col in chunk:
+            codes, uniques = pd.factorize(chunk[col])
+            parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format=profile.value_format, errors="coerce")
+            # Missing values have code -1, which picks the trailing None
+            formatted = np.append(format_temporal(parsed, profile.kind), None)
+            chunk[col] = pd.Series(formatted[codes], index=chunk.index, dtype=object)
+    return chunk
+
+
+def iter_converted_chunks(chunks, profiles):
+    for chunk in chunks:
+        yield convert_chunk(chunk, profiles)
+
+
+# A loaded CSV file's rows as they are stored in the table: converted, with the constant columns added
+# and reindexed to the table's columns (files loaded into one table may each have only some of them)
+def iter_loaded_chunks(csv_path, profiles, columns, constants=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    for chunk in iter_converted_chunks(iter_csv_chunks(csv_path, chunk_size), profiles):
+        if constants:
+            chunk = chunk.assign(**constants)
+        yield chunk.reindex(columns=columns)
+
+
+# Convert a DataFrame into plain Python tuples with NaN/NaT mapped to None
+def dataframe_rows(df):
+    values = df.astype(object).where(pd.notna(df), None)
+    return list(values.itertuples(index=False, name=None))
+
+
+# Generator pipeline: CSV chunks -> Python row tuples -> fixed-size insert batches
+def iter_row_batches(chunks, batch_size=DEFAULT_BATCH_SIZE):
+    batch = []
+    for chunk in chunks:
+        for row_values in dataframe_rows(chunk):
+            batch.append(row_values)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def build_insert_query(table_name, columns):
+    return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))});"
+
+
+# Original row-by-row path, kept for comparison in the ingest benchmark
+def insert_rows_individually(connection, insert_query, rows):
+    rows_inserted = 0
+    failed_rows = []
+    with connection.cursor() as cursor:
+        for row_values in rows:
+            try:
+                cursor.execute(insert_query, row_values)
+                rows_inserted += 1
+            except pymysql.MySQLError as e:
+                print(f"Failed to insert row: {row_values}. Error: {e}")
+                failed_rows.append(row_values)
+    connection.commit()
+    return rows_inserted, failed_rows
+
+
+# Send rows as multi-row executemany batches. When a batch fails, only that batch is
+# retried row by row so bad rows are skipped and reported while the rest still load.
+def insert_batches(connection, insert_query, batches):
+    rows_inserted = 0
+    failed_rows = []
+    with connection.cursor() as cursor:
+        for batch in batches:
+            try:
+                cursor.executemany(insert_query, batch)
+                rows_inserted += len(batch)
+            except pymysql.MySQLError:
+                # Embedded backends keep the rows inserted before the failing one; undo them first
+                connection.rollback()
+                for row_values in batch:
+                    try:
+                        cursor.execute(insert_query, row_values)
+                        rows_inserted += 1
+                    except pymysql.MySQLError as e:
+                        print(f"Failed to insert row: {row_values}. Error: {e}")
+                        failed_rows.append(row_values)
+            connection.commit()
+    return rows_inserted, failed_rows
+
+
+def insert_rows_in_batches(connection, insert_query, rows, batch_size=DEFAULT_BATCH_SIZE):
+    batches = (rows[start:start + batch_size] for start in range(0, len(rows), batch_size))
+    return insert_batches(connection, insert_query, batches)
+
+
+def table_exists(connection, table_name):
+    with connection.cursor() as cursor:
+        cursor.execute("SHOW TABLES;")
+        return any(row[0].lower() == table_name.lower() for row in cursor.fetchall())
+
+
+# LOAD DATA LOCAL INFILE needs both the client flag (local_infile=True) and the server variable
+def local_infile_enabled(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW VARIABLES LIKE 'local_infile';")
+            result = cursor.fetchone()
+        return bool(result) and str(result[1]).upper() == "ON"
+    except pymysql.MySQLError:
+        return False
+
+
+# Let the server parse the file directly. Empty fields are loaded as NULL to match the
+# DataFrame path; rows the server rejects are reported as warnings instead of aborting the load.
+# constants maps extra columns (e.g. a discriminator) to the value every loaded row should get.
+# Date/time columns are parsed with STR_TO_DATE using the format found during inference.
+def load_data_local_infile(connection, csv_path, table_name, columns, constants=None, profiles=None):
+    constants = constants or {}
+    profiles = profiles or {}
+    variables = [f"@v{index}" for index in range(len(columns))]
+    assignments = []
+    for col, var in zip(columns, variables):
+        profile = profiles.get(col)
+        if profile is not None and profile.kind in TEMPORAL_KINDS:
+            # '%' is doubled because the statement is sent with parameters
+            date_format = mysql_date_format(profile.value_format).replace("%", "%%")
+            assignments.append(f"{col} = STR_TO_DATE(NULLIF({var}, ''), '{date_format}')")
+        else:
+            assignments.append(f"{col} = NULLIF({var}, '')")
+    assignments += [f"{col} = %s" for col in constants]
+    load_query = (f"LOAD DATA LOCAL INFILE %s INTO TABLE {table_name} "
+                  f"FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+                  f"LINES TERMINATED BY '\\n' IGNORE 1 LINES "
+                  f"({', '.join(variables)}) SET {', '.join(assignments)};")
+    with connection.cursor() as cursor:
+        cursor.execute(load_query, (csv_path, *constants.values()))
+        rows_inserted = cursor.rowcount
+        cursor.execute("SHOW COUNT(*) WARNINGS;")
+        warning_count = cursor.fetchone()[0]
+    connection.commit()
+    if warning_count:
+        print(f"LOAD DATA reported {warning_count} warnings; some rows may have been skipped or truncated.")
+    return rows_inserted
+
+
+# Load a whole CSV file with the database's own bulk loader: embedded engines that read CSV files
+# directly expose load_csv, MySQL uses LOAD DATA LOCAL INFILE when the server allows it. Returns None
+# when no bulk loader is available so the caller can fall back to batched inserts.
+def bulk_load(connection, csv_path, table_name, columns, constants=None, profiles=None):
+    if hasattr(connection, "load_csv"):
+        return connection.load_csv(csv_path, table_name, columns, constants, profiles)
+    if local_infile_enabled(connection):
+        return load_data_local_infile(connection, csv_path, table_name, columns, constants, profiles)
+    return None
+
+
+def report_throughput(rows_inserted, elapsed, label="Inserted"):
+    rate = rows_inserted / elapsed if elapsed > 0 else float("inf")
+    print(f"{label} {rows_inserted} rows in {elapsed:.2f}s ({rate:,.0f} rows/sec).")
+    return rate
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -0,0 +1,210 @@
+import re
+import threading
+import pymysql
+from csv_loader import TEMPORAL_KINDS
+from lazy_imports import lazy_import
+
+# None when the duckdb package is not installed; otherwise imported the first time the backend is used
+duckdb = lazy_import("duckdb")
+
+
+# A DuckDB-backed connection that behaves like a pymysql connection for the statements ChatDB issues,
+# so tables can be loaded and queried in-process with DuckDB's vectorized columnar engine. MySQL
+# metadata statements are rewritten to queries over DuckDB's information_schema and catalog functions.
+SHOW_TABLES_PATTERN = re.compile(r"^\s*SHOW\s+TABLES\s*;?\s*$", re.IGNORECASE)
+DESCRIBE_PATTERN = re.compile(r"^\s*(?:DESCRIBE|DESC)\s+`?(\w+)`?\s*;?\s*$", re.IGNORECASE)
+SHOW_INDEX_PATTERN = re.compile(r"^\s*SHOW\s+(?:INDEX|INDEXES|KEYS)\s+FROM\s+`?(\w+)`?\s*;?\s*$", re.IGNORECASE)
+CREATE_TABLE_PATTERN = re.compile(r"^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?", re.IGNORECASE)
+AUTO_INCREMENT_PATTERN = re.compile(r"\bid\s+INT\s+AUTO_INCREMENT\b", re.IGNORECASE)
+MEDIUMINT_PATTERN = re.compile(r"\bMEDIUMINT\b", re.IGNORECASE)
+ENUM_PATTERN = re.compile(r"\bENUM\((?:'(?:[^']|'')*'(?:,\s*)?)+\)", re.IGNORECASE)
+
+PRIMARY_KEY_COLUMNS = ("SELECT unnest(constraint_column_names) FROM duckdb_constraints() "
+                       "WHERE constraint_type = 'PRIMARY KEY' AND table_name = '{table}'")
+
+
+def translate_metadata_statement(query):
+    if SHOW_TABLES_PATTERN.match(query):
+        return "SELECT table_name FROM information_schema.tables WHERE table_schema = 'main' ORDER BY table_name"
+    match = DESCRIBE_PATTERN.match(query)
+    if match:
+        primary_key_columns = PRIMARY_KEY_COLUMNS.format(table=match.group(1))
+        return (f"SELECT column_name AS Field, lower(data_type) AS Type, is_nullable AS \"Null\", "
+                f"CASE WHEN column_name IN ({primary_key_columns}) THEN 'PRI' ELSE '' END AS \"Key\", "
+                f"column_default AS \"Default\", '' AS Extra FROM information_schema.columns "
+                f"WHERE table_schema = 'main' AND table_name = '{match.group(1)}' ORDER BY ordinal_position")
+    match = SHOW_INDEX_PATTERN.match(query)
+    if match:
+        # DuckDB only uses its ART indexes for point lookups; report the primary key like MySQL does
+        return (f"SELECT '{match.group(1)}' AS \"Table\", 0 AS Non_unique, 'PRIMARY' AS Key_name, "
+                f"1 AS Seq_in_index, column_name AS Column_name FROM ({PRIMARY_KEY_COLUMNS.format(table=match.group(1))}) "
+                f"AS primary_key(column_name)")
+    return None
+
+
+# Returns the statements to run for one MySQL statement. AUTO_INCREMENT ids become a per-table sequence.
+def translate_statement(query, has_params=True):
+    metadata_query = translate_metadata_statement(query)
+    if metadata_query:
+        return [metadata_query]
+    statements = []
+    create_match = CREATE_TABLE_PATTERN.match(query)
+    if create_match and AUTO_INCREMENT_PATTERN.search(query):
+        sequence_name = f"{create_match.group(1)}_id_seq"
+        statements.append(f"CREATE SEQUENCE IF NOT EXISTS {sequence_name}")
+        query = AUTO_INCREMENT_PATTERN.sub(f"id BIGINT DEFAULT nextval('{sequence_name}')", query)
+    if create_match:
+        query = MEDIUMINT_PATTERN.sub("INTEGER", query)
+        # DuckDB ENUMs reject comparisons with values outside the set, which MySQL allows; DuckDB
+        # dictionary-compresses low-cardinality VARCHAR columns anyway
+        query = ENUM_PATTERN.sub("VARCHAR", query)
+    if has_params:
+        # pymysql uses the 'format' paramstyle, DuckDB uses 'qmark'
+        query = re.sub(r"(?<!%)%s", "?", query).replace("%%", "%")
+    statements.append(query)
+    return statements
+
+
+def database_error(error):
+    if isinstance(error, duckdb.ParserException):
+        return pymysql.err.ProgrammingError(str(error))
+    return pymysql.err.DatabaseError(str(error))
+
+
+class DuckDBCursor:
+    def __init__(self, connection, dict_rows=False):
+        self._connection = connection
+        self.dict_rows = dict_rows
+        self.description = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, query, params=None):
+        try:
+            statements = translate_statement(query, params is not None)
+            for statement in statements[:-1]:
+                self._connection.execute(statement)
+            self._connection.execute(statements[-1], list(params) if params is not None else None)
+        except duckdb.Error as e:
+            raise database_error(e)
+        self.description = self._connection.description
+        self.rowcount = -1
+        return self.rowcount
+
+    # The rows go in one transaction, so like MySQL's multi-row INSERT a failing row leaves none behind
+    def executemany(self, query, seq_of_params):
+        try:
+            statements = translate_statement(query)
+            for statement in statements[:-1]:
+                self._connection.execute(statement)
+            rows = [list(params) for params in seq_of_params]
+            self._connection.begin()
+            try:
+                self._connection.executemany(statements[-1], rows)
+            except duckdb.Error:
+                self._connection.rollback()
+                raise
+            self._connection.commit()
+        except duckdb.Error as e:
+            raise database_error(e)
+        self.description = None
+        self.rowcount = len(rows)
+        return self.rowcount
+
+    # DictCursor/SSDictCursor return rows as {column: value}
+    def _convert(self, rows):
+        if not self.dict_rows:
+            return rows
+        names = [column[0] for column in self.description]
+        return [dict(zip(names, row)) for row in rows]
+
+    def fetchone(self):
+        row = self._connection.fetchone()
+        return self._convert([row])[0] if row is not None else None
+
+    def fetchmany(self, size=1):
+        return self._convert(self._connection.fetchmany(size))
+
+    def fetchall(self):
+        return self._convert(self._connection.fetchall())
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+
+# One DuckDB database per path, shared by every connection in the process. Each ChatDB connection is
+# a DuckDB cursor on it, which is how DuckDB hands out connections that are safe to use from separate
+# threads. In-memory databases are therefore shared by every connection too.
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def open_database(path):
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = duckdb.connect(path)
+        return _databases[path]
+
+
+class DuckDBConnection:
+    def __init__(self, path=":memory:"):
+        if duckdb is None:
+            raise ImportError("The DuckDB backend needs the duckdb package (pip install duckdb).")
+        self.path = path
+        self._connection = open_database(path).cursor()
+        self.open = True
+
+    def cursor(self, cursor_class=None):
+        dict_rows = cursor_class is not None and "Dict" in cursor_class.__name__
+        return DuckDBCursor(self._connection, dict_rows)
+
+    # Statements run in auto-commit mode
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def ping(self, reconnect=False):
+        return self.open
+
+    # Stop the statement running on this connection (from another thread)
+    def interrupt(self):
+        self._connection.interrupt()
+
+    def close(self):
+        self._connection.close()
+        self.open = False
+
+    # Bulk load used by csv_loader.bulk_load in place of LOAD DATA: DuckDB reads the CSV itself with its
+    # parallel reader, and date/time columns are parsed with the formats found during inference.
+    def load_csv(self, csv_path, table_name, columns, constants=None, profiles=None):
+        constants = constants or {}
+        profiles = profiles or {}
+        expressions = []
+        for col in columns:
+            profile = profiles.get(col)
+            if profile is not None and profile.kind in TEMPORAL_KINDS:
+                expressions.append(f"strptime(NULLIF(\"{col}\", ''), '{profile.value_format}')::{profile.kind.upper()}")
+            else:
+                expressions.append(f"NULLIF(\"{col}\", '')")
+        expressions += ["?"] * len(constants)
+        load_query = (f"INSERT INTO {table_name} ({', '.join(list(columns) + list(constants))}) "
+                      f"SELECT {', '.join(expressions)} FROM read_csv(?, header = true, all_varchar = true)")
+        try:
+            result = self._connection.execute(load_query, [*constants.values(), csv_path]).fetchone()
+        except duckdb.Error as e:
+            raise database_error(e)
+        return result[0] if result else 0
+
+
+def connect(path=":memory:"):
+    return DuckDBConnection(path)
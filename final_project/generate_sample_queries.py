@@ -1,56 +1,91 @@
 import random
-
-def generate_sample_queries(connection, selected_table, query_type=None, aggregation_function=None):
+from column_stats import MAX_GROUPS, column_statistics
+from connection_pool import pool_aware
+from instrumentation import metrics
+from schema_catalog import schema_catalog
+
+VALID_KEYWORDS = ["sum", "min", "max", "count", "group by", "having", "order by"]
+QUERY_TYPES = ["simple_select", "where", "group_by", "order_by", "aggregation"]
+# Column type names (as DESCRIBE reports them) that hold numbers
+NUMERIC_TYPES = ("int", "float", "double", "decimal")
+
+KEYWORD_TO_QUERY_TYPE = {
+    'group by': 'group_by',
+    'having': 'group_by',
+    'order by': 'order_by',
+}
+
+# A WHERE value drawn from the column's statistics (see ColumnStats.predicate_value), or default when
+# the table has none
+def pick_condition_value(table_stats, column, operator, rng, default):
+    column_stats = table_stats.get(column) if table_stats is not None else None
+    value = column_stats.predicate_value(operator, rng) if column_stats is not None else None
+    return default if value is None else value
+
+@pool_aware
+@metrics.timed("generate.query")
+def generate_sample_queries(connection, selected_table, query_type=None, aggregation_function=None, rng=random,
+                            verbose=True):
     try:
-        with connection.cursor() as cursor:
-            cursor.execute(f"DESCRIBE {selected_table}")
-            columns_info = cursor.fetchall()
-            columns = [row[0] for row in columns_info]
-            column_data_types = {row[0]: row[1] for row in columns_info}
+        table_schema = schema_catalog.get_table_schema(connection, selected_table)
+        columns = table_schema.columns
+        column_data_types = table_schema.column_types
+        table_stats = column_statistics.get_table_stats(connection, selected_table)
 
         if not columns:
             print(f"No columns found in the table {selected_table}.")
             return None
 
         if query_type is None:
-            query_type = random.choice(["simple_select", "where", "group_by", "order_by", "aggregation"])
+            query_type = rng.choice(QUERY_TYPES)
 
         query = ""
         descriptive_sentence = ""
 
         if query_type == "simple_select":
-            if random.choice([True, False]):
+            if rng.choice([True, False]):
                 selected_columns = "*"
                 descriptive_sentence = f"Select all columns from the table '{selected_table}'."
             else:
-                selected_columns = random.choice(columns)
+                selected_columns = rng.choice(columns)
                 descriptive_sentence = f"Select the column '{selected_columns}' from the table '{selected_table}' limited to 10 rows."
             query = f"SELECT {selected_columns} FROM {selected_table} LIMIT 10;"
 
         elif query_type == "where":
-            condition_column = random.choice(columns)
+            condition_column = rng.choice(columns)
             # Determine the data type for condition value
             data_type = column_data_types[condition_column]
-            if "int" in data_type or "float" in data_type:
-                condition_value = random.randint(1, 100)
-                operator = random.choice(["=", ">", "<", ">=", "<=", "!="])
+            if any(type_name in data_type for type_name in NUMERIC_TYPES):
+                operator = rng.choice(["=", ">", "<", ">=", "<=", "!="])
+                condition_value = pick_condition_value(table_stats, condition_column, operator, rng, rng.randint(1, 100))
                 query = f"SELECT * FROM {selected_table} WHERE {condition_column} {operator} {condition_value} LIMIT 10;"
                 descriptive_sentence = f"Select all columns from '{selected_table}' where '{condition_column}' {operator} {condition_value}, limited to 10 rows."
             elif "date" in data_type:
-                condition_value = "2022-01-01"
-                operator = random.choice(["=", ">", "<", ">=", "<=", "!="])
+                operator = rng.choice(["=", ">", "<", ">=", "<=", "!="])
+                condition_value = pick_condition_value(table_stats, condition_column, operator, rng, "2022-01-01")
+                query = f"SELECT * FROM {selected_table} WHERE {condition_column} {operator} '{condition_value}' LIMIT 10;"
+                descriptive_sentence = f"Select all columns from '{selected_table}' where '{condition_column}' {operator} '{condition_value}', limited to 10 rows."
+            elif "time" in data_type:
+                operator = rng.choice(["=", ">", "<", ">=", "<=", "!="])
+                condition_value = pick_condition_value(table_stats, condition_column, operator, rng, "12:00:00")
                 query = f"SELECT * FROM {selected_table} WHERE {condition_column} {operator} '{condition_value}' LIMIT 10;"
                 descriptive_sentence = f"Select all columns from '{selected_table}' where '{condition_column}' {operator} '{condition_value}', limited to 10 rows."
             else:
-                condition_value = "'SampleValue'"
-                operator = random.choice(["=", "LIKE"])
+                operator = rng.choice(["=", "LIKE"])
+                condition_value = pick_condition_value(table_stats, condition_column, operator, rng, "SampleValue")
+                condition_value = "'" + str(condition_value).replace("'", "''") + "'"
                 query = f"SELECT * FROM {selected_table} WHERE {condition_column} {operator} {condition_value} LIMIT 10;"
                 descriptive_sentence = f"Select all columns from '{selected_table}' where '{condition_column}' {operator} {condition_value}, limited to 10 rows."
 
         elif query_type == "group_by":
             if len(columns) > 1:
-                group_by_column = random.choice(columns)
-                aggregate_column = random.choice([col for col in columns if col != group_by_column])
+                # Group on columns known to give a readable number of groups, when the table has statistics
+                group_by_candidates = columns
+                if table_stats is not None:
+                    group_by_candidates = [col for col in columns if col in table_stats.columns
+                                           and 1 < table_stats.get(col).distinct_count <= MAX_GROUPS] or columns
+                group_by_column = rng.choice(group_by_candidates)
+                aggregate_column = rng.choice([col for col in columns if col != group_by_column])
                 query = (f"SELECT {group_by_column}, COUNT({aggregate_column}) as count "
                          f"FROM {selected_table} GROUP BY {group_by_column};")
                 descriptive_sentence = f"group rows by the column '{group_by_column}' and counts the occurrences of '{aggregate_column}'."
@@ -61,11 +96,11 @@ def generate_sample_queries(connection, selected_table, query_type=None, aggrega
 
 
         elif query_type == "order_by":
-            order_by_column = random.choice(columns)
-            order_direction = random.choice(["ASC", "DESC"])
-            limit = random.randint(5, 15)
+            order_by_column = rng.choice(columns)
+            order_direction = rng.choice(["ASC", "DESC"])
+            limit = rng.randint(5, 15)
 
-            fallback_column = random.choice([col for col in columns if col != order_by_column])
+            fallback_column = rng.choice([col for col in columns if col != order_by_column])
 
             query = f"SELECT * FROM {selected_table} ORDER BY {order_by_column} {order_direction}, {fallback_column} ASC LIMIT {limit};"
             descriptive_sentence = (f"Select all columns from '{selected_table}', ordered by '{order_by_column}' in "
@@ -73,15 +108,16 @@ def generate_sample_queries(connection, selected_table, query_type=None, aggrega
                                     f"limited to {limit} rows.")
 
         elif query_type == "aggregation":
-            numeric_columns = [col for col in columns if "int" in column_data_types[col] or "float" in column_data_types[col]]
+            numeric_columns = [col for col in columns
+                               if any(type_name in column_data_types[col] for type_name in NUMERIC_TYPES)]
             if not numeric_columns:
                 print("No numeric columns available for aggregation.")
                 return None
 
-            agg_column = random.choice(numeric_columns)
+            agg_column = rng.choice(numeric_columns)
 
             if aggregation_function is None:
-                aggregation_function = random.choice(["MIN", "MAX", "COUNT", "AVG", "SUM"])
+                aggregation_function = rng.choice(["MIN", "MAX", "COUNT", "AVG", "SUM"])
 
             if aggregation_function == "MIN":
                 query = f"SELECT MIN({agg_column}) AS min_value FROM {selected_table};"
@@ -106,13 +142,51 @@ def generate_sample_queries(connection, selected_table, query_type=None, aggrega
             print(f"Unsupported query type: {query_type}")
             return None
 
-        print(f"Generated Sample Query with query type '{query_type}':\n")
-        print(query)
-        print("\nDescription:")
-        print(descriptive_sentence)
+        if verbose:
+            print(f"Generated Sample Query with query type '{query_type}':\n")
+            print(query)
+            print("\nDescription:")
+            print(descriptive_sentence)
 
         return query, descriptive_sentence
 
     except Exception as e:
         print(f"Error while exploring tables: {e}")
         return None
+
+# Generate a query for one of VALID_KEYWORDS; returns None for unknown keywords
+def generate_keyword_query(connection, selected_table, keyword):
+    keyword = keyword.lower()
+    if keyword not in VALID_KEYWORDS:
+        return None
+    if keyword in ["sum", "min", "max", "count"]:
+        return generate_sample_queries(connection, selected_table, 'aggregation', keyword.upper())
+    return generate_sample_queries(connection, selected_table, KEYWORD_TO_QUERY_TYPE[keyword])
+
+# Parse a query mix such as "where=3,group_by=1" into a weight per query type; types left out get 0
+def parse_query_mix(text):
+    mix = {query_type: 0 for query_type in QUERY_TYPES}
+    for part in text.split(","):
+        query_type, _, weight = part.partition("=")
+        if query_type.strip() not in mix:
+            raise ValueError(f"Unknown query type '{query_type.strip()}'. Choose from: {', '.join(QUERY_TYPES)}.")
+        mix[query_type.strip()] = float(weight) if weight else 1.0
+    return mix
+
+# A reproducible workload of count generated queries as (query_type, query, description) tuples: the
+# same seed, mix and table statistics always give the same queries. mix weights the query types
+# (default: all equally); types the table cannot produce (e.g. aggregation without numeric columns) are skipped.
+def generate_workload(connection, selected_table, count, mix=None, seed=None):
+    rng = random.Random(seed)
+    mix = mix or {query_type: 1 for query_type in QUERY_TYPES}
+    query_types = [query_type for query_type, weight in mix.items() if weight > 0]
+    weights = [mix[query_type] for query_type in query_types]
+    workload = []
+    for _ in range(count * 2):
+        if len(workload) >= count:
+            break
+        query_type = rng.choices(query_types, weights)[0]
+        query_result = generate_sample_queries(connection, selected_table, query_type, rng=rng, verbose=False)
+        if query_result:
+            workload.append((query_type,) + tuple(query_result))
+    return workload
@@ -1,312 +1,156 @@
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
+import os
+import pickle
 import re
+import threading
+from collections import OrderedDict
 import pymysql  # or your preferred database library
+from column_stats import MAX_GROUPS, column_statistics
+from connection_pool import pool_aware
+from instrumentation import metrics
+from lazy_imports import lazy_import
+from query_cache import schema_fingerprint, translation_cache
+from query_executor import QueryPlan, run_plan
+from schema_catalog import schema_catalog
+
+# NLTK takes longer to import than the rest of ChatDB together, so it is only loaded by the first question
+nltk = lazy_import("nltk")
 
 # Download required NLTK data files (run these once)
 #nltk.download('punkt', quiet=True)
 #nltk.download('averaged_perceptron_tagger', quiet=True)
 #nltk.download('stopwords', quiet=True)
 
+# Define synonyms for mapping
+SYNONYMS = {
+    'product': 'product_id',
+    'product id': 'product_id',
+    'date': 'purchase_date',
+    'purchase date': 'purchase_date',
+    'time': 'purchase_time',
+    'purchase time': 'purchase_time',
+    'country': 'country_code',
+    'country code': 'country_code',
+    'price': 'price_per_unit',
+    'price per unit': 'price_per_unit',
+    'units': 'units_sold',
+    'units sold': 'units_sold',
+    'total units sold': 'units_sold',
+    'currency': 'currency',
+    # Add more synonyms as needed
+}
+
+# Operator map with multi-word operators
+OPERATOR_MAP = {
+    'greater than or equal to': '>=',
+    'less than or equal to': '<=',
+    'greater than': '>',
+    'more than': '>',
+    'higher than': '>',
+    'less than': '<',
+    'fewer than': '<',
+    'lower than': '<',
+    'equal to': '=',
+    'equals': '=',
+    'is': '=',
+    'between': 'BETWEEN',
+    'not equal to': '!=',
+    'not equals': '!=',
+    'before': '<',
+    'after': '>',
+}
+
+# Aggregate function keywords
+AGGREGATE_FUNCTIONS = {
+    'total': 'SUM',
+    'sum': 'SUM',
+    'average': 'AVG',
+    'avg': 'AVG',
+    'count': 'COUNT',
+    'maximum': 'MAX',
+    'max': 'MAX',
+    'minimum': 'MIN',
+    'min': 'MIN',
+}
+
+# Superlative adjectives mapped to (order direction, limit)
+SUPERLATIVE_MAP = {
+    'highest': ('DESC', 1),
+    'largest': ('DESC', 1),
+    'most': ('DESC', 1),
+    'lowest': ('ASC', 1),
+    'smallest': ('ASC', 1),
+    'least': ('ASC', 1),
+    'latest': ('DESC', 1),
+    'earliest': ('ASC', 1),
+    'oldest': ('ASC', 1),
+    'newest': ('DESC', 1),
+}
+
+# GROUP BY columns of a translated query
+GROUP_BY_PATTERN = re.compile(r" GROUP BY ([\w, ]+?)(?= ORDER BY| LIMIT|;|$)")
+
 # Natural Language Processing Functions
-def natural_language_query(connection, sentence, selected_table):
+def plan_natural_language_query(connection, sentence, selected_table):
     query, params = translate_to_sql(sentence, connection, selected_table)
-    if query:
-        print("\nGenerated SQL Query:")
-        print(query)
-        print("Parameters:", params)
-
-        with connection.cursor(pymysql.cursors.DictCursor) as cursor:
-            try:
-                cursor.execute(query, params)
-                results = cursor.fetchall()
-            except Exception as e:
-                print(f"Error executing query: {e}")
-                return
-
-        if results:
-            print("\nQuery Results:")
-            for row in results:
-                print(row)
-        else:
-            print("\nNo results returned by the query.")
-    else:
+    if not query:
+        return None
+    return QueryPlan(query, params, f"Answer to the question '{sentence}' on the table '{selected_table}'.",
+                     source="natural_language")
+
+# Translate, execute once and print the results; returns the executed result (rows and timing)
+def natural_language_query(connection, sentence, selected_table, max_rows=None, page_size=None):
+    plan = plan_natural_language_query(connection, sentence, selected_table)
+    if not plan:
         print("Failed to generate a query.")
+        return None
+
+    try:
+        return run_plan(connection, plan, dict_rows=True, max_rows=max_rows, page_size=page_size)
+    except Exception as e:
+        print(f"Error executing query: {e}")
+        return None
 
 def get_table_structure(connection, selected_table):
-    with connection.cursor(pymysql.cursors.DictCursor) as cursor:
-        cursor.execute(f"DESCRIBE {selected_table}")
-        columns_info = cursor.fetchall()
-        column_data_types = {row['Field']: row['Type'] for row in columns_info}
-    return column_data_types
+    table_schema = schema_catalog.get_table_schema(connection, selected_table)
+    return dict(table_schema.column_types)
 
+@pool_aware
+@metrics.timed("nl.translate")
 def translate_to_sql(sentence, connection, selected_table):
     # Fetch table structure
     table_structure = get_table_structure(connection, selected_table)
-    table_columns = list(table_structure.keys())
-
-    # Define synonyms for mapping
-    synonyms = {
-        'product': 'product_id',
-        'product id': 'product_id',
-        'date': 'purchase_date',
-        'purchase date': 'purchase_date',
-        'time': 'purchase_time',
-        'purchase time': 'purchase_time',
-        'country': 'country_code',
-        'country code': 'country_code',
-        'price': 'price_per_unit',
-        'price per unit': 'price_per_unit',
-        'units': 'units_sold',
-        'units sold': 'units_sold',
-        'total units sold': 'units_sold',
-        'currency': 'currency',
-        # Add more synonyms as needed
-    }
-
-    # Tokenize the sentence
-    tokens = word_tokenize(sentence.lower())
-
-    # Join tokens back to a string for pattern matching
-    sentence_lower = ' '.join(tokens)
-
-    # Attempt to detect if the sentence matches a known pattern
-    pattern_name, components = detect_pattern(sentence_lower)
-    if pattern_name:
-        # Map components to columns
-        mapped_columns = map_components_to_columns(components, table_columns, synonyms)
-        query, params = generate_aggregate_query(mapped_columns, selected_table, pattern_name)
-        if query:
-            return query, params  # Return the generated query
-
-    # Initialize query components
-    select_columns = []
-    conditions = []
-    action = "SELECT"
-    params = []
-
-    # Function to normalize text
-    def normalize(text):
-        return re.sub(r'\s+|_', '', text.lower())
-
-    # Identify columns mentioned in the sentence
-    attributes = extract_attributes(tokens, table_columns, synonyms)
-    if attributes:
-        select_columns = attributes
-    else:
-        select_columns = ["*"]
-
-    # Operator map with multi-word operators
-    operator_map = {
-        'greater than or equal to': '>=',
-        'less than or equal to': '<=',
-        'greater than': '>',
-        'more than': '>',
-        'higher than': '>',
-        'less than': '<',
-        'fewer than': '<',
-        'lower than': '<',
-        'equal to': '=',
-        'equals': '=',
-        'is': '=',
-        'between': 'BETWEEN',
-        'not equal to': '!=',
-        'not equals': '!=',
-        'before': '<',
-        'after': '>',
-    }
-
-    # Build patterns for operators, sorted by length to match longer phrases first
-    operator_phrases = sorted(operator_map.keys(), key=lambda x: -len(x))
-    operator_pattern = '|'.join(map(re.escape, operator_phrases))
-
-    # Extract conditions from the sentence
-    stop_words = set(stopwords.words('english'))
-    for column in table_columns:
-        column_variants = [column.lower().replace('_', ' ')]
-        # Include synonyms
-        for key, value in synonyms.items():
-            if value == column:
-                column_variants.append(key)
-
-        # Build a regex pattern for each operator
-        patterns = []
-
-        # BETWEEN operator
-        patterns.append(
-            rf"({'|'.join(map(re.escape, column_variants))})\s+(?:is\s+)?between\s+(\S+)\s+and\s+(\S+)"
-        )
-
-        # Other operators
-        for op_phrase in operator_phrases:
-            if op_phrase != 'between':
-                patterns.append(
-                    rf"({'|'.join(map(re.escape, column_variants))})\s+(?:is\s+)?{op_phrase}\s+(\S+)"
-                )
-
-        # Equality without operator phrases
-        patterns.append(
-            rf"({'|'.join(map(re.escape, column_variants))})\s+(?:is\s+)?(\S+)"
-        )
-
-        # Try matching patterns
-        for pattern in patterns:
-            regex = re.compile(pattern, re.IGNORECASE)
-            matches = regex.findall(sentence_lower)
-            if matches:
-                for match in matches:
-                    col_match = match[0]
-                    groups = match[1:]
-                    if 'between' in pattern:
-                        value1, value2 = groups
-                        conditions.append(f"{column} BETWEEN %s AND %s")
-                        params.extend([value1, value2])
-                    else:
-                        value = groups[-1]
-                        # Skip if value is a stopword
-                        if value.lower() in stop_words:
-                            continue
-                        # Extract the operator from the matched string
-                        op_match = re.search(operator_pattern, pattern, re.IGNORECASE)
-                        if op_match:
-                            op_phrase = op_match.group()
-                            op_symbol = operator_map.get(op_phrase.lower(), '=')
-                        else:
-                            op_symbol = '='
-                        conditions.append(f"{column} {op_symbol} %s")
-                        params.append(value)
-                break  # Stop after the first match for this column
-
-    # Check for aggregate functions in the sentence
-    aggregate_functions = {
-        'total': 'SUM',
-        'sum': 'SUM',
-        'average': 'AVG',
-        'avg': 'AVG',
-        'count': 'COUNT',
-        'maximum': 'MAX',
-        'max': 'MAX',
-        'minimum': 'MIN',
-        'min': 'MIN',
-    }
-
-    # Detect if an aggregate function is used
-    agg_func = None
-    for word in tokens:
-        if word in aggregate_functions:
-            agg_func = aggregate_functions[word]
-            break
-
-    # Handle grouping if necessary
-    group_by_columns = []
-    group_by_clause = ''
-    if 'each' in tokens or 'per' in tokens or 'by' in tokens:
-        # Attempt to find the grouping column
-        for idx, token in enumerate(tokens):
-            if token in ['each', 'per', 'by']:
-                next_tokens = tokens[idx + 1:idx + 4]  # Get the next few tokens
-                possible_column = ' '.join(next_tokens)
-                normalized_column = synonyms.get(possible_column, possible_column)
-                for column in table_columns:
-                    if normalize(column) == normalize(normalized_column):
-                        group_by_columns.append(column)
-                        break
-        if group_by_columns:
-            group_by_clause = f" GROUP BY {', '.join(group_by_columns)}"
-
-    # Adjust select columns based on aggregate function and grouping
-    if agg_func and select_columns != ["*"]:
-        if group_by_columns:
-            select_clause = ', '.join(
-                group_by_columns +
-                [f"{agg_func}({col}) AS {agg_func.lower()}_{col}" for col in select_columns if col not in group_by_columns]
-            )
-        else:
-            select_clause = ', '.join([f"{agg_func}({col}) AS {agg_func.lower()}_{col}" for col in select_columns])
-    elif group_by_columns:
-        select_clause = ', '.join(set(select_columns + group_by_columns))
-    else:
-        select_clause = ', '.join(set(select_columns))
-
-    # Build the SQL query
-    query = f"{action} {select_clause} FROM {selected_table}"
-
-    if conditions:
-        query += f" WHERE {' AND '.join(conditions)}"
-
-    query += group_by_clause
-
-    # Handle ordering if superlative adjectives are found
-    order_by_clause = ''
-    limit_clause = ''
-    superlative_map = {
-        'highest': ('DESC', 1),
-        'largest': ('DESC', 1),
-        'most': ('DESC', 1),
-        'lowest': ('ASC', 1),
-        'smallest': ('ASC', 1),
-        'least': ('ASC', 1),
-        'latest': ('DESC', 1),
-        'earliest': ('ASC', 1),
-        'oldest': ('ASC', 1),
-        'newest': ('DESC', 1),
-    }
-
-    for idx, word in enumerate(tokens):
-        if word in superlative_map:
-            order_direction, limit = superlative_map[word]
-            # Assume the next word is the column to order by
-            next_tokens = tokens[idx + 1:idx + 4]
-            possible_column = ' '.join(next_tokens)
-            normalized_column = synonyms.get(possible_column, possible_column)
-            for column in table_columns:
-                if normalize(column) == normalize(normalized_column):
-                    order_by_clause = f" ORDER BY {column} {order_direction}"
-                    limit_clause = f" LIMIT {limit}"
-                    break
-            if order_by_clause:
-                break
-    query += order_by_clause + limit_clause
-    query += ";"
+    table_stats = column_statistics.get_table_stats(connection, selected_table)
+
+    # Repeated questions against an unchanged schema (and column statistics) skip the NLP pipeline entirely
+    fingerprint = schema_fingerprint(selected_table, table_structure, table_stats.version if table_stats else None)
+    cached = translation_cache.get(sentence, fingerprint)
+    if cached:
+        metrics.increment("translation_cache_hits")
+        return cached
+    metrics.increment("translation_cache_misses")
+
+    translator = get_translator(selected_table, list(table_structure.keys()))
+    query, params = translator.translate(sentence, table_stats)
+    translation_cache.put(sentence, fingerprint, query, params)
     return query, params
 
+# Known question shapes, compiled once at import
+QUERY_PATTERNS = {
+    'total_A_by_B': re.compile(r'(?:what\s+is\s+)?(?:the\s+)?(?:total|sum)\s+(?P<A>[\w\s]+?)\s+(?:by|for\s+each|per)\s+(?P<B>[\w\s]+)'),
+    'count_A_by_B': re.compile(r'(?:what\s+is\s+)?(?:the\s+)?(?:number|count)\s+of\s+(?P<A>[\w\s]+?)\s+(?:by|for\s+each|per)\s+(?P<B>[\w\s]+)'),
+    'average_A_by_B': re.compile(r'(?:what\s+is\s+)?(?:the\s+)?(?:average|avg)\s+of\s+(?P<A>[\w\s]+?)\s+(?:by|for\s+each|per)\s+(?P<B>[\w\s]+)'),
+    'count_by_B': re.compile(r'(?:what\s+is\s+)?(?:the\s+)?(?:number|count)\s+(?:of\s+)?(?:records|entries|rows)?\s*(?:by|for\s+each|per)\s+(?P<B>[\w\s]+)'),
+    'list_A_grouped_by_B': re.compile(r'(?:list\s+of\s+)?(?P<A>[\w\s]+?)\s+(?:grouped\s+by|by)\s+(?P<B>[\w\s]+)'),
+    # Add other patterns as needed
+}
+
 def detect_pattern(sentence):
-    patterns = {
-        'total_A_by_B': r'(?:what\s+is\s+)?(?:the\s+)?(?:total|sum)\s+(?P<A>[\w\s]+?)\s+(?:by|for\s+each|per)\s+(?P<B>[\w\s]+)',
-        'count_A_by_B': r'(?:what\s+is\s+)?(?:the\s+)?(?:number|count)\s+of\s+(?P<A>[\w\s]+?)\s+(?:by|for\s+each|per)\s+(?P<B>[\w\s]+)',
-        'average_A_by_B': r'(?:what\s+is\s+)?(?:the\s+)?(?:average|avg)\s+of\s+(?P<A>[\w\s]+?)\s+(?:by|for\s+each|per)\s+(?P<B>[\w\s]+)',
-        'count_by_B': r'(?:what\s+is\s+)?(?:the\s+)?(?:number|count)\s+(?:of\s+)?(?:records|entries|rows)?\s*(?:by|for\s+each|per)\s+(?P<B>[\w\s]+)',
-        'list_A_grouped_by_B': r'(?:list\s+of\s+)?(?P<A>[\w\s]+?)\s+(?:grouped\s+by|by)\s+(?P<B>[\w\s]+)',
-        # Add other patterns as needed
-    }
-
-    for pattern_name, pattern_regex in patterns.items():
-        match = re.search(pattern_regex, sentence)
+    for pattern_name, pattern_regex in QUERY_PATTERNS.items():
+        match = pattern_regex.search(sentence)
         if match:
             return pattern_name, match.groupdict()
     return None, None
 
-def map_components_to_columns(components, table_columns, synonyms):
-    def normalize(text):
-        return re.sub(r'\s+|_', '', text.lower())
-
-    mapped_columns = {}
-    for key, value in components.items():
-        normalized_value = value.strip().lower()
-        normalized_value = synonyms.get(normalized_value, normalized_value)
-
-        for column in table_columns:
-            if normalize(column) == normalize(normalized_value):
-                mapped_columns[key] = column
-                break
-        else:
-            if key == 'A' and value in ['records', 'entries', 'rows']:
-                mapped_columns[key] = '*'  # For COUNT(*) cases
-            else:
-                mapped_columns[key] = None
-    return mapped_columns
-
 def generate_aggregate_query(mapped_columns, selected_table, pattern_name):
     B = mapped_columns.get('B')
     A = mapped_columns.get('A')
@@ -336,27 +180,296 @@ def generate_aggregate_query(mapped_columns, selected_table, pattern_name):
 
     return query, params
 
+NORMALIZE_PATTERN = re.compile(r'\s+|_')
+
 def normalize(text):
-    return re.sub(r'\s+|_', '', text.lower())
-
-def extract_attributes(tokens, table_columns, synonyms):
-    attributes = []
-    token_text = ' '.join(tokens)
-    possible_attributes = []
-
-    # Create a list of possible column names including synonyms
-    possible_columns = set(table_columns)
-    possible_columns.update(synonyms.keys())
-
-    # Iterate over possible n-grams in the tokenized text
-    for n in range(1, 4):  # Adjust n for longer attributes if necessary
-        for i in range(len(tokens) - n + 1):
-            gram = ' '.join(tokens[i:i + n])
-            normalized_gram = synonyms.get(gram, gram)
-            for column in possible_columns:
-                if normalize(column) == normalize(normalized_gram):
-                    attributes.append(synonyms.get(column, column))
+    return NORMALIZE_PATTERN.sub('', text.lower())
+
+# NLTK's English stopword list, frozen here so stopword checks need neither NLTK nor its data files
+ENGLISH_STOP_WORDS = frozenset("""
+i me my myself we our ours ourselves you you're you've you'll you'd your yours yourself yourselves he him his
+himself she she's her hers herself it it's its itself they them their theirs themselves what which who whom this
+that that'll these those am is are was were be been being have has had having do does did doing a an the and but
+if or because as until while of at by for with about against between into through during before after above below
+to from up down in out on off over under again further then once here there when where why how all any both each
+few more most other some such no nor not only own same so than too very s t can will just don don't should
+should've now d ll m o re ve y ain aren aren't couldn couldn't didn didn't doesn doesn't hadn hadn't hasn hasn't
+haven haven't isn isn't ma mightn mightn't mustn mustn't needn needn't shan shan't shouldn shouldn't wasn wasn't
+weren weren't won won't wouldn wouldn't he'd he'll he's i'd i'll i'm i've it'd it'll she'd she'll they'd they'll
+they're they've we'd we'll we're we've
+""".split())
+
+# One regex that splits a question exactly as nltk.word_tokenize does, for questions made of words,
+# numbers and the punctuation below: ;@#$%&?!*()[]{}<> and "--" are always separate tokens, "," and ":"
+# are separate unless a digit follows, and a period is kept inside numbers or split off at the end.
+FAST_TOKEN_PATTERN = re.compile(
+    r"--|[;@#$%&?!*()\[\]{}<>]|(?:[^\s;@#$%&?!*()\[\]{}<>,:.-]+|-(?!-)|[,:](?=\d)|(?<=\d)\.(?=\d))+|[,:.]")
+# Text FAST_TOKEN_PATTERN may split differently from NLTK: quotes and other characters it does not
+# handle, periods other than in numbers or at the end, doubled "," or ":", and the words NLTK splits
+# as contractions
+FAST_TOKEN_UNSUPPORTED_PATTERN = re.compile(
+    r"[^\w\s;@#$%&?!*()\[\]{}<>,:.=+/^|~-]|[,:][,:]|\.(?:(?<!\d\.)(?!\s*$)|\.|(?!\d|\s*$))"
+    r"|(?<!\w)(?:cannot|gimme|gonna|gotta|lemme|wanna)(?!\w)", re.IGNORECASE)
+
+# The Punkt sentence tokenizer NLTK needs for the few questions the regex does not cover, pickled after
+# NLTK first loads it from its data files so later sessions skip parsing them. The cache records the
+# NLTK version it was built with.
+NLTK_CACHE_PATH = os.environ.get("CHATDB_NLTK_CACHE",
+                                 os.path.join(os.path.expanduser("~"), ".cache", "chatdb", "nltk_english.pickle"))
+
+nltk_resources = None
+nltk_resources_lock = threading.Lock()
+
+def build_nltk_resources():
+    try:
+        sentence_tokenizer = nltk.tokenize.PunktTokenizer("english")
+    except AttributeError:
+        # NLTK before 3.8.2 ships Punkt as a pickle
+        sentence_tokenizer = nltk.data.load("tokenizers/punkt/english.pickle")
+    return {"version": nltk.__version__, "sentence_tokenizer": sentence_tokenizer,
+            "word_tokenizer": nltk.tokenize.NLTKWordTokenizer()}
+
+# The NLTK tokenizers, or False when NLTK or its punkt data is not installed
+def load_nltk_resources(cache_path=NLTK_CACHE_PATH):
+    global nltk_resources
+    with nltk_resources_lock:
+        if nltk_resources is not None:
+            return nltk_resources
+        if nltk is None:
+            nltk_resources = False
+            return nltk_resources
+        resources = None
+        try:
+            with open(cache_path, "rb") as cache_file:
+                resources = pickle.load(cache_file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            pass
+        if not isinstance(resources, dict) or resources.get("version") != nltk.__version__:
+            try:
+                resources = build_nltk_resources()
+            except LookupError:
+                print("NLTK punkt data is not installed; all questions are split with the built-in tokenizer.")
+                nltk_resources = False
+                return nltk_resources
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                with open(cache_path, "wb") as cache_file:
+                    pickle.dump(resources, cache_file)
+            except OSError as e:
+                print(f"Could not write the NLTK cache {cache_path}: {e}")
+        nltk_resources = resources
+        return resources
+
+# Same tokens as nltk.word_tokenize. Nearly every question is split by FAST_TOKEN_PATTERN alone; the
+# rest go through NLTK (Punkt sentences, then its Treebank-style word tokenizer) when it is installed.
+def word_tokenize(text):
+    if FAST_TOKEN_UNSUPPORTED_PATTERN.search(text):
+        resources = load_nltk_resources()
+        if resources:
+            return [token for sentence in resources["sentence_tokenizer"].tokenize(text)
+                    for token in resources["word_tokenizer"].tokenize(sentence)]
+    return FAST_TOKEN_PATTERN.findall(text)
+
+def get_stop_words():
+    return ENGLISH_STOP_WORDS
+
+# Translator compiled once per table schema: every regex, operator lookup and column index that the
+# original per-call translator (benchmarks.translate_to_sql_reference) rebuilt per question is prepared
+# here, so translating a question is a handful of dictionary lookups plus the regex scans that can
+# actually match. Without table_stats it produces exactly the same SQL and parameters as the original.
+class CompiledTranslator:
+    def __init__(self, selected_table, table_columns, synonyms=SYNONYMS):
+        self.selected_table = selected_table
+        self.table_columns = list(table_columns)
+        self.synonyms = synonyms
+
+        # normalized name -> first matching table column, replacing the normalize() scans over columns
+        self.column_index = {}
+        for column in self.table_columns:
+            self.column_index.setdefault(normalize(column), column)
+
+        # normalized n-gram -> attribute, built in the same order extract_attributes scans its candidates
+        possible_columns = set(self.table_columns)
+        possible_columns.update(synonyms.keys())
+        self.attribute_index = {}
+        for column in possible_columns:
+            self.attribute_index.setdefault(normalize(column), synonyms.get(column, column))
+
+        operator_phrases = sorted(OPERATOR_MAP.keys(), key=lambda x: -len(x))
+        operator_pattern = re.compile('|'.join(map(re.escape, operator_phrases)), re.IGNORECASE)
+
+        # Per column: a prefilter on the column variants (every condition pattern starts with one) and the
+        # ordered condition patterns with their operator resolved up front
+        self.condition_matchers = []
+        for column in self.table_columns:
+            column_variants = [column.lower().replace('_', ' ')]
+            for key, value in synonyms.items():
+                if value == column:
+                    column_variants.append(key)
+            variants_pattern = '|'.join(map(re.escape, column_variants))
+
+            patterns = [rf"({variants_pattern})\s+(?:is\s+)?between\s+(\S+)\s+and\s+(\S+)"]
+            for op_phrase in operator_phrases:
+                if op_phrase != 'between':
+                    patterns.append(rf"({variants_pattern})\s+(?:is\s+)?{op_phrase}\s+(\S+)")
+            patterns.append(rf"({variants_pattern})\s+(?:is\s+)?(\S+)")
+
+            matchers = []
+            for pattern in patterns:
+                op_match = operator_pattern.search(pattern)
+                op_symbol = OPERATOR_MAP.get(op_match.group().lower(), '=') if op_match else '='
+                matchers.append((re.compile(pattern, re.IGNORECASE), 'between' in pattern, op_symbol))
+            prefilter = re.compile(rf"({variants_pattern})\s+", re.IGNORECASE)
+            self.condition_matchers.append((column, prefilter, matchers))
+
+    def lookup_column(self, phrase):
+        return self.column_index.get(normalize(self.synonyms.get(phrase, phrase)))
+
+    def map_components_to_columns(self, components):
+        mapped_columns = {}
+        for key, value in components.items():
+            column = self.lookup_column(value.strip().lower())
+            if column is not None:
+                mapped_columns[key] = column
+            elif key == 'A' and value in ['records', 'entries', 'rows']:
+                mapped_columns[key] = '*'  # For COUNT(*) cases
+            else:
+                mapped_columns[key] = None
+        return mapped_columns
+
+    def extract_attributes(self, tokens):
+        attributes = []
+        for n in range(1, 4):
+            for i in range(len(tokens) - n + 1):
+                gram = ' '.join(tokens[i:i + n])
+                attribute = self.attribute_index.get(normalize(self.synonyms.get(gram, gram)))
+                if attribute is not None:
+                    attributes.append(attribute)
+        return list(set(attributes))
+
+    # With column statistics, a GROUP BY expected to return more than MAX_GROUPS groups gets a LIMIT
+    def limit_groups(self, query, table_stats):
+        match = GROUP_BY_PATTERN.search(query)
+        if table_stats is None or match is None or " LIMIT " in query:
+            return query
+        group_count = table_stats.group_count([col.strip() for col in match.group(1).split(",")])
+        if group_count is None or group_count <= MAX_GROUPS:
+            return query
+        return f"{query.rstrip(';')} LIMIT {MAX_GROUPS};"
+
+    # Time spent in each step is recorded as the nl.* stages. table_stats (the table's column
+    # statistics, optional) restores the stored spelling of values and limits oversized groupings.
+    def translate(self, sentence, table_stats=None):
+        timer = metrics.timer()
+        tokens = word_tokenize(sentence.lower())
+        sentence_lower = ' '.join(tokens)
+        timer.lap("nl.tokenize")
+
+        pattern_name, components = detect_pattern(sentence_lower)
+        timer.lap("nl.detect_pattern")
+        if pattern_name:
+            mapped_columns = self.map_components_to_columns(components)
+            query, params = generate_aggregate_query(mapped_columns, self.selected_table, pattern_name)
+            if query:
+                return self.limit_groups(query, table_stats), params
+
+        conditions = []
+        params = []
+        attributes = self.extract_attributes(tokens)
+        select_columns = attributes if attributes else ["*"]
+        timer.lap("nl.extract_attributes")
+
+        stop_words = get_stop_words()
+        for column, prefilter, matchers in self.condition_matchers:
+            if not prefilter.search(sentence_lower):
+                continue
+            for regex, is_between, op_symbol in matchers:
+                matches = regex.findall(sentence_lower)
+                if matches:
+                    for match in matches:
+                        groups = match[1:]
+                        if is_between:
+                            value1, value2 = groups
+                            conditions.append(f"{column} BETWEEN %s AND %s")
+                            params.extend([value1, value2])
+                        else:
+                            value = groups[-1]
+                            if value.lower() in stop_words:
+                                continue
+                            conditions.append(f"{column} {op_symbol} %s")
+                            column_stats = table_stats.get(column) if table_stats is not None else None
+                            params.append(column_stats.stored_value(value) if column_stats is not None else value)
                     break
+        timer.lap("nl.conditions")
+
+        agg_func = None
+        for word in tokens:
+            if word in AGGREGATE_FUNCTIONS:
+                agg_func = AGGREGATE_FUNCTIONS[word]
+                break
 
-    # Remove duplicates and return
-    return list(set(attributes))
+        group_by_columns = []
+        group_by_clause = ''
+        for idx, token in enumerate(tokens):
+            if token in ['each', 'per', 'by']:
+                column = self.lookup_column(' '.join(tokens[idx + 1:idx + 4]))
+                if column is not None:
+                    group_by_columns.append(column)
+        if group_by_columns:
+            group_by_clause = f" GROUP BY {', '.join(group_by_columns)}"
+
+        if agg_func and select_columns != ["*"]:
+            if group_by_columns:
+                select_clause = ', '.join(
+                    group_by_columns +
+                    [f"{agg_func}({col}) AS {agg_func.lower()}_{col}" for col in select_columns if col not in group_by_columns]
+                )
+            else:
+                select_clause = ', '.join([f"{agg_func}({col}) AS {agg_func.lower()}_{col}" for col in select_columns])
+        elif group_by_columns:
+            select_clause = ', '.join(set(select_columns + group_by_columns))
+        else:
+            select_clause = ', '.join(set(select_columns))
+
+        query = f"SELECT {select_clause} FROM {self.selected_table}"
+        if conditions:
+            query += f" WHERE {' AND '.join(conditions)}"
+        query += group_by_clause
+
+        for idx, word in enumerate(tokens):
+            if word in SUPERLATIVE_MAP:
+                order_direction, limit = SUPERLATIVE_MAP[word]
+                column = self.lookup_column(' '.join(tokens[idx + 1:idx + 4]))
+                if column is not None:
+                    query += f" ORDER BY {column} {order_direction} LIMIT {limit}"
+                    break
+        query += ";"
+        return self.limit_groups(query, table_stats), params
+
+# One compiled translator per (table, columns), least recently used evicted first; a schema change
+# produces a new key. Translators are built outside the lock, and the first one stored for a key wins.
+MAX_TRANSLATORS = 64
+translator_cache = OrderedDict()
+translator_cache_lock = threading.Lock()
+
+def get_translator(selected_table, table_columns):
+    key = (selected_table, tuple(table_columns))
+    with translator_cache_lock:
+        translator = translator_cache.get(key)
+        if translator is not None:
+            translator_cache.move_to_end(key)
+            return translator
+    with metrics.stage("nl.build_translator"):
+        translator = CompiledTranslator(selected_table, table_columns)
+    with translator_cache_lock:
+        translator = translator_cache.setdefault(key, translator)
+        translator_cache.move_to_end(key)
+        while len(translator_cache) > MAX_TRANSLATORS:
+            translator_cache.popitem(last=False)
+    return translator
+
+
+# Build the NLTK cache ahead of time (e.g. when installing ChatDB) so the first question is fast too
+if __name__ == "__main__":
+    if load_nltk_resources():
+        print(f"NLTK {nltk_resources['version']} tokenizer cached in {NLTK_CACHE_PATH}.")
@@ -0,0 +1,449 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import pymysql
+from aggregate_cube import cube_registry
+from approximate_query import load_reservoir, load_sample_info, sample_table, save_sample
+from column_stats import column_kind, column_statistics
+from connection_pool import pool_aware
+from csv_loader import (DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, TEMPORAL_KINDS, TEMPORAL_STORAGE_FORMATS,
+                        ColumnProfile, build_insert_query, bulk_load, infer_column_definitions, insert_batches,
+                        iter_converted_chunks, iter_csv_chunks, iter_loaded_chunks, iter_row_batches,
+                        report_throughput, table_exists)
+from index_advisor import IndexProposal, create_indexes, is_covered
+from instrumentation import metrics
+from lazy_imports import lazy_import
+from query_cache import result_cache
+from schema_catalog import schema_catalog
+from snapshot_cache import snapshot_cache, write_snapshot
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# One row per (table, file) loaded incrementally: the watermark (byte offset up to which the file has
+# been loaded), the file's size and mtime at that point, a fingerprint of its header and of the bytes
+# just before the watermark, the number of rows loaded from it and the text format of its date and
+# time columns
+MANIFEST_TABLE = "chatdb_ingest_manifest"
+# Hash of every row loaded incrementally into a table, so rows already loaded are recognised when a
+# file is rewritten or a new file repeats them
+ROW_HASHES_SUFFIX = "_row_hashes"
+STAGING_SUFFIX = "_staging"
+FINGERPRINT_BYTES = 64 * 1024
+DECIMAL_SCALE_PATTERN = re.compile(r"\(\s*\d+\s*,\s*(\d+)\s*\)")
+
+
+def row_hashes_table_name(table_name):
+    return f"{table_name}{ROW_HASHES_SUFFIX}"
+
+
+# Hash of the header line and of the FINGERPRINT_BYTES before offset. If it is unchanged, the rows up
+# to offset are taken to be the ones already loaded and only what follows is new.
+def file_fingerprint(csv_path, offset):
+    digest = hashlib.sha256()
+    with open(csv_path, "rb") as csv_file:
+        digest.update(csv_file.readline())
+        csv_file.seek(max(0, offset - FINGERPRINT_BYTES))
+        digest.update(csv_file.read(offset - csv_file.tell()))
+    return digest.hexdigest()
+
+
+def load_watermark(connection, table_name, csv_path):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT byte_offset, file_size, mtime, fingerprint, rows_loaded FROM {MANIFEST_TABLE} "
+                           f"WHERE table_name = %s AND file_path = %s;", (table_name.lower(), csv_path))
+            return cursor.fetchone()
+    except pymysql.MySQLError:
+        return None
+
+
+# With complete=False (some rows of the file could not be loaded) the watermark matches no state of the
+# file, so the next load reads the whole file and loads the rows whose hashes were not recorded.
+def save_watermark(connection, table_name, csv_path, file_size, mtime, rows_loaded, value_formats, complete=True):
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {MANIFEST_TABLE} (table_name VARCHAR(64) NOT NULL, "
+                       f"file_path VARCHAR(512) NOT NULL, byte_offset BIGINT NOT NULL, file_size BIGINT NOT NULL, "
+                       f"mtime DOUBLE NOT NULL, fingerprint CHAR(64) NOT NULL, rows_loaded BIGINT NOT NULL, "
+                       f"value_formats TEXT NOT NULL, PRIMARY KEY (table_name, file_path));")
+        cursor.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE table_name = %s AND file_path = %s;",
+                       (table_name.lower(), csv_path))
+        cursor.execute(f"INSERT INTO {MANIFEST_TABLE} (table_name, file_path, byte_offset, file_size, mtime, "
+                       f"fingerprint, rows_loaded, value_formats) VALUES (%s, %s, %s, %s, %s, %s, %s, %s);",
+                       (table_name.lower(), csv_path, file_size if complete else 0, file_size if complete else -1,
+                        mtime, file_fingerprint(csv_path, file_size) if complete else "", rows_loaded,
+                        json.dumps(value_formats)))
+    connection.commit()
+
+
+def profile_formats(profiles):
+    return {col: profile.value_format for col, profile in profiles.items() if profile.kind in TEMPORAL_KINDS}
+
+
+# Date/time formats recorded for the table's files: those of csv_path, falling back to the ones
+# recorded for its other files
+def load_value_formats(connection, table_name, csv_path):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT file_path, value_formats FROM {MANIFEST_TABLE} WHERE table_name = %s;",
+                           (table_name.lower(),))
+            rows = cursor.fetchall()
+    except pymysql.MySQLError:
+        return {}
+    value_formats = {}
+    for file_path, formats in sorted(rows, key=lambda row: row[0] == csv_path):
+        value_formats.update(json.loads(formats))
+    return value_formats
+
+
+# Profiles of an existing table's columns built from its schema, so new rows are converted, aggregated
+# and profiled the way the table stores them rather than by what the new rows alone look like (an
+# all-integer delta of a DECIMAL column, or dates that also parse with another format). Dates and times
+# are parsed with the recorded value_formats, or the format found in the new rows if none was recorded.
+def table_column_profiles(connection, table_name, columns, delta_profiles, value_formats):
+    column_types = schema_catalog.get_table_schema(connection, table_name).column_types
+    profiles = {}
+    for col in columns:
+        if col not in column_types:
+            profiles[col] = delta_profiles[col]
+            continue
+        profile = ColumnProfile()
+        profile.kind = column_kind(column_types[col])
+        if profile.kind == "float":
+            match = DECIMAL_SCALE_PATTERN.search(column_types[col])
+            profile.scale = int(match.group(1)) if match else None
+        elif profile.kind in TEMPORAL_KINDS:
+            profile.value_format = value_formats.get(col)
+            if profile.value_format is None:
+                delta_profile = delta_profiles[col]
+                profile.value_format = (delta_profile.value_format if delta_profile.kind == profile.kind
+                                        else TEMPORAL_STORAGE_FORMATS[profile.kind])
+        profiles[col] = profile
+    return profiles
+
+
+def table_column_definitions(connection, table_name):
+    table_schema = schema_catalog.get_table_schema(connection, table_name)
+    return [f"{col} {table_schema.column_types[col]}" for col in table_schema.columns]
+
+
+# Number of times each row hash has been loaded into the table, or None if nothing was loaded
+# incrementally yet
+def load_row_hash_counts(connection, table_name):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT row_hash, COUNT(*) FROM {row_hashes_table_name(table_name)} GROUP BY row_hash;")
+            rows = cursor.fetchall()
+    except pymysql.MySQLError:
+        return None
+    hashes, counts = zip(*rows) if rows else ((), ())
+    return pd.Series(counts, index=pd.Index(hashes, dtype="int64"), dtype="int64")
+
+
+def save_row_hashes(connection, table_name, hashes, work_dir):
+    hashes_table = row_hashes_table_name(table_name)
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {hashes_table} (row_hash BIGINT NOT NULL);")
+    connection.commit()
+    if not len(hashes):
+        return
+    frame = pd.DataFrame({"row_hash": hashes})
+    csv_path = os.path.join(work_dir, f"{hashes_table}.csv")
+    frame.to_csv(csv_path, index=False)
+    if bulk_load(connection, csv_path, hashes_table, ["row_hash"]) is None:
+        insert_batches(connection, build_insert_query(hashes_table, ["row_hash"]), iter_row_batches([frame]))
+
+
+def row_hashes(chunk):
+    return pd.util.hash_pandas_object(chunk, index=False).to_numpy().view("int64")
+
+
+def file_row_hashes(csv_path, chunk_size=DEFAULT_CHUNK_SIZE):
+    hashes = [row_hashes(chunk) for chunk in pd.read_csv(csv_path, dtype=str, keep_default_na=False, chunksize=chunk_size)]
+    return np.concatenate(hashes) if hashes else np.empty(0, dtype="int64")
+
+
+# Whether every row of table_name was loaded by ChatDB with its row hash recorded, so incremental loads
+# can tell which rows it already has
+def is_tracked(connection, table_name):
+    return table_exists(connection, row_hashes_table_name(table_name))
+
+
+# Drop what is recorded about the loads into table_name, e.g. once rows were loaded without their
+# hashes or the table was dropped and is created again
+def forget_loads(connection, table_name):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {row_hashes_table_name(table_name)};")
+        if table_exists(connection, MANIFEST_TABLE):
+            cursor.execute(f"DELETE FROM {MANIFEST_TABLE} WHERE table_name = %s;", (table_name.lower(),))
+    connection.commit()
+
+
+# Record a full load of csv_path into table_name the way incremental_load records its loads (the file's
+# watermark and the hash of every row), so a later incremental load of the file only adds what is new.
+# A table that already had rows loaded without hashes stays untracked. stat is the file's os.stat
+# from before the load.
+def record_full_load(connection, csv_path, table_name, table_existed, stat, profiles, chunk_size=DEFAULT_CHUNK_SIZE):
+    if not table_existed:
+        forget_loads(connection, table_name)
+    elif not is_tracked(connection, table_name):
+        return
+    csv_path = os.path.realpath(csv_path)
+    hashes = file_row_hashes(csv_path, chunk_size)
+    with tempfile.TemporaryDirectory() as work_dir:
+        save_row_hashes(connection, table_name, hashes, work_dir)
+    save_watermark(connection, table_name, csv_path, stat.st_size, stat.st_mtime, len(hashes), profile_formats(profiles))
+
+
+# Copy the header and the bytes from start to end of csv_path into region_path, so only that part of
+# the file is parsed
+def copy_region(csv_path, region_path, start, end, block_size=1024 * 1024):
+    with open(csv_path, "rb") as source, open(region_path, "wb") as region:
+        header = source.readline()
+        region.write(header)
+        source.seek(max(start, len(header)))
+        remaining = end - source.tell()
+        while remaining > 0:
+            block = source.read(min(block_size, remaining))
+            if not block:
+                break
+            region.write(block)
+            remaining -= len(block)
+
+
+# Drop the rows of the region file that were loaded before (by row hash, counting repeats, so a row
+# that appears twice in the file and was loaded once is loaded once more). Writes the new rows to
+# delta_path and returns (hashes of the new rows, rows skipped). Values are read as text so a row
+# hashes the same however its file is later parsed.
+def filter_new_rows(region_path, delta_path, loaded_counts, chunk_size):
+    new_hashes, skipped, wrote_header = [], 0, False
+    seen = pd.Series(dtype="int64", index=pd.Index([], dtype="int64"))
+    for chunk in pd.read_csv(region_path, dtype=str, keep_default_na=False, chunksize=chunk_size):
+        hashes = pd.Series(row_hashes(chunk))
+        if loaded_counts is not None and len(loaded_counts):
+            # Occurrence number of each row among the equal rows read so far
+            occurrence = hashes.groupby(hashes).cumcount().to_numpy() + seen.reindex(hashes).fillna(0).to_numpy()
+            is_new = occurrence >= loaded_counts.reindex(hashes).fillna(0).to_numpy()
+            seen = seen.add(hashes.value_counts(), fill_value=0)
+            skipped += int((~is_new).sum())
+            chunk, hashes = chunk[is_new], hashes[is_new]
+        chunk.to_csv(delta_path, mode="a", header=not wrote_header, index=False)
+        wrote_header = True
+        new_hashes.append(hashes.to_numpy())
+    return np.concatenate(new_hashes) if new_hashes else np.empty(0, dtype="int64"), skipped
+
+
+# Load the row_count rows of delta_path. Returns (rows inserted, positions in delta_path of the rows that
+# could not be inserted); the positions are None when the bulk loader skipped rows without saying which.
+def load_rows(connection, delta_path, table_name, columns, profiles, row_count, batch_size, chunk_size):
+    rows_inserted = None
+    try:
+        rows_inserted = bulk_load(connection, delta_path, table_name, columns, profiles=profiles)
+    except pymysql.MySQLError as e:
+        print(f"Bulk load failed, falling back to batched inserts. Error: {e}")
+    if rows_inserted is not None:
+        return rows_inserted, [] if rows_inserted >= row_count else None
+    insert_query = build_insert_query(table_name, columns)
+    rows_inserted, failed_positions, position = 0, [], 0
+    # One batch at a time, so each failed row (returned as the batch's own row object) is located in the file
+    for batch in iter_row_batches(iter_converted_chunks(iter_csv_chunks(delta_path, chunk_size), profiles), batch_size):
+        inserted, failed_rows = insert_batches(connection, insert_query, [batch])
+        failed_ids = {id(row) for row in failed_rows}
+        failed_positions += [position + index for index, row in enumerate(batch) if id(row) in failed_ids]
+        rows_inserted += inserted
+        position += len(batch)
+    if failed_positions:
+        print(f"{len(failed_positions)} rows could not be inserted and were skipped.")
+    return rows_inserted, failed_positions
+
+
+# Upsert through a staging table: the new rows are loaded into it, rows of the table with the same
+# key_columns values are deleted and the staged rows inserted. The key columns are indexed first so
+# both steps cost time in proportion to the new rows. Returns (rows inserted, rows replaced, positions of
+# the rows that could not be loaded, as load_rows returns them). Rows that share a key within the new
+# rows are all inserted.
+def upsert_rows(connection, delta_path, table_name, columns, key_columns, profiles, row_count, batch_size,
+                chunk_size):
+    if not is_covered(key_columns, schema_catalog.get_table_schema(connection, table_name).indexes.values()):
+        create_indexes(connection, [IndexProposal(table_name, key_columns, 0)])
+    staging_table = f"{table_name}{STAGING_SUFFIX}"
+    column_list = ", ".join(columns)
+    key_list = ", ".join(key_columns)
+    matches_staged_key = f"({key_list}) IN (SELECT {key_list} FROM {staging_table})"
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging_table};")
+        cursor.execute(f"CREATE TABLE {staging_table} AS SELECT {column_list} FROM {table_name} WHERE 1 = 0;")
+    connection.commit()
+    try:
+        _, failed_positions = load_rows(connection, delta_path, staging_table, columns, profiles, row_count,
+                                        batch_size, chunk_size)
+        # Counted with queries because not every backend reports a row count for DELETE and INSERT ... SELECT
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {staging_table};")
+            rows_inserted = int(cursor.fetchone()[0])
+            cursor.execute(f"SELECT COUNT(*) FROM {table_name} WHERE {matches_staged_key};")
+            rows_replaced = int(cursor.fetchone()[0])
+            cursor.execute(f"DELETE FROM {table_name} WHERE {matches_staged_key};")
+            cursor.execute(f"INSERT INTO {table_name} ({column_list}) SELECT {column_list} FROM {staging_table};")
+        connection.commit()
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {staging_table};")
+        connection.commit()
+    return rows_inserted, rows_replaced, failed_positions
+
+
+# Keep the table's aggregate cube, sample, column statistics and columnar snapshot in step with the rows
+# just loaded, in one pass over loaded_chunks (the rows as iter_loaded_chunks yields them). cube is the one
+# cube_registry.cube_for_load returned before the load. When the chunks are not exactly the rows added
+# (exact=False: rows were replaced or some could not be loaded), the cube is dropped (and rebuilt by the
+# next full load), the sample is redrawn and the statistics are collected again from the table.
+def refresh_derived_data(connection, table_name, cube, loaded_chunks, columns, column_definitions, profiles,
+                         table_existed, exact=True):
+    if not exact:
+        cube = None
+    sample_info = load_sample_info(connection, table_name)
+    reservoir = None
+    if sample_info is not None and exact:
+        reservoir = load_reservoir(connection, table_name, columns, int(sample_info[1]))
+    table_stats = None
+    if exact:
+        table_stats = column_statistics.stats_for_load(connection, table_name, columns, profiles, table_existed)
+    if cube is not None or reservoir is not None or table_stats is not None:
+        for chunk in loaded_chunks:
+            if cube is not None:
+                cube.update(chunk)
+            if reservoir is not None:
+                reservoir.add(chunk)
+            if table_stats is not None:
+                table_stats.update(chunk)
+    if table_stats is None:
+        column_statistics.collect(connection, table_name)
+    else:
+        column_statistics.save(connection, table_stats)
+    if cube is not None:
+        cube_registry.register(cube)
+    if sample_info is not None:
+        if reservoir is None:
+            reservoir = sample_table(connection, table_name, columns, int(sample_info[1]))
+        save_sample(connection, table_name, column_definitions, columns, reservoir)
+    # The statistics version changed, so a snapshot of the table would no longer be used
+    if snapshot_cache.exists(connection, table_name):
+        write_snapshot(connection, table_name)
+
+
+# Load only the rows of csv_path that are not in table_name yet. A watermark per file records how far
+# it was loaded: an unchanged file is skipped, a file that was appended to is read from the watermark
+# on, and a new or rewritten file is read whole with the rows already loaded (by row hash) skipped.
+# With key_columns, rows whose key matches an existing row replace it (upsert). Rows that cannot be
+# inserted are not recorded as loaded, so the next load of the file tries them again. Returns a dict with
+# rows_inserted, rows_replaced, rows_skipped and rows_failed, or None on failure.
+@pool_aware
+def incremental_load(connection, csv_path, table_name, key_columns=None, batch_size=DEFAULT_BATCH_SIZE,
+                     chunk_size=DEFAULT_CHUNK_SIZE):
+    try:
+        csv_path = os.path.realpath(csv_path)
+        stat = os.stat(csv_path)
+        if key_columns:
+            missing = [col for col in key_columns if col not in pd.read_csv(csv_path, nrows=0).columns]
+            if missing:
+                print(f"Key columns not found in the CSV file: {', '.join(missing)}")
+                return None
+        table_existed = table_exists(connection, table_name)
+        if table_existed and not is_tracked(connection, table_name):
+            print(f"'{table_name}' has rows that were not recorded when they were loaded, so the rows of "
+                  f"'{csv_path}' it already has cannot be recognised. Upload the file into a new table instead.")
+            return None
+        if not table_existed:
+            forget_loads(connection, table_name)
+        watermark = load_watermark(connection, table_name, csv_path) if table_existed else None
+        if watermark is not None and watermark[1] == stat.st_size and watermark[2] == stat.st_mtime:
+            print(f"'{csv_path}' is unchanged since it was last loaded into '{table_name}'; nothing to load.")
+            return {"rows_inserted": 0, "rows_replaced": 0, "rows_skipped": int(watermark[4]), "rows_failed": 0,
+                    "mode": "unchanged"}
+
+        if (watermark is not None and stat.st_size >= watermark[0]
+                and file_fingerprint(csv_path, watermark[0]) == watermark[3]):
+            mode, start_offset = "append", int(watermark[0])
+        else:
+            mode, start_offset = ("rewrite" if watermark is not None else "new"), 0
+
+        start = time.perf_counter()
+        timer = metrics.timer()
+        with tempfile.TemporaryDirectory() as work_dir:
+            region_path = os.path.join(work_dir, "region.csv")
+            delta_path = os.path.join(work_dir, "delta.csv")
+            copy_region(csv_path, region_path, start_offset, stat.st_size)
+            # Rows after the watermark are new by construction; anything else is checked against the hashes
+            loaded_counts = load_row_hash_counts(connection, table_name) if mode != "append" and table_existed else None
+            hashes, rows_skipped = filter_new_rows(region_path, delta_path, loaded_counts, chunk_size)
+            timer.lap("incremental.find_new_rows")
+
+            rows_inserted = rows_replaced = 0
+            failed_positions = []
+            columns, column_definitions, profiles = None, None, {}
+            if len(hashes):
+                columns, column_definitions, profiles = infer_column_definitions(delta_path, chunk_size=chunk_size)
+                if table_existed:
+                    profiles = table_column_profiles(connection, table_name, columns, profiles,
+                                                     load_value_formats(connection, table_name, csv_path))
+                    column_definitions = table_column_definitions(connection, table_name)
+                else:
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(column_definitions)});")
+                    connection.commit()
+                # The table's cube is unregistered while rows are loaded and registered again once it has them
+                cube = cube_registry.cube_for_load(table_name, columns, profiles, table_existed)
+                cube_registry.drop(table_name)
+                if key_columns and table_existed:
+                    rows_inserted, rows_replaced, failed_positions = upsert_rows(
+                        connection, delta_path, table_name, columns, key_columns, profiles, len(hashes), batch_size,
+                        chunk_size)
+                else:
+                    rows_inserted, failed_positions = load_rows(connection, delta_path, table_name, columns, profiles,
+                                                                len(hashes), batch_size, chunk_size)
+            if failed_positions is None:
+                # The bulk loader skipped rows without saying which; all of them are recorded as loaded
+                rows_failed = len(hashes) - rows_inserted
+                print(f"{rows_failed} rows were skipped by the bulk loader and will not be loaded again.")
+                loaded_hashes = hashes
+            else:
+                rows_failed = len(failed_positions)
+                loaded_hashes = np.delete(hashes, failed_positions)
+            save_row_hashes(connection, table_name, loaded_hashes, work_dir)
+            loaded_before = int(watermark[4]) if watermark is not None and mode == "append" else 0
+            value_formats = profile_formats(profiles) if profiles else load_value_formats(connection, table_name, csv_path)
+            save_watermark(connection, table_name, csv_path, stat.st_size, stat.st_mtime,
+                           loaded_before + rows_skipped + len(loaded_hashes), value_formats,
+                           complete=not failed_positions)
+            load_time = time.perf_counter() - start
+            timer.lap("incremental.load")
+
+            schema_catalog.invalidate(table_name)
+            result_cache.invalidate_table(table_name)
+            if len(hashes):
+                refresh_derived_data(connection, table_name, cube,
+                                     iter_loaded_chunks(delta_path, profiles, columns, chunk_size=chunk_size),
+                                     columns, column_definitions, profiles, table_existed,
+                                     exact=not rows_replaced and not rows_failed)
+                timer.lap("incremental.cube_and_sample")
+
+        metrics.increment("rows_inserted", rows_inserted)
+        metrics.increment("rows_skipped", rows_skipped)
+        print(f"Loaded '{csv_path}' into '{table_name}' ({mode}): {rows_inserted} rows inserted, "
+              f"{rows_replaced} rows replaced, {rows_skipped} rows already loaded and skipped"
+              + (f", {rows_failed} rows failed." if rows_failed else "."))
+        report_throughput(rows_inserted, load_time)
+        return {"rows_inserted": rows_inserted, "rows_replaced": rows_replaced, "rows_skipped": rows_skipped,
+                "rows_failed": rows_failed, "mode": mode}
+
+    except FileNotFoundError:
+        print("The specified CSV file was not found. Please check the file path and try again.")
+    except pymysql.MySQLError as e:
+        print(f"MySQL Error occurred: {e}")
+    except Exception as e:
+        print(f"Error occurred: {e}")
+    return None
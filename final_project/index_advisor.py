@@ -0,0 +1,295 @@
+import argparse
+import json
+import re
+import threading
+from collections import Counter
+import pymysql
+from connection_pool import pool_aware
+from schema_catalog import schema_catalog
+
+DEFAULT_MAX_INDEXES = 5
+# InnoDB keys are limited to 3072 bytes; longer text columns are indexed on a prefix
+MAX_FULL_INDEX_CHARS = 768
+INDEX_PREFIX_CHARS = 255
+MAX_INDEX_NAME_LENGTH = 64
+
+TABLE_PATTERN = re.compile(r"\bFROM\s+`?(\w+)`?", re.IGNORECASE)
+WHERE_PATTERN = re.compile(r"\bWHERE\s+(.*?)(?=\bGROUP\s+BY\b|\bORDER\s+BY\b|\bLIMIT\b|;|$)", re.IGNORECASE | re.DOTALL)
+GROUP_BY_PATTERN = re.compile(r"\bGROUP\s+BY\s+(.*?)(?=\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|;|$)", re.IGNORECASE | re.DOTALL)
+ORDER_BY_PATTERN = re.compile(r"\bORDER\s+BY\s+(.*?)(?=\bLIMIT\b|;|$)", re.IGNORECASE | re.DOTALL)
+LIMIT_PATTERN = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+CONDITION_PATTERN = re.compile(r"`?(\w+)`?\s*(<>|!=|>=|<=|=|>|<|\bNOT\s+LIKE\b|\bLIKE\b|\bBETWEEN\b|\bIS\b|\bIN\b)",
+                               re.IGNORECASE)
+AGGREGATE_PATTERN = re.compile(r"\b(SUM|COUNT|AVG|MIN|MAX)\(\s*`?(\w+)`?\s*\)", re.IGNORECASE)
+
+EQUALITY_OPERATORS = {"=", "IN"}
+RANGE_OPERATORS = {">", "<", ">=", "<=", "BETWEEN", "LIKE"}
+
+
+# Column usage of one SELECT: equality and range filters, GROUP BY and ORDER BY columns, whether it has
+# a LIMIT, and aggregated columns. Negations (!=, NOT LIKE) and IS [NOT] NULL cannot use an index
+# efficiently and are ignored.
+class QueryShape:
+    def __init__(self, query):
+        table_match = TABLE_PATTERN.search(query)
+        self.table = table_match.group(1).lower() if table_match else None
+        self.equality_columns = []
+        self.range_columns = []
+        where_match = WHERE_PATTERN.search(query)
+        if where_match:
+            for column, operator in CONDITION_PATTERN.findall(where_match.group(1)):
+                operator = " ".join(operator.upper().split())
+                if operator in EQUALITY_OPERATORS and column not in self.equality_columns:
+                    self.equality_columns.append(column)
+                elif operator in RANGE_OPERATORS and column not in self.range_columns:
+                    self.range_columns.append(column)
+        group_match = GROUP_BY_PATTERN.search(query)
+        self.group_columns = split_column_list(group_match.group(1)) if group_match else []
+        order_match = ORDER_BY_PATTERN.search(query)
+        self.order_columns = split_column_list(order_match.group(1)) if order_match else []
+        self.has_limit = bool(LIMIT_PATTERN.search(query))
+        self.aggregates = [(function.upper(), column) for function, column in AGGREGATE_PATTERN.findall(query)]
+
+    # Candidate index columns for this query, following the usual rule: equality columns first, then the
+    # GROUP BY or ORDER BY columns the index can deliver pre-sorted, then at most one range column.
+    def candidate_indexes(self):
+        candidates = []
+        if self.equality_columns or self.range_columns:
+            candidates.append(tuple(self.equality_columns + self.range_columns[:1]))
+            if self.order_columns and not self.range_columns:
+                candidates.append(tuple(self.equality_columns + self.order_columns))
+        if self.group_columns:
+            group_index = list(self.equality_columns) + self.group_columns
+            aggregated = {column for _, column in self.aggregates if column not in group_index}
+            # A single aggregated column is appended so the index also covers the aggregate
+            if len(aggregated) == 1:
+                group_index.append(aggregated.pop())
+            candidates.append(tuple(group_index))
+        elif self.order_columns and not (self.equality_columns or self.range_columns):
+            candidates.append(tuple(self.order_columns))
+        if not (self.equality_columns or self.range_columns or self.group_columns):
+            # MIN/MAX over an indexed column is answered from the end of the index
+            candidates.extend((column,) for function, column in self.aggregates if function in ("MIN", "MAX"))
+        return [candidate for candidate in candidates if candidate]
+
+    def usage(self):
+        return ([("filter", column) for column in self.equality_columns + self.range_columns] +
+                [("group", column) for column in self.group_columns] +
+                [("order", column) for column in self.order_columns])
+
+
+def split_column_list(clause):
+    columns = []
+    for part in clause.split(","):
+        words = part.strip().strip("`").split()
+        if words and re.match(r"^\w+$", words[0].strip("`")):
+            columns.append(words[0].strip("`"))
+    return columns
+
+
+class IndexProposal:
+    def __init__(self, table_name, columns, query_count):
+        self.table_name = table_name
+        self.columns = tuple(columns)
+        self.query_count = query_count
+
+    @property
+    def name(self):
+        return f"idx_{self.table_name}_{'_'.join(self.columns)}"[:MAX_INDEX_NAME_LENGTH]
+
+    def create_statement(self, column_types=None):
+        column_types = column_types or {}
+        parts = []
+        for column in self.columns:
+            length = re.search(r"char\((\d+)\)", column_types.get(column, "").lower())
+            is_text = "text" in column_types.get(column, "").lower()
+            if is_text or (length and int(length.group(1)) > MAX_FULL_INDEX_CHARS):
+                parts.append(f"{column}({INDEX_PREFIX_CHARS})")
+            else:
+                parts.append(column)
+        return f"CREATE INDEX {self.name} ON {self.table_name} ({', '.join(parts)});"
+
+    def __repr__(self):
+        return f"IndexProposal({self.table_name!r}, {self.columns!r}, query_count={self.query_count})"
+
+
+# Thread-safe log of the column usage of executed SELECTs, per table. execute_plan records every plan,
+# so the log reflects the random, keyword and natural-language queries users actually run.
+class QueryUsageLog:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._usage = {}
+        self._candidates = {}
+        self.queries_logged = 0
+
+    def record(self, query):
+        if not query.lstrip().upper().startswith("SELECT"):
+            return
+        shape = QueryShape(query)
+        if not shape.table:
+            return
+        with self._lock:
+            self._usage.setdefault(shape.table, Counter()).update(shape.usage())
+            self._candidates.setdefault(shape.table, Counter()).update(shape.candidate_indexes())
+            self.queries_logged += 1
+
+    def column_usage(self, table_name):
+        with self._lock:
+            return Counter(self._usage.get(table_name.lower(), ()))
+
+    def candidate_counts(self, table_name):
+        with self._lock:
+            return Counter(self._candidates.get(table_name.lower(), ()))
+
+    def clear(self, table_name=None):
+        with self._lock:
+            if table_name is None:
+                self._usage.clear()
+                self._candidates.clear()
+            else:
+                self._usage.pop(table_name.lower(), None)
+                self._candidates.pop(table_name.lower(), None)
+
+
+# Shared usage log fed by query_executor.execute_plan
+query_usage_log = QueryUsageLog()
+
+
+def is_covered(columns, existing_indexes):
+    return any(tuple(index_columns[:len(columns)]) == tuple(columns) for index_columns in existing_indexes)
+
+
+# Rank candidate indexes for a table by how many logged queries would use them. Candidates that are a
+# leading prefix of another candidate or of an existing index are dropped, since that index serves both.
+@pool_aware
+def propose_indexes(connection, table_name, usage_log=query_usage_log, max_indexes=DEFAULT_MAX_INDEXES,
+                    min_queries=1):
+    table_schema = schema_catalog.get_table_schema(connection, table_name)
+    known_columns = {column.lower(): column for column in table_schema.columns}
+    existing_indexes = list(table_schema.indexes.values())
+
+    counts = Counter()
+    for columns, count in usage_log.candidate_counts(table_name).items():
+        if all(column.lower() in known_columns for column in columns):
+            counts[tuple(known_columns[column.lower()] for column in columns)] += count
+
+    # A prefix candidate's queries are served by the longer index as well
+    logged_counts = dict(counts)
+    for columns, count in logged_counts.items():
+        for other in logged_counts:
+            if other != columns and other[:len(columns)] == columns:
+                counts[other] += count
+    candidates = sorted(counts.items(), key=lambda item: (-item[1], len(item[0]), item[0]))
+
+    proposals = []
+    for columns, count in candidates:
+        if count < min_queries or is_covered(columns, existing_indexes):
+            continue
+        if any(other[:len(columns)] == columns for other in counts if other != columns):
+            continue
+        proposals.append(IndexProposal(table_name, columns, count))
+        existing_indexes.append(list(columns))
+        if len(proposals) >= max_indexes:
+            break
+    return proposals
+
+
+@pool_aware
+def create_indexes(connection, proposals):
+    created = []
+    for proposal in proposals:
+        column_types = schema_catalog.get_table_schema(connection, proposal.table_name).column_types
+        statement = proposal.create_statement(column_types)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(statement)
+            connection.commit()
+            created.append(proposal)
+            print(f"Created index {proposal.name} on {proposal.table_name} ({', '.join(proposal.columns)}).")
+        except pymysql.MySQLError as e:
+            print(f"Could not create index {proposal.name}: {e}")
+        schema_catalog.invalidate(proposal.table_name)
+    return created
+
+
+# EXPLAIN a query and return its plan rows as dicts
+@pool_aware
+def explain_query(connection, query, params=None):
+    with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute(f"EXPLAIN {query}", params or None)
+        return cursor.fetchall()
+
+
+# One-line summary of an EXPLAIN: access type, key and estimated rows on MySQL, the plan text elsewhere
+def summarize_explain(plan_rows):
+    summaries = []
+    for row in plan_rows:
+        if "type" in row:
+            summaries.append(f"type={row.get('type')} key={row.get('key')} rows={row.get('rows')}"
+                             + (f" ({row['Extra']})" if row.get("Extra") else ""))
+        else:
+            summaries.append(str(row.get("detail", row)))
+    return "; ".join(summaries)
+
+
+def print_proposals(proposals):
+    if not proposals:
+        print("No index recommendations: the logged queries are already served by existing indexes.")
+        return
+    print("\nRecommended indexes:")
+    for proposal in proposals:
+        print(f"  {proposal.create_statement()}  -- used by {proposal.query_count} logged queries")
+
+
+# Propose indexes from the logged workload and optionally create them
+@pool_aware
+def advise_indexes(connection, table_name, create=False, usage_log=query_usage_log,
+                   max_indexes=DEFAULT_MAX_INDEXES):
+    proposals = propose_indexes(connection, table_name, usage_log, max_indexes)
+    print_proposals(proposals)
+    if create and proposals:
+        return create_indexes(connection, proposals)
+    return proposals
+
+
+# Log a sample of the queries generate_sample_queries produces for a table, for use when no workload
+# has been recorded yet
+@pool_aware
+def log_sample_workload(connection, table_name, count, usage_log=query_usage_log):
+    from generate_sample_queries import generate_sample_queries
+    for _ in range(count):
+        query_result = generate_sample_queries(connection, table_name)
+        if query_result:
+            usage_log.record(query_result[0])
+
+
+# Log the SQL of a batch_mode results file (JSONL with a "sql" field per line)
+def log_workload_file(path, usage_log=query_usage_log):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                query = json.loads(line).get("sql")
+                if query:
+                    usage_log.record(query)
+
+
+if __name__ == "__main__":
+    from backends import add_backend_arguments, get_backend
+    parser = argparse.ArgumentParser(description="Recommend (and optionally create) indexes for a ChatDB table")
+    parser.add_argument("table")
+    parser.add_argument("--workload", default=None, help="batch_mode JSONL results whose SQL is the workload")
+    parser.add_argument("--sample", type=int, default=100, help="Generated sample queries to use without --workload")
+    parser.add_argument("--max-indexes", type=int, default=DEFAULT_MAX_INDEXES)
+    parser.add_argument("--create", action="store_true", help="Create the recommended indexes")
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+
+    connection = get_backend(args.backend, args.database).connect()
+    try:
+        if args.workload:
+            log_workload_file(args.workload)
+        else:
+            log_sample_workload(connection, args.table, args.sample)
+        advise_indexes(connection, args.table, create=args.create, max_indexes=args.max_indexes)
+    finally:
+        connection.close()
@@ -0,0 +1,234 @@
+import cProfile
+import functools
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from lazy_imports import lazy_import
+
+pyinstrument = lazy_import("pyinstrument")
+
+# Set CHATDB_METRICS_LOG to a file path (or - for stderr) to write one JSON line per request
+METRICS_LOG_PATH = os.environ.get("CHATDB_METRICS_LOG")
+# Set CHATDB_PROFILE to cprofile or pyinstrument to profile every request; reports go to PROFILE_DIR
+PROFILER = os.environ.get("CHATDB_PROFILE")
+PROFILE_DIR = os.environ.get("CHATDB_PROFILE_DIR", "chatdb_profiles")
+PROFILERS = ("cprofile", "pyinstrument")
+# Upper bounds, in seconds, of the stage duration histogram buckets
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+METRIC_PREFIX = "chatdb"
+
+METRIC_NAME_PATTERN = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def metric_name(*parts):
+    return METRIC_NAME_PATTERN.sub("_", "_".join((METRIC_PREFIX,) + parts))
+
+
+# Stage timings and counters of one request (a CLI step or a service call), written to the metrics
+# log when it finishes
+class RequestTrace:
+    def __init__(self, kind):
+        self.kind = kind
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.elapsed = None
+        self.profile_path = None
+
+    def as_dict(self):
+        return {"request": self.kind, "started": round(self.started, 3),
+                "elapsed_ms": round(self.elapsed * 1000, 3) if self.elapsed is not None else None,
+                "stages_ms": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+                "counters": dict(self.counters), "profile": self.profile_path}
+
+
+# Records how long a sequence of stages takes: each lap() observes the time since the previous one
+class StageTimer:
+    def __init__(self, registry):
+        self.registry = registry
+        self.last = time.perf_counter()
+
+    def lap(self, name):
+        now = time.perf_counter()
+        self.registry.observe(name, now - self.last)
+        self.last = now
+
+
+# Process-wide stage timers (count, total, max and a latency histogram per stage) and counters such as
+# rows fetched and cache hits. Each value is also added to the RequestTrace of the request running on
+# the current thread, if any. Exported as a snapshot dict or in the Prometheus text format.
+class Metrics:
+    def __init__(self, buckets=LATENCY_BUCKETS, log_path=METRICS_LOG_PATH, profiler=PROFILER,
+                 profile_dir=PROFILE_DIR):
+        self.buckets = buckets
+        self.log_path = log_path
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._profile_numbers = itertools.count(1)
+
+    @property
+    def current_request(self):
+        return getattr(self._local, "trace", None)
+
+    def observe(self, name, seconds):
+        bucket = bisect_left(self.buckets, seconds)
+        with self._lock:
+            stage = self._stages.get(name)
+            if stage is None:
+                stage = self._stages[name] = {"count": 0, "total": 0.0, "max": 0.0, "buckets": [0] * len(self.buckets)}
+            stage["count"] += 1
+            stage["total"] += seconds
+            stage["max"] = max(stage["max"], seconds)
+            if bucket < len(self.buckets):
+                stage["buckets"][bucket] += 1
+        trace = self.current_request
+        if trace is not None:
+            trace.stages[name] = trace.stages.get(name, 0.0) + seconds
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+        trace = self.current_request
+        if trace is not None:
+            trace.counters[name] = trace.counters.get(name, 0) + amount
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timer(self):
+        return StageTimer(self)
+
+    # Decorator that times every call of a function as the stage name
+    def timed(self, name):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Trace one request: its stages and counters are collected, it is optionally profiled (profile
+    # overrides CHATDB_PROFILE) and written to the metrics log. Requests nested in another one on the
+    # same thread are part of the outer request.
+    @contextmanager
+    def request(self, kind, profile=None):
+        if self.current_request is not None:
+            yield self.current_request
+            return
+        trace = RequestTrace(kind)
+        self._local.trace = trace
+        profiler = self._start_profiler(profile or self.profiler)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            trace.elapsed = time.perf_counter() - start
+            self._local.trace = None
+            if profiler is not None:
+                trace.profile_path = self._save_profile(profiler, kind)
+            self.observe(f"request.{kind}", trace.elapsed)
+            self.log(trace)
+
+    def _start_profiler(self, profiler_name):
+        if profiler_name not in PROFILERS:
+            return None
+        if profiler_name == "pyinstrument" and pyinstrument is None:
+            print("pyinstrument is not installed (pip install pyinstrument); profiling with cProfile instead.")
+            profiler_name = "cprofile"
+        try:
+            if profiler_name == "pyinstrument":
+                profiler = pyinstrument.Profiler()
+                profiler.start()
+            else:
+                profiler = cProfile.Profile()
+                profiler.enable()
+        except (RuntimeError, ValueError) as e:
+            # Only one profiler can run at a time, e.g. when several service requests ask for one
+            print(f"Request not profiled: {e}")
+            return None
+        return profiler
+
+    def _save_profile(self, profiler, kind):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base_path = os.path.join(self.profile_dir, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{next(self._profile_numbers)}")
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(f"{base_path}.prof")
+            return f"{base_path}.prof"
+        profiler.stop()
+        with open(f"{base_path}.txt", "w") as report:
+            report.write(profiler.output_text())
+        return f"{base_path}.txt"
+
+    def log(self, trace):
+        if not self.log_path:
+            return
+        line = json.dumps(trace.as_dict(), default=str)
+        if self.log_path == "-":
+            print(line, file=sys.stderr)
+            return
+        with self._lock:
+            with open(self.log_path, "a") as log_file:
+                log_file.write(line + "\n")
+
+    def snapshot(self):
+        with self._lock:
+            return {"counters": dict(self._counters),
+                    "stages": {name: {"count": stage["count"], "total_ms": round(stage["total"] * 1000, 3),
+                                      "max_ms": round(stage["max"] * 1000, 3)}
+                               for name, stage in self._stages.items()}}
+
+    # Prometheus text exposition of the counters and stage histograms. gauges maps a component name to
+    # its stats() dict (e.g. the caches and the connection pool); their numeric values are exported too.
+    def prometheus_text(self, gauges=None):
+        with self._lock:
+            counters = dict(self._counters)
+            stages = {name: dict(stage, buckets=list(stage["buckets"])) for name, stage in self._stages.items()}
+        lines = []
+        for name, value in sorted(counters.items()):
+            full_name = metric_name(name, "total")
+            lines += [f"# TYPE {full_name} counter", f"{full_name} {value}"]
+        if stages:
+            full_name = metric_name("stage", "seconds")
+            lines.append(f"# TYPE {full_name} histogram")
+            for name, stage in sorted(stages.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, stage["buckets"]):
+                    cumulative += count
+                    lines.append(f'{full_name}_bucket{{stage="{name}",le="{bound:g}"}} {cumulative}')
+                lines += [f'{full_name}_bucket{{stage="{name}",le="+Inf"}} {stage["count"]}',
+                          f'{full_name}_sum{{stage="{name}"}} {stage["total"]:.6f}',
+                          f'{full_name}_count{{stage="{name}"}} {stage["count"]}']
+        for component, stats in sorted((gauges or {}).items()):
+            for key, value in sorted(stats.items()):
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                full_name = metric_name(component, key)
+                lines += [f"# TYPE {full_name} gauge", f"{full_name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+
+# Shared metrics recorded by simple_chatdb, generate_sample_queries, handle_natural_language and
+# query_executor, and served by chatdb_service at /metrics
+metrics = Metrics()
@@ -0,0 +1,30 @@
+import importlib
+import importlib.util
+import sys
+import threading
+import types
+
+
+# Stand-in for a module that is imported on first attribute access, so heavy dependencies (pandas,
+# NumPy, DuckDB) are only loaded by the code paths that use them and not at CLI startup. Loading is
+# guarded by a lock because the service and the loaders touch these modules from several threads.
+class LazyModule(types.ModuleType):
+    def __init__(self, name):
+        super().__init__(name)
+        self._load_lock = threading.Lock()
+
+    def __getattr__(self, attribute):
+        with self._load_lock:
+            module = importlib.import_module(self.__name__)
+            self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+
+# A LazyModule for name, the module itself when it is already imported, or None when it is not installed
+def lazy_import(name):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        return None
+    return LazyModule(name)
@@ -0,0 +1,182 @@
+import glob
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import pymysql
+from aggregate_cube import cube_registry
+from csv_loader import (DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, SCHEMA_SAMPLE_ROWS, build_column_definitions,
+                        build_insert_query, bulk_load, convert_chunk, infer_column_profiles, insert_batches,
+                        iter_csv_chunks, iter_loaded_chunks, iter_row_batches, merge_column_profiles, report_throughput, table_exists)
+from incremental_ingest import (forget_loads, load_value_formats, refresh_derived_data, table_column_definitions,
+                                table_column_profiles)
+from lazy_imports import lazy_import
+from query_cache import result_cache
+from schema_catalog import schema_catalog
+
+pd = lazy_import("pandas")
+
+DEFAULT_DISCRIMINATOR_COLUMN = "source_name"
+
+
+def resolve_csv_paths(path_or_pattern):
+    if os.path.isdir(path_or_pattern):
+        path_or_pattern = os.path.join(path_or_pattern, "*.csv")
+    return sorted(glob.glob(path_or_pattern))
+
+
+# Label each file by what is left of its name once the prefix and suffix shared by all files are
+# removed, e.g. costco_sales_data_usa.csv -> usa
+def discriminator_values(csv_paths):
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in csv_paths]
+    prefix = os.path.commonprefix(stems) if len(stems) > 1 else ""
+    suffix = os.path.commonprefix([stem[::-1] for stem in stems])[::-1] if len(stems) > 1 else ""
+    labels = {}
+    for path, stem in zip(csv_paths, stems):
+        label = stem[len(prefix):len(stem) - len(suffix)]
+        labels[path] = label if label else stem
+    return labels
+
+
+# Runs in a worker process: each worker opens its own connection, parses its file in chunks and inserts it
+def load_file(connect_function, connect_kwargs, csv_path, table_name, constants, profiles, batch_size, chunk_size,
+              use_local_infile):
+    start = time.perf_counter()
+    connection = connect_function(**connect_kwargs)
+    try:
+        columns = list(pd.read_csv(csv_path, nrows=0).columns)
+        constants = {col: value for col, value in constants.items() if col not in columns}
+
+        rows_inserted = None
+        failed_count = 0
+        if use_local_infile:
+            try:
+                rows_inserted = bulk_load(connection, csv_path, table_name, columns, constants, profiles)
+            except pymysql.MySQLError as e:
+                print(f"Bulk load failed for {csv_path}, falling back to batched inserts. Error: {e}")
+
+        if rows_inserted is None:
+            insert_query = build_insert_query(table_name, columns + list(constants))
+            chunks = (convert_chunk(chunk, profiles).assign(**constants) for chunk in iter_csv_chunks(csv_path, chunk_size))
+            rows_inserted, failed_rows = insert_batches(connection, insert_query, iter_row_batches(chunks, batch_size))
+            failed_count = len(failed_rows)
+    finally:
+        connection.close()
+    return csv_path, rows_inserted, failed_count, time.perf_counter() - start
+
+
+def build_create_table_query(table_name, column_definitions, discriminator_column, labels, partitioned):
+    if not partitioned:
+        return f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(column_definitions)});"
+
+    # MySQL requires the partitioning column to be part of every unique key, including the primary key
+    column_definitions = ["id INT AUTO_INCREMENT"] + column_definitions[1:] + [f"PRIMARY KEY (id, {discriminator_column})"]
+    partitions = [f"PARTITION p_{re.sub(r'[^0-9A-Za-z_]', '_', label)} VALUES IN ('{label}')"
+                  for label in sorted(set(labels))]
+    return (f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(column_definitions)}) "
+            f"PARTITION BY LIST COLUMNS ({discriminator_column}) ({', '.join(partitions)});")
+
+
+# Load many CSV files (a directory or a glob pattern) into one table in parallel. Schema inference and
+# loading both run in a process pool, and every row is tagged with the file it came from in
+# discriminator_column. connect_function/connect_kwargs are used to open one connection per worker.
+# Embedded databases that only one process may write to are loaded from threads instead (use_threads).
+def ingest_csv_files(connect_function, connect_kwargs, path_or_pattern, table_name,
+                     discriminator_column=DEFAULT_DISCRIMINATOR_COLUMN, partitioned=False, max_workers=None,
+                     batch_size=DEFAULT_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE, use_local_infile=True,
+                     use_threads=False):
+    try:
+        csv_paths = resolve_csv_paths(path_or_pattern)
+        if not csv_paths:
+            print(f"No CSV files matched '{path_or_pattern}'.")
+            return None
+
+        labels = discriminator_values(csv_paths)
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor, \
+                ThreadPoolExecutor(max_workers=max_workers) as thread_executor:
+            schemas = list(executor.map(infer_column_profiles, csv_paths, [SCHEMA_SAMPLE_ROWS] * len(csv_paths),
+                                        [chunk_size] * len(csv_paths)))
+            for csv_path, schema in zip(csv_paths, schemas):
+                if not schema[0]:
+                    print(f"Skipping empty CSV file: {csv_path}")
+            csv_paths = [csv_path for csv_path, schema in zip(csv_paths, schemas) if schema[0]]
+            schemas = [schema for schema in schemas if schema[0]]
+            if not schemas:
+                print("All matched CSV files are empty.")
+                return None
+
+            columns, profiles = merge_column_profiles(schemas)
+            add_discriminator = bool(discriminator_column) and discriminator_column not in columns
+            if not add_discriminator and partitioned:
+                print("Partitioning requires a discriminator column that is not already in the CSV files.")
+                return None
+            table_columns = columns + ([discriminator_column] if add_discriminator else [])
+            connection = connect_function(**connect_kwargs)
+            try:
+                table_existed = table_exists(connection, table_name)
+                if table_existed:
+                    # Rows added to an existing table are converted the way the table stores them, with the
+                    # date and time formats recorded when it was loaded, not as the new files alone suggest
+                    profiles = table_column_profiles(connection, table_name, columns, profiles,
+                                                     load_value_formats(connection, table_name, None))
+                    column_definitions = table_column_definitions(connection, table_name)
+                else:
+                    column_definitions = build_column_definitions(columns, profiles)
+                    if add_discriminator:
+                        label_length = max(len(labels[path]) for path in csv_paths)
+                        column_definitions.append(f"{discriminator_column} VARCHAR({max(32, label_length)}) NOT NULL")
+                cube = cube_registry.cube_for_load(table_name, table_columns, profiles, table_existed)
+                cube_registry.drop(table_name)
+                if not table_existed:
+                    create_table_query = build_create_table_query(table_name, column_definitions, discriminator_column,
+                                                                  [labels[path] for path in csv_paths], partitioned)
+                    with connection.cursor() as cursor:
+                        cursor.execute(create_table_query)
+                    connection.commit()
+            finally:
+                connection.close()
+
+            load_executor = thread_executor if use_threads else executor
+            futures = [load_executor.submit(load_file, connect_function, connect_kwargs, csv_path, table_name,
+                                            {discriminator_column: labels[csv_path]} if add_discriminator else {},
+                                            profiles, batch_size, chunk_size, use_local_infile)
+                       for csv_path in csv_paths]
+
+            results = []
+            for future in as_completed(futures):
+                csv_path, rows_inserted, failed_count, elapsed = future.result()
+                results.append((csv_path, rows_inserted, failed_count, elapsed))
+                report_throughput(rows_inserted, elapsed, label=f"[{labels[csv_path]}] Inserted")
+                if failed_count:
+                    print(f"[{labels[csv_path]}] {failed_count} rows could not be inserted and were skipped.")
+
+        schema_catalog.invalidate(table_name)
+        result_cache.invalidate_table(table_name)
+        # The cube, sample, column statistics and snapshot are updated with the files' rows in one more pass,
+        # or rebuilt from the table if some rows were skipped
+        connection = connect_function(**connect_kwargs)
+        try:
+            # Rows loaded from many files are not hashed, so incremental loads cannot be used on the table
+            forget_loads(connection, table_name)
+            chunks = (chunk for csv_path in csv_paths for chunk in iter_loaded_chunks(
+                csv_path, profiles, table_columns, {discriminator_column: labels[csv_path]} if add_discriminator else {},
+                chunk_size))
+            refresh_derived_data(connection, table_name, cube, chunks, table_columns, column_definitions, profiles,
+                                 table_existed, exact=not any(result[2] for result in results))
+        finally:
+            connection.close()
+        total_rows = sum(result[1] for result in results)
+        wall_time = time.perf_counter() - start
+        serial_time = sum(result[3] for result in results)
+        print(f"Table '{table_name}' created and {total_rows} rows inserted from {len(results)} files.")
+        report_throughput(total_rows, wall_time, label="Total: inserted")
+        print(f"Sum of per-file load times: {serial_time:.2f}s (wall clock {wall_time:.2f}s).")
+        return results
+
+    except pymysql.MySQLError as e:
+        print(f"MySQL Error occurred: {e}")
+    except Exception as e:
+        print(f"Error occurred: {e}")
+    return None
@@ -0,0 +1,258 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_TRANSLATIONS = 1024
+# A persisted translation cache is written once this many new entries, or this many seconds since the
+# last write, have accumulated, and at exit
+TRANSLATION_FLUSH_ENTRIES = 32
+TRANSLATION_FLUSH_SECONDS = 5
+
+# Quoted literals are kept verbatim; whitespace anywhere else is collapsed
+SQL_TOKEN_PATTERN = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")|\s+")
+TABLE_REFERENCE_PATTERN = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?", re.IGNORECASE)
+
+
+def normalize_sql(query):
+    normalized = SQL_TOKEN_PATTERN.sub(lambda match: match.group(1) or " ", query.strip())
+    return normalized.rstrip("; ")
+
+
+def referenced_tables(query):
+    return {table.lower() for table in TABLE_REFERENCE_PATTERN.findall(query)}
+
+
+# Rough in-memory footprint of a result set, used for the byte budget
+def estimate_size(rows):
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        values = row.values() if isinstance(row, dict) else row
+        for value in values:
+            size += sys.getsizeof(value)
+    return size
+
+
+# Rows as a tuple, with dict rows copied; tuple rows are immutable and shared
+def copy_rows(rows):
+    return tuple(dict(row) if isinstance(row, dict) else row for row in rows)
+
+
+# LRU cache of SELECT results keyed by normalized SQL text, parameters and cursor type. Entries are
+# bounded by total estimated size and dropped when a table they read from is reloaded. Rows are kept
+# as a tuple and dict rows are copied in and out, so callers cannot change a cached result.
+class QueryResultCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._table_keys = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def make_key(self, query, params=None, cursor_class=None):
+        if isinstance(params, dict):
+            params = tuple(sorted(params.items()))
+        elif params is not None:
+            params = tuple(params)
+        return normalize_sql(query), params, getattr(cursor_class, "__name__", None)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (self.ttl is not None and time.monotonic() - entry[2] > self.ttl):
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            rows = entry[0]
+        return copy_rows(rows)
+
+    def put(self, key, rows):
+        rows = copy_rows(rows)
+        size = estimate_size(rows)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (rows, size, time.monotonic())
+            self.current_bytes += size
+            for table in referenced_tables(key[0]):
+                self._table_keys.setdefault(table, set()).add(key)
+            while self.current_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def _remove(self, key):
+        rows, size, _ = self._entries.pop(key)
+        self.current_bytes -= size
+        for table in referenced_tables(key[0]):
+            keys = self._table_keys.get(table)
+            if keys:
+                keys.discard(key)
+
+    def invalidate_table(self, table_name):
+        with self._lock:
+            for key in list(self._table_keys.pop(table_name.lower(), ())):
+                if key in self._entries:
+                    self._remove(key)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._table_keys.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "invalidations": self.invalidations, "entries": len(self._entries),
+                    "bytes": self.current_bytes, "max_bytes": self.max_bytes}
+
+
+# Shared result cache used by every query execution path
+result_cache = QueryResultCache()
+
+
+# Run a query through the result cache. Only SELECT statements are cached.
+def execute_cached(connection, query, params=None, cursor_class=None):
+    cacheable = query.lstrip().upper().startswith("SELECT")
+    if cacheable:
+        key = result_cache.make_key(query, params, cursor_class)
+        rows = result_cache.get(key)
+        if rows is not None:
+            return rows
+
+    cursor = connection.cursor(cursor_class) if cursor_class else connection.cursor()
+    with cursor:
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+
+    if cacheable:
+        result_cache.put(key, rows)
+    return rows
+
+
+# Questions that differ only in case or spacing translate to the same SQL
+def canonicalize_question(sentence):
+    return " ".join(sentence.lower().split())
+
+
+# stats_version identifies the column statistics a translation was made with, if the table has them
+def schema_fingerprint(selected_table, table_structure, stats_version=None):
+    key = [selected_table, sorted(table_structure.items())] + ([stats_version] if stats_version is not None else [])
+    payload = json.dumps(key, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+# Bounded LRU of natural-language translations keyed by canonical question and schema fingerprint.
+# With a persist_path the cache is loaded at start-up and new entries are written in batches (and at
+# exit), so a restarted process answers known questions without running the NLP pipeline and a busy
+# one does not rewrite the file for every question.
+class TranslationCache:
+    def __init__(self, max_entries=DEFAULT_MAX_TRANSLATIONS, persist_path=None,
+                 flush_entries=TRANSLATION_FLUSH_ENTRIES, flush_seconds=TRANSLATION_FLUSH_SECONDS):
+        self.max_entries = max_entries
+        self.persist_path = persist_path
+        self.flush_entries = flush_entries
+        self.flush_seconds = flush_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        # Entries added since the file was last written
+        self._unsaved = 0
+        self._last_save = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.saves = 0
+        if persist_path:
+            self.load(persist_path)
+        atexit.register(self.flush)
+
+    def get(self, sentence, fingerprint):
+        key = f"{fingerprint}:{canonicalize_question(sentence)}"
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], list(entry[1])
+
+    def put(self, sentence, fingerprint, query, params):
+        key = f"{fingerprint}:{canonicalize_question(sentence)}"
+        with self._lock:
+            self._entries[key] = (query, list(params or []))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._unsaved += 1
+            due = (self._unsaved >= self.flush_entries
+                   or time.monotonic() - self._last_save >= self.flush_seconds)
+        if self.persist_path and due:
+            self.flush()
+
+    def load(self, path):
+        self.persist_path = path
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable translation cache {path}: {e}")
+            return
+        with self._lock:
+            for key, (query, params) in entries[-self.max_entries:]:
+                self._entries[key] = (query, params)
+
+    def save(self, only_unsaved=False):
+        with self._save_lock:
+            with self._lock:
+                # Threads that found a batch due at the same time wait here; the first one writes it
+                if only_unsaved and not self._unsaved:
+                    return
+                entries = [[key, list(value)] for key, value in self._entries.items()]
+                self._unsaved = 0
+                self._last_save = time.monotonic()
+                self.saves += 1
+            temp_path = f"{self.persist_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(temp_path, self.persist_path)
+
+    # Write entries not saved yet
+    def flush(self):
+        if self.persist_path:
+            self.save(only_unsaved=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "max_entries": self.max_entries, "persist_path": self.persist_path, "saves": self.saves,
+                    "unsaved": self._unsaved}
+
+
+# Shared translation cache; set CHATDB_TRANSLATION_CACHE to a file path to keep it across restarts
+translation_cache = TranslationCache(persist_path=os.environ.get("CHATDB_TRANSLATION_CACHE"))
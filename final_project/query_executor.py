@@ -0,0 +1,254 @@
+import re
+import time
+import pymysql
+from aggregate_cube import cube_registry
+from approximate_query import CONFIDENCE_LEVEL, plan_estimate
+from index_advisor import query_usage_log
+from instrumentation import metrics
+from query_cache import estimate_size, result_cache
+from query_guard import query_guard
+from snapshot_cache import snapshot_cache
+
+DEFAULT_FETCH_SIZE = 500
+# Streamed results up to this many rows are also stored in the result cache
+CACHEABLE_ROW_LIMIT = 10000
+
+LIMIT_PATTERN = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+
+
+# Add a LIMIT to queries that have none so a row cap is enforced by the server instead of the client
+# reading and discarding rows. One extra row is requested to tell whether the result was truncated.
+def apply_row_cap(query, max_rows):
+    if max_rows is None or LIMIT_PATTERN.search(query):
+        return query
+    return f"{query.rstrip().rstrip(';')} LIMIT {max_rows + 1};"
+
+
+# Iterable over a query result that is fetched from an unbuffered server-side cursor (SSCursor) in
+# fetch_size batches, so at most one batch is held in client memory. Rows are yielded as soon as the
+# first batch arrives; time_to_first_row, elapsed and the row counts are filled in while iterating and
+# recorded in the shared metrics when iteration ends. Aggregates the table's pre-aggregated cube can
+# answer are served from it without a query, and sample-row and aggregate queries on a table with an
+# up-to-date columnar snapshot are answered from the snapshot (see snapshot_cache). Queries that do go to the database pass the query guard
+# first (which may cap their rows or reject them) and run under its timeout.
+class StreamedResult:
+    def __init__(self, connection, query, params=None, dict_rows=False, fetch_size=DEFAULT_FETCH_SIZE,
+                 max_rows=None, use_cache=True, use_cube=True, use_snapshot=True):
+        self.connection = connection
+        self.query = apply_row_cap(query, max_rows)
+        self.params = params
+        self.dict_rows = dict_rows
+        self.fetch_size = fetch_size
+        self.max_rows = max_rows
+        self.cursor_class = pymysql.cursors.SSDictCursor if dict_rows else pymysql.cursors.SSCursor
+        self.cache_key = None
+        if use_cache and self.query.lstrip().upper().startswith("SELECT"):
+            self.cache_key = result_cache.make_key(self.query, params, self.cursor_class)
+        self.use_cube = use_cube
+        self.use_snapshot = use_snapshot
+        self.rows_returned = 0
+        self.rows_fetched = 0
+        self.bytes_fetched = 0
+        self.time_to_first_row = None
+        self.elapsed = None
+        self.truncated = False
+        self.from_cache = False
+        self.from_cube = False
+        self.from_snapshot = False
+        self.approximate = False
+        self.guard_decision = None
+
+    def __iter__(self):
+        try:
+            yield from self._iter_rows()
+        finally:
+            self._record_metrics()
+
+    def _iter_rows(self):
+        start = time.perf_counter()
+        cached_rows = result_cache.get(self.cache_key) if self.cache_key else None
+        if cached_rows is not None:
+            self.from_cache = True
+            yield from self._yield_rows((cached_rows,), start)
+            return
+        cube_rows = cube_registry.answer(self.query, self.params, self.dict_rows) if self.use_cube else None
+        if cube_rows is not None:
+            self.from_cube = True
+            yield from self._yield_rows((cube_rows,), start)
+            return
+        snapshot_rows = (snapshot_cache.answer(self.connection, self.query, self.params, self.dict_rows)
+                         if self.use_snapshot else None)
+        if snapshot_rows is not None:
+            self.from_snapshot = True
+            yield from self._yield_rows((snapshot_rows,), start)
+            return
+
+        self.guard_decision = query_guard.check(self.connection, self.query, self.params)
+        if self.guard_decision.row_cap:
+            self.max_rows = min(self.max_rows or self.guard_decision.row_cap, self.guard_decision.row_cap)
+            self.query = apply_row_cap(self.query, self.max_rows)
+        deadline = query_guard.deadline(self.connection, self.query)
+        cursor = self.connection.cursor(self.cursor_class)
+        try:
+            with deadline.waiting():
+                cursor.execute(query_guard.apply_timeout_hint(self.connection, self.query), self.params)
+            collected = [] if self.cache_key else None
+            for row in self._yield_rows(self._fetch_batches(cursor, deadline), start, collected):
+                yield row
+            if self.cache_key and not self.truncated:
+                result_cache.put(self.cache_key, collected)
+        finally:
+            # Closing an unbuffered cursor reads any rows that were not consumed
+            cursor.close()
+
+    def _fetch_batches(self, cursor, deadline):
+        row_size = None
+        while True:
+            with deadline.waiting():
+                batch = cursor.fetchmany(self.fetch_size)
+            if not batch:
+                break
+            # Bytes fetched are estimated from the in-memory size of the first batch
+            if row_size is None:
+                row_size = estimate_size(batch) / len(batch)
+            self.rows_fetched += len(batch)
+            self.bytes_fetched += round(row_size * len(batch))
+            yield batch
+
+    def _yield_rows(self, batches, start, collected=None):
+        for batch in batches:
+            for row in batch:
+                if self.max_rows is not None and self.rows_returned >= self.max_rows:
+                    self.truncated = True
+                    self.elapsed = time.perf_counter() - start
+                    return
+                if self.time_to_first_row is None:
+                    self.time_to_first_row = time.perf_counter() - start
+                if collected is not None and self.cache_key:
+                    if len(collected) < CACHEABLE_ROW_LIMIT:
+                        collected.append(row)
+                    else:
+                        # Too large to cache; stop holding on to rows
+                        collected.clear()
+                        self.cache_key = None
+                self.rows_returned += 1
+                yield row
+        self.elapsed = time.perf_counter() - start
+
+    def _record_metrics(self):
+        if self.from_cache:
+            metrics.increment("result_cache_hits")
+        elif self.from_cube:
+            metrics.increment("cube_hits")
+        elif self.from_snapshot:
+            metrics.increment("snapshot_hits")
+        elif self.approximate:
+            metrics.increment("approximate_queries")
+        else:
+            metrics.increment("database_queries")
+            metrics.increment("rows_fetched", self.rows_fetched)
+            metrics.increment("bytes_fetched", self.bytes_fetched)
+        metrics.increment("rows_returned", self.rows_returned)
+        if self.time_to_first_row is not None:
+            metrics.observe("query.first_row", self.time_to_first_row)
+        if self.elapsed is not None:
+            metrics.observe("query.execute", self.elapsed)
+
+
+def stream_query(connection, query, params=None, dict_rows=False, fetch_size=DEFAULT_FETCH_SIZE, max_rows=None,
+                 use_cache=True, use_cube=True, use_snapshot=True):
+    return StreamedResult(connection, query, params, dict_rows, fetch_size, max_rows, use_cache, use_cube,
+                          use_snapshot)
+
+
+# Result of a SUM/COUNT/AVG query estimated from the table's sample (see approximate_query). Each
+# aggregate is followed by the low and high ends of its confidence interval.
+class ApproximateResult(StreamedResult):
+    def __init__(self, connection, estimate, dict_rows=False, max_rows=None):
+        super().__init__(connection, estimate.sample_query, None, dict_rows, max_rows=max_rows, use_cache=False,
+                         use_cube=False, use_snapshot=False)
+        self.estimate = estimate
+        self.approximate = True
+
+    def _iter_rows(self):
+        start = time.perf_counter()
+        yield from self._yield_rows((self.estimate.run(self.connection, self.dict_rows),), start)
+
+
+# A translated or generated query ready to run: the SQL, its parameters and a readable description.
+# Query builders return plans and execute_plan is the only place a plan is sent to the database.
+class QueryPlan:
+    def __init__(self, sql, params=None, description="", source=None):
+        self.sql = sql
+        self.params = list(params) if params else []
+        self.description = description
+        self.source = source
+
+    def __repr__(self):
+        return f"QueryPlan(sql={self.sql!r}, params={self.params!r}, source={self.source!r})"
+
+
+# Wrap the (query, description) tuples returned by generate_sample_queries
+def plan_from_generated(query_result, source="generated"):
+    if not query_result:
+        return None
+    query, description = query_result
+    return QueryPlan(query, description=description, source=source)
+
+
+# Run a plan exactly once; the returned StreamedResult carries the rows and timing. Its column usage is
+# logged for the index advisor. With approximate=True, SUM/COUNT/AVG queries on tables that have a
+# sample are estimated from the sample instead, unless the table's cube has their exact answer.
+def execute_plan(connection, plan, dict_rows=False, max_rows=None, fetch_size=DEFAULT_FETCH_SIZE, use_cache=True,
+                 use_cube=True, approximate=False):
+    query_usage_log.record(plan.sql)
+    # The cube answers exactly and as fast as the sample estimates, so the sample is used only without it
+    if approximate and use_cube and cube_registry.can_answer(plan.sql, plan.params):
+        approximate = False
+    estimate = plan_estimate(connection, plan.sql, plan.params) if approximate else None
+    if estimate is not None:
+        return ApproximateResult(connection, estimate, dict_rows, max_rows)
+    return stream_query(connection, plan.sql, plan.params or None, dict_rows, fetch_size, max_rows, use_cache, use_cube)
+
+
+# Print a plan, execute it once and print its rows
+def run_plan(connection, plan, dict_rows=False, max_rows=None, page_size=None, approximate=False):
+    print(f"\nGenerated Query: {plan.sql}")
+    if plan.params:
+        print("Parameters:", plan.params)
+    if plan.description:
+        print(f"Description: {plan.description}")
+    return print_streamed_rows(execute_plan(connection, plan, dict_rows, max_rows, approximate=approximate),
+                               page_size=page_size)
+
+
+# Print rows as they arrive. With a page_size the user is asked before each further page is shown.
+def print_streamed_rows(result, header="\nQuery Results:", page_size=None):
+    printed_header = False
+    printing = 0.0
+    for row in result:
+        start = time.perf_counter()
+        if not printed_header:
+            print(header)
+            printed_header = True
+        print(row)
+        printing += time.perf_counter() - start
+        if page_size and result.rows_returned % page_size == 0:
+            if input("-- more -- (press Enter to continue, or q to stop): ").strip().lower() == "q":
+                break
+    metrics.observe("cli.print_rows", printing)
+
+    if not printed_header:
+        print("\nNo results returned by the query.")
+        return result
+    if result.truncated:
+        guard_cap = result.guard_decision is not None and result.guard_decision.row_cap == result.max_rows
+        print(f"Result truncated to {result.max_rows} rows" + (" by the query guard." if guard_cap else "."))
+    source = (" (from cache)" if result.from_cache else " (from aggregate cube)" if result.from_cube
+              else " (from columnar snapshot)" if result.from_snapshot else "")
+    elapsed = f"{result.elapsed * 1000:.1f} ms" if result.elapsed is not None else "stopped early"
+    print(f"{result.rows_returned} rows in {elapsed}; first row after {result.time_to_first_row * 1000:.1f} ms{source}.")
+    if result.approximate:
+        print(f"Approximate: estimated from a sample of {result.estimate.sample_rows} of "
+              f"{result.estimate.population_rows} rows, with {CONFIDENCE_LEVEL:.0%} confidence intervals (_low, _high).")
+    return result
@@ -0,0 +1,319 @@
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import pymysql
+from instrumentation import metrics
+
+
+def env_limit(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return (float(value) if "." in value else int(value)) or None
+
+
+# Queries estimated to read more rows than GUARD_LIMIT_ROWS get a LIMIT of GUARD_AUTO_LIMIT rows if they
+# have none; above GUARD_REJECT_ROWS they are rejected unless a LIMIT already bounds the work or they
+# aggregate (a full-scan COUNT(*) or GROUP BY is a normal question; only the timeout bounds it). Every
+# query that reaches the database is cancelled after QUERY_TIMEOUT seconds of database time. Set a
+# variable to 0 to turn that check off.
+GUARD_LIMIT_ROWS = env_limit("CHATDB_GUARD_LIMIT_ROWS", 100000)
+GUARD_REJECT_ROWS = env_limit("CHATDB_GUARD_REJECT_ROWS", 10000000)
+GUARD_AUTO_LIMIT = env_limit("CHATDB_GUARD_AUTO_LIMIT", 1000)
+QUERY_TIMEOUT = env_limit("CHATDB_QUERY_TIMEOUT", 30)
+# Set CHATDB_GUARD_LOG to a file path (or - for stderr) to write every guard decision as a JSON line
+GUARD_LOG_PATH = os.environ.get("CHATDB_GUARD_LOG")
+DECISION_LOG_SIZE = 1000
+# SQLite plans have no row estimates: a SEARCH through an index is taken to read this share of the table
+SQLITE_SEARCH_FRACTION = 0.1
+# MySQL error code of a statement stopped by its MAX_EXECUTION_TIME hint
+MAX_EXECUTION_TIME_EXCEEDED = 3024
+
+LIMIT_PATTERN = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+# Queries that read every matching row before returning the first one, so a LIMIT does not bound the work
+FULL_READ_PATTERN = re.compile(r"\b(?:GROUP\s+BY|ORDER\s+BY|DISTINCT|HAVING|UNION)\b|\b(?:SUM|COUNT|AVG|MIN|MAX)\s*\(",
+                               re.IGNORECASE)
+GROUP_BY_PATTERN = re.compile(r"\bGROUP\s+BY\b", re.IGNORECASE)
+AGGREGATE_PATTERN = re.compile(r"\b(?:SUM|COUNT|AVG|MIN|MAX)\s*\(", re.IGNORECASE)
+SELECT_PATTERN = re.compile(r"^\s*SELECT\b", re.IGNORECASE)
+SQLITE_PLAN_PATTERN = re.compile(r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\w+)", re.IGNORECASE)
+DUCKDB_ESTIMATE_PATTERN = re.compile(r"~([\d,]+) rows?")
+
+
+# Not OperationalErrors: the connection is still usable, so connection pools keep it
+class QueryRejected(pymysql.err.DatabaseError):
+    pass
+
+
+class QueryTimeout(pymysql.err.DatabaseError):
+    pass
+
+
+# What the guard decided for one query: allowed, limited (a LIMIT was added), rejected or timed_out
+class GuardDecision:
+    def __init__(self, query, action, estimated_rows=None, row_cap=None, reason=""):
+        self.query = query
+        self.action = action
+        self.estimated_rows = estimated_rows
+        self.row_cap = row_cap
+        self.reason = reason
+        self.time = time.time()
+
+    def as_dict(self):
+        return {"time": round(self.time, 3), "action": self.action, "estimated_rows": self.estimated_rows,
+                "row_cap": self.row_cap, "reason": self.reason, "query": self.query}
+
+    def __repr__(self):
+        return f"GuardDecision({self.action!r}, estimated_rows={self.estimated_rows}, reason={self.reason!r})"
+
+
+# One background thread that cancels queries whose deadline has passed. arm() and disarm() only take
+# a lock, so a deadline can be set around every blocking database call without starting a thread.
+class QueryWatchdog:
+    def __init__(self):
+        self._deadlines = {}
+        self._fired = set()
+        self._condition = threading.Condition()
+        self._ids = itertools.count()
+        self._thread = None
+
+    def arm(self, seconds, cancel):
+        with self._condition:
+            token = next(self._ids)
+            self._deadlines[token] = (time.monotonic() + seconds, cancel)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="chatdb-query-watchdog", daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return token
+
+    # True if the deadline passed and the query was cancelled
+    def disarm(self, token):
+        with self._condition:
+            self._deadlines.pop(token, None)
+            if token in self._fired:
+                self._fired.discard(token)
+                return True
+        return False
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._deadlines:
+                        self._condition.wait()
+                        continue
+                    token = min(self._deadlines, key=lambda key: self._deadlines[key][0])
+                    remaining = self._deadlines[token][0] - time.monotonic()
+                    if remaining <= 0:
+                        cancel = self._deadlines.pop(token)[1]
+                        self._fired.add(token)
+                        break
+                    self._condition.wait(remaining)
+            try:
+                cancel()
+            except Exception as e:
+                print(f"Could not cancel a query that ran past its timeout: {e}")
+            # Holding on to the callback while waiting would keep its connection alive past shutdown
+            cancel = None
+
+
+watchdog = QueryWatchdog()
+
+
+# Stop the statement running on connection: embedded backends interrupt it in-process; on MySQL a
+# side connection sends KILL QUERY for the connection's thread
+def cancel_query(connection):
+    if hasattr(connection, "interrupt"):
+        connection.interrupt()
+        return
+    side_connection = pymysql.connect(host=connection.host, port=connection.port, user=connection.user,
+                                      password=connection.password, unix_socket=connection.unix_socket,
+                                      connect_timeout=5)
+    try:
+        with side_connection.cursor() as cursor:
+            cursor.execute(f"KILL QUERY {int(connection.thread_id())};")
+    finally:
+        side_connection.close()
+
+
+# Database time left for one query. Each blocking call (execute, fetching a batch) runs inside
+# waiting(); time spent by the caller between batches, e.g. while the CLI waits for the next page,
+# does not count. A call still running when the time is up is cancelled and raises QueryTimeout.
+class QueryDeadline:
+    def __init__(self, guard, connection, query, timeout):
+        self.guard = guard
+        self.connection = connection
+        self.query = query
+        self.timeout = timeout
+        self.remaining = timeout
+        self.expired = False
+
+    def expire(self):
+        if not self.expired:
+            self.expired = True
+            self.guard.record(GuardDecision(self.query, "timed_out", reason=f"cancelled after {self.timeout:g} s"))
+        return QueryTimeout(f"Query cancelled after the {self.timeout:g} s timeout.")
+
+    @contextmanager
+    def waiting(self):
+        if self.timeout is None:
+            yield
+            return
+        if self.expired or self.remaining <= 0:
+            raise self.expire()
+        start = time.monotonic()
+        token = watchdog.arm(self.remaining, lambda: cancel_query(self.connection))
+        try:
+            yield
+        except pymysql.MySQLError as e:
+            if watchdog.disarm(token) or (e.args and e.args[0] == MAX_EXECUTION_TIME_EXCEEDED):
+                raise self.expire() from e
+            raise
+        finally:
+            self.remaining -= time.monotonic() - start
+            if watchdog.disarm(token):
+                # The call returned just as it was cancelled; the next one raises
+                self.remaining = 0
+
+
+def is_mysql(connection):
+    return isinstance(connection, pymysql.connections.Connection)
+
+
+# Rows a query is expected to read, from its EXPLAIN: MySQL's row estimates (multiplied across the
+# tables of a join), DuckDB's cardinality estimates, or SQLite's SCAN/SEARCH steps applied to the
+# table's size. None when the plan gives no estimate.
+def estimate_rows(connection, query, params=None):
+    with connection.cursor(pymysql.cursors.DictCursor) as cursor:
+        cursor.execute(f"EXPLAIN {query}", params or None)
+        plan_rows = cursor.fetchall()
+    estimates = []
+    if plan_rows and "rows" in plan_rows[0]:
+        per_select = {}
+        for row in plan_rows:
+            if row.get("rows") is not None:
+                per_select[row.get("id")] = per_select.get(row.get("id"), 1) * int(row["rows"])
+        estimates = list(per_select.values())
+    elif plan_rows and "explain_value" in plan_rows[0]:
+        for row in plan_rows:
+            estimates += [int(value.replace(",", "")) for value in DUCKDB_ESTIMATE_PATTERN.findall(row["explain_value"])]
+    else:
+        for row in plan_rows:
+            match = SQLITE_PLAN_PATTERN.match(str(row.get("detail", "")))
+            if not match:
+                continue
+            if "rowid=" in row["detail"]:
+                estimates.append(1)
+                continue
+            table_rows = sqlite_table_rows(connection, match.group(2))
+            if table_rows is not None:
+                fraction = 1 if match.group(1).upper() == "SCAN" else SQLITE_SEARCH_FRACTION
+                estimates.append(int(table_rows * fraction))
+    return max(estimates) if estimates else None
+
+
+# Size of a SQLite table from its largest rowid, which is read from the end of the table's b-tree
+def sqlite_table_rows(connection, table_name):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT MAX(rowid) FROM {table_name};")
+            row = cursor.fetchone()
+    except pymysql.MySQLError:
+        return None
+    return int(row[0] or 0) if row else None
+
+
+# Pre-execution check of the SELECTs ChatDB sends to the database. A query that can read many rows
+# (by its EXPLAIN estimate) gets a LIMIT or, unless it aggregates, is rejected, and every query runs
+# with a timeout: the MAX_EXECUTION_TIME hint on MySQL, plus a client-side deadline that cancels the
+# statement. Each decision is counted in the metrics, kept in a bounded log and optionally written to
+# log_path.
+class QueryGuard:
+    def __init__(self, limit_rows=GUARD_LIMIT_ROWS, reject_rows=GUARD_REJECT_ROWS, auto_limit=GUARD_AUTO_LIMIT,
+                 timeout=QUERY_TIMEOUT, log_path=GUARD_LOG_PATH):
+        self.limit_rows = limit_rows
+        self.reject_rows = reject_rows
+        self.auto_limit = auto_limit
+        self.timeout = timeout
+        self.log_path = log_path
+        self.enabled = True
+        self.decisions = deque(maxlen=DECISION_LOG_SIZE)
+        self.counts = {action: 0 for action in ("allowed", "limited", "rejected", "timed_out")}
+        self._lock = threading.Lock()
+
+    # The decision for query; raises QueryRejected (after logging it) when the query must not run
+    def check(self, connection, query, params=None):
+        if not self.enabled or not SELECT_PATTERN.match(query):
+            return GuardDecision(query, "allowed", reason="not checked")
+        has_limit = bool(LIMIT_PATTERN.search(query))
+        if has_limit and not FULL_READ_PATTERN.search(query):
+            # The database stops reading once the LIMIT is reached
+            return self.record(GuardDecision(query, "allowed", reason="bounded by its LIMIT"))
+        if self.limit_rows is None and self.reject_rows is None:
+            return self.record(GuardDecision(query, "allowed", reason="no row thresholds"))
+
+        with metrics.stage("guard.explain"):
+            try:
+                estimated = estimate_rows(connection, query, params)
+            except pymysql.MySQLError as e:
+                return self.record(GuardDecision(query, "allowed", reason=f"EXPLAIN failed: {e}"))
+        aggregates = AGGREGATE_PATTERN.search(query) or GROUP_BY_PATTERN.search(query)
+        if self.reject_rows is not None and estimated is not None and estimated > self.reject_rows and not aggregates:
+            self.record(GuardDecision(query, "rejected", estimated,
+                                      reason=f"estimated to read {estimated} rows (limit {self.reject_rows})"))
+            raise QueryRejected(f"Query rejected: it is estimated to read {estimated} rows, more than the "
+                                f"{self.reject_rows} allowed. Add a filter or a LIMIT.")
+        if self.limit_rows is not None and estimated is not None and estimated > self.limit_rows:
+            # An aggregate without GROUP BY returns one row; a LIMIT would not change anything
+            single_row = AGGREGATE_PATTERN.search(query) and not GROUP_BY_PATTERN.search(query)
+            if not has_limit and not single_row and self.auto_limit:
+                return self.record(GuardDecision(query, "limited", estimated, self.auto_limit,
+                                                 reason=f"estimated to read {estimated} rows; "
+                                                        f"results capped at {self.auto_limit} rows"))
+        return self.record(GuardDecision(query, "allowed", estimated))
+
+    # The query as sent to the server: MySQL SELECTs carry the timeout as a MAX_EXECUTION_TIME hint
+    def apply_timeout_hint(self, connection, query):
+        if not self.enabled or self.timeout is None or not is_mysql(connection) or not SELECT_PATTERN.match(query):
+            return query
+        return SELECT_PATTERN.sub(f"SELECT /*+ MAX_EXECUTION_TIME({int(self.timeout * 1000)}) */", query, count=1)
+
+    def deadline(self, connection, query):
+        return QueryDeadline(self, connection, query, self.timeout if self.enabled else None)
+
+    def record(self, decision):
+        metrics.increment(f"guard_{decision.action}")
+        with self._lock:
+            self.counts[decision.action] += 1
+            self.decisions.append(decision)
+        if decision.action != "allowed":
+            print(f"Query guard: {decision.action} - {decision.reason}.")
+        self.log(decision)
+        return decision
+
+    def log(self, decision):
+        if not self.log_path:
+            return
+        line = json.dumps(decision.as_dict(), default=str)
+        if self.log_path == "-":
+            print(line, file=sys.stderr)
+            return
+        with self._lock:
+            with open(self.log_path, "a") as log_file:
+                log_file.write(line + "\n")
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, limit_rows=self.limit_rows or 0, reject_rows=self.reject_rows or 0,
+                        timeout_seconds=self.timeout or 0)
+
+
+# Shared guard consulted by query_executor before a query goes to the database
+query_guard = QueryGuard()
@@ -0,0 +1,90 @@
+import threading
+import time
+import pymysql
+from instrumentation import metrics
+
+DEFAULT_TTL_SECONDS = 300
+# Tables ChatDB keeps for its own bookkeeping (approximate_query, column_stats, incremental_ingest),
+# left out of table listings. A suffixed table belongs to the table named by the rest of its name.
+INTERNAL_TABLES = ("chatdb_samples", "chatdb_column_stats", "chatdb_ingest_manifest")
+INTERNAL_TABLE_SUFFIXES = ("_sample", "_row_hashes", "_staging")
+
+
+class TableSchema:
+    def __init__(self, table_name, describe_rows, index_rows):
+        self.table_name = table_name
+        # DESCRIBE rows: Field, Type, Null, Key, Default, Extra
+        self.columns = [row[0] for row in describe_rows]
+        self.column_types = {row[0]: row[1] for row in describe_rows}
+        self.nullable = {row[0]: row[2] == "YES" for row in describe_rows}
+        self.keys = {row[0]: row[3] for row in describe_rows}
+        # SHOW INDEX rows: Table, Non_unique, Key_name, Seq_in_index, Column_name, ...
+        self.indexes = {}
+        for row in sorted(index_rows, key=lambda index_row: (index_row[2], index_row[3])):
+            self.indexes.setdefault(row[2], []).append(row[4])
+
+
+# table_names without ChatDB's internal tables
+def visible_tables(table_names):
+    names = {name.lower() for name in table_names}
+    return [name for name in table_names if name.lower() not in INTERNAL_TABLES
+            and not any(name.lower().endswith(suffix) and name.lower()[:-len(suffix)] in names
+                        for suffix in INTERNAL_TABLE_SUFFIXES)]
+
+
+# Caches table metadata per table so DESCRIBE/SHOW INDEX are issued once per TTL instead of once
+# per query. Anything that changes a table's structure must call invalidate(table_name).
+class SchemaCatalog:
+    def __init__(self, ttl=DEFAULT_TTL_SECONDS):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_table_schema(self, connection, table_name):
+        with self._lock:
+            entry = self._entries.get(table_name)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                metrics.increment("schema_catalog_hits")
+                return entry[1]
+            self.misses += 1
+        metrics.increment("schema_catalog_misses")
+
+        with metrics.stage("schema.describe"):
+            table_schema = self._load(connection, table_name)
+        with self._lock:
+            self._entries[table_name] = (time.monotonic(), table_schema)
+        return table_schema
+
+    def _load(self, connection, table_name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DESCRIBE {table_name}")
+            describe_rows = cursor.fetchall()
+            try:
+                cursor.execute(f"SHOW INDEX FROM {table_name}")
+                index_rows = cursor.fetchall()
+            except pymysql.MySQLError:
+                index_rows = []
+        return TableSchema(table_name, describe_rows, index_rows)
+
+    def invalidate(self, table_name=None):
+        with self._lock:
+            if table_name is None:
+                self._entries.clear()
+            else:
+                # Entries are looked up by the name as written; a reload drops them under any spelling
+                for name in [name for name in self._entries if name.lower() == table_name.lower()]:
+                    del self._entries[name]
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "invalidations": self.invalidations,
+                    "cached_tables": len(self._entries)}
+
+
+# Shared catalog used by simple_chatdb, generate_sample_queries and handle_natural_language
+schema_catalog = SchemaCatalog()
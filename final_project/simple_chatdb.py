@@ -1,57 +1,125 @@
 import os
-import pymysql
-import pandas as pd
 import random
-from generate_sample_queries import generate_sample_queries
-from handle_natural_language import natural_language_query
+import time
+from connection_pool import pool_aware
+from lazy_imports import lazy_import
+
+# The driver, pandas and the feature modules are imported by the code paths that use them, so
+# importing this module (or starting the CLI) does not load them all up front
+pd = lazy_import("pandas")
+pymysql = lazy_import("pymysql")
 
 
 # Step 1: Function to upload CSV file and create a table in the database with appropriate column types
-def upload_csv_to_database(connection, csv_path, table_name):
+# batch_size and chunk_size default to csv_loader's DEFAULT_BATCH_SIZE and DEFAULT_CHUNK_SIZE.
+@pool_aware
+def upload_csv_to_database(connection, csv_path, table_name, batch_size=None, use_local_infile=True,
+                           chunk_size=None, create_recommended_indexes=False, sample_rows=None, snapshot=False):
+    from aggregate_cube import cube_registry
+    from approximate_query import ReservoirSample, load_reservoir, sample_table, save_sample
+    from column_stats import column_statistics
+    from csv_loader import (DEFAULT_BATCH_SIZE, DEFAULT_CHUNK_SIZE, build_insert_query, bulk_load,
+                            infer_column_definitions, insert_batches, iter_converted_chunks, iter_csv_chunks,
+                            iter_loaded_chunks, iter_row_batches, report_throughput, table_exists)
+    from incremental_ingest import forget_loads, record_full_load
+    from index_advisor import advise_indexes
+    from instrumentation import metrics
+    from query_cache import result_cache
+    from schema_catalog import schema_catalog
+    from snapshot_cache import snapshot_cache, write_snapshot
+
+    batch_size = batch_size or DEFAULT_BATCH_SIZE
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
     try:
-        df = pd.read_csv(csv_path)
-        
+        timer = metrics.timer()
+        stat = os.stat(csv_path)
+        columns, column_definitions, profiles = infer_column_definitions(csv_path, chunk_size=chunk_size)
+        timer.lap("upload.infer_schema")
 
-        if df.empty:
+        if not columns:
             print("The CSV file is empty. Please provide a valid CSV file.")
             return
-        
-        columns = df.columns
-        column_definitions = []
 
-        column_definitions.append("id INT AUTO_INCREMENT PRIMARY KEY")
-        
-        for col in columns:
-            if pd.api.types.is_integer_dtype(df[col]):
-                column_definitions.append(f"{col} INT")
-            elif pd.api.types.is_float_dtype(df[col]):
-                column_definitions.append(f"{col} DECIMAL(10, 2)")
-            elif pd.api.types.is_datetime64_any_dtype(df[col]):
-                column_definitions.append(f"{col} DATETIME")
-            else:
-                max_length = df[col].astype(str).map(len).max()
-                column_definitions.append(f"{col} VARCHAR({max(255, max_length)})")
-        
         create_table_query = f"CREATE TABLE IF NOT EXISTS {table_name} ({', '.join(column_definitions)});"
+        table_existed = table_exists(connection, table_name)
+        # The table's cube is unregistered while rows are loaded and registered again once it has them
+        cube = cube_registry.cube_for_load(table_name, columns, profiles, table_existed)
+        cube_registry.drop(table_name)
+        # With sample_rows, a uniform sample of the table is kept for approximate queries
+        reservoir = None
+        if sample_rows and table_existed:
+            reservoir = load_reservoir(connection, table_name, columns, sample_rows)
+        elif sample_rows:
+            reservoir = ReservoirSample(sample_rows)
+        table_stats = column_statistics.stats_for_load(connection, table_name, columns, profiles, table_existed)
         
         with connection.cursor() as cursor:
             cursor.execute(create_table_query)
             connection.commit()
 
-        insert_query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))});"
-        rows_inserted = 0
+        insert_query = build_insert_query(table_name, columns)
+        start = time.perf_counter()
 
-        with connection.cursor() as cursor:
-            for _, row in df.iterrows():
-                try:
-                    row_values = tuple(row.where(pd.notna(row), None))
-                    cursor.execute(insert_query, row_values)
-                    rows_inserted += 1
-                except pymysql.MySQLError as e:
-                    print(f"Failed to insert row: {row_values}. Error: {e}")
-        
-        connection.commit()
+        # Prefer the database's bulk loader; fall back to batched inserts when it is unavailable
+        rows_inserted = None
+        rows_skipped = False
+        if use_local_infile:
+            try:
+                rows_inserted = bulk_load(connection, csv_path, table_name, columns, profiles=profiles)
+            except pymysql.MySQLError as e:
+                print(f"Bulk load failed, falling back to batched inserts. Error: {e}")
+
+        if rows_inserted is None:
+            batches = iter_row_batches(iter_converted_chunks(iter_csv_chunks(csv_path, chunk_size), profiles), batch_size)
+            rows_inserted, failed_rows = insert_batches(connection, insert_query, batches)
+            if failed_rows:
+                print(f"{len(failed_rows)} rows could not be inserted and were skipped.")
+                cube = reservoir = table_stats = None
+                rows_skipped = True
+
+        load_time = time.perf_counter() - start
+        timer.lap("upload.load")
+        metrics.increment("rows_inserted", rows_inserted)
+        schema_catalog.invalidate(table_name)
+        result_cache.invalidate_table(table_name)
+        # Pre-aggregate, sample and profile the new rows in one more pass over the file
+        if cube is not None or reservoir is not None or table_stats is not None:
+            for chunk in iter_loaded_chunks(csv_path, profiles, columns, chunk_size=chunk_size):
+                if cube is not None:
+                    cube.update(chunk)
+                if reservoir is not None:
+                    reservoir.add(chunk)
+                if table_stats is not None:
+                    table_stats.update(chunk)
+        if cube is not None:
+            cube_registry.register(cube)
+        if sample_rows:
+            if reservoir is None:
+                reservoir = sample_table(connection, table_name, columns, sample_rows)
+            save_sample(connection, table_name, column_definitions, columns, reservoir)
+        # Column statistics let the query generators and the translator pick realistic predicates
+        if table_stats is None:
+            column_statistics.collect(connection, table_name)
+        else:
+            column_statistics.save(connection, table_stats)
+        timer.lap("upload.cube_and_sample")
+        # Record the file's watermark and row hashes so a later incremental load only adds new rows
+        if rows_skipped:
+            forget_loads(connection, table_name)
+        else:
+            record_full_load(connection, csv_path, table_name, table_existed, stat, profiles, chunk_size)
+        timer.lap("upload.record_load")
         print(f"Table '{table_name}' created and {rows_inserted} rows inserted successfully.")
+        report_throughput(rows_inserted, load_time)
+        # A columnar snapshot lets later sessions explore the table without querying the database; one
+        # the table already had is rewritten
+        if snapshot or snapshot_cache.exists(connection, table_name):
+            write_snapshot(connection, table_name)
+            timer.lap("upload.snapshot")
+        # Index the columns the logged workload filters, groups and sorts on for this table
+        if create_recommended_indexes:
+            advise_indexes(connection, table_name, create=True)
+        return rows_inserted
 
     except FileNotFoundError:
         print("The specified CSV file was not found. Please check the file path and try again.")
@@ -63,17 +131,20 @@ def upload_csv_to_database(connection, csv_path, table_name):
         print(f"Error occurred: {e}")
 
 def list_tables_and_select(connection):
+    from schema_catalog import visible_tables
+
     try:
         with connection.cursor() as cursor:
             cursor.execute("SHOW TABLES;")
             tables = cursor.fetchall()
+            # ChatDB's sample, statistics and load-tracking tables are not offered
+            table_list = visible_tables([table[0] for table in tables])
 
-            if not tables:
+            if not table_list:
                 print("No tables found in the database.")
                 return None
 
             print("Available tables:")
-            table_list = [table[0] for table in tables]
             for index, table in enumerate(table_list, start=1):
                 print(f"{index}. {table}")
 
@@ -95,53 +166,92 @@ def list_tables_and_select(connection):
         return None
 
 def explore_table(connection, table_name):
+    from query_executor import stream_query
+    from schema_catalog import schema_catalog
+
     try:
         # Fetch the table columns and attributes
-        with connection.cursor() as cursor:
-            cursor.execute(f"DESCRIBE {table_name};")
-            columns_info = cursor.fetchall()
-            
-            if not columns_info:
-                print(f"No columns found in the table {table_name}")
-                return
-            
-            print(f"\nTable: {table_name}")
-            for column_info in columns_info:
-                print(f" - {column_info[0]} ({column_info[1]})")
-            
-            # Fetch and display sample data
-            cursor.execute(f"SELECT * FROM {table_name} LIMIT 5;")
-            sample_data = cursor.fetchall()
-            if sample_data:
-                print("Sample data:")
-                for row in sample_data:
-                    print(row)
-            else:
-                print("No data available in the table.")
+        table_schema = schema_catalog.get_table_schema(connection, table_name)
+
+        if not table_schema.columns:
+            print(f"No columns found in the table {table_name}")
+            return
+
+        print(f"\nTable: {table_name}")
+        for column in table_schema.columns:
+            print(f" - {column} ({table_schema.column_types[column]})")
+
+        # Fetch and display sample data
+        sample_data = list(stream_query(connection, f"SELECT * FROM {table_name} LIMIT 5;"))
+        if sample_data:
+            print("Sample data:")
+            for row in sample_data:
+                print(row)
+        else:
+            print("No data available in the table.")
     except Exception as e:
         print(f"Error occurred while exploring the table: {e}")
 
 
+# Query results are streamed from the server; page through them RESULT_PAGE_SIZE rows at a time and
+# optionally cap them at MAX_RESULT_ROWS rows
+RESULT_PAGE_SIZE = 50
+MAX_RESULT_ROWS = None
+# Set to a row count (e.g. 100000) to keep a sample of uploaded tables and answer SUM/COUNT/AVG queries
+# with sample estimates first; the exact query can then be run on request
+APPROXIMATE_SAMPLE_ROWS = None
+# Set to True to write a columnar (Parquet) snapshot of uploaded tables; sample rows and aggregates
+# are then read from the snapshot until the table changes
+COLUMNAR_SNAPSHOTS = False
+
 db_config = {
     "host": "localhost",
     "user": "root",
     "password": "12345678",
     "database": "costco",
     "port": 3306,
-    
+    # Allows upload_csv_to_database to use LOAD DATA LOCAL INFILE when the server permits it
+    "local_infile": True,
 }
 
 
 if __name__ == "__main__":
+    from backends import get_backend
+    from instrumentation import metrics
+
     try:
-        connection = pymysql.connect(**db_config)
+        # CHATDB_BACKEND=sqlite or duckdb (with CHATDB_DATABASE=<file>) runs ChatDB without a MySQL server
+        backend = get_backend()
+        connection = backend.connect()
         
         user_choice = input("Would you like to (1) Upload a CSV file or (2) Select an existing table? Enter 1 or 2: ")
         if user_choice == '1':
-            csv_path = input("Enter the path of the CSV file to upload: ")
-            if os.path.exists(csv_path):
+            csv_path = input("Enter the path of the CSV file to upload (or a directory / glob pattern to load many files into one table): ")
+            if os.path.isdir(csv_path) or any(char in csv_path for char in "*?["):
+                from multi_file_ingest import ingest_csv_files
+
+                table_name = input("Enter the table name to create in the database: ")
+                with metrics.request("upload"):
+                    ingest_csv_files(backend.connect_function, backend.connect_kwargs, csv_path, table_name,
+                                     use_threads=backend.embedded)
+                explore_table(connection, table_name)
+            elif os.path.exists(csv_path):
+                from csv_loader import table_exists
+                from incremental_ingest import incremental_load, is_tracked
+
                 table_name = input("Enter the table name to create in the database: ")
-                upload_csv_to_database(connection, csv_path, table_name)
+                # Refreshing an existing table from a file that grows (or is re-exported) only loads the new rows
+                incremental = (table_exists(connection, table_name) and is_tracked(connection, table_name)
+                               and input("Load only rows not loaded yet? (y/n): ").strip().lower() == "y")
+                if incremental:
+                    key_input = input("Enter key columns to replace matching rows (comma-separated, or press Enter to only append): ")
+                    key_columns = [col.strip() for col in key_input.split(",") if col.strip()]
+                    with metrics.request("upload"):
+                        incremental_load(connection, csv_path, table_name, key_columns or None)
+                else:
+                    with metrics.request("upload"):
+                        upload_csv_to_database(connection, csv_path, table_name, sample_rows=APPROXIMATE_SAMPLE_ROWS,
+                                               snapshot=COLUMNAR_SNAPSHOTS)
                 explore_table(connection, table_name)
             else:
                 print("CSV file does not exist.")
@@ -153,70 +263,52 @@ if __name__ == "__main__":
             print("Invalid choice. Please enter 1 or 2.")
             exit()
         
-        query_choice = input("Would you like to (1) Generate SQL queries randomly, (2) Generate SQL queries by keywords, or (3) Generate SQL queries by natural language? Enter 1, 2, or 3: ")
-        if query_choice == '1':
-            query_result = generate_sample_queries(connection, table_name)
-            if query_result:
-                query, description = query_result
-                print(f"\nGenerated Query: {query}\nDescription: {description}")
-                with connection.cursor() as cursor:
-                    cursor.execute(query)
-                    result = cursor.fetchall()
-                    print("Result:")
-                    for row in result:
-                        print(row)
-        if query_choice == '2':
-            keyword_query = input("Enter the keywords for query generation: ").lower()
-            valid_keywords = ["sum", "min", "max", "count", "group by", "having", "order by"]
-            if keyword_query in valid_keywords:
-                if keyword_query in ["sum", "min", "max", "count"]:
-                    query_type = 'aggregation'
-                    aggregation_function = keyword_query.upper()
-                    query_result = generate_sample_queries(connection, table_name, query_type, aggregation_function)
-                else:
-                    keyword_to_query_type = {
-                        'group by': 'group_by',
-                        'having': 'group_by',
-                        'order by': 'order_by',
-                    }
-                    query_type = keyword_to_query_type[keyword_query]
-                    query_result = generate_sample_queries(connection, table_name, query_type)
-                if query_result:
-                    query, description = query_result
-                    print(f"\nGenerated Query: {query}\nDescription: {description}")
-                    with connection.cursor() as cursor:
-                        cursor.execute(query)
-                        result = cursor.fetchall()
-                        print("\nQuery Results:")
-                        for row in result:
-                            print(row)
+        # Generating and running the query is one request in the metrics log; its elapsed time includes
+        # waiting for input, its stages do not
+        from generate_sample_queries import VALID_KEYWORDS, generate_keyword_query, generate_sample_queries
+        from query_executor import plan_from_generated, run_plan
+
+        with metrics.request("query"):
+            query_choice = input("Would you like to (1) Generate SQL queries randomly, (2) Generate SQL queries by keywords, or (3) Generate SQL queries by natural language? Enter 1, 2, or 3: ")
+            plan = None
+            if query_choice == '1':
+                plan = plan_from_generated(generate_sample_queries(connection, table_name), source="random")
+            elif query_choice == '2':
+                keyword_query = input("Enter the keywords for query generation: ").lower()
+                if keyword_query in VALID_KEYWORDS:
+                    plan = plan_from_generated(generate_keyword_query(connection, table_name, keyword_query),
+                                               source="keyword")
+                    if not plan:
+                        print("Failed to generate a query.")
                 else:
-                    print("Failed to generate a query.")
-            else:
-                print("Invalid keyword. Please enter one of the following:")
-                print(", ".join(valid_keywords))
+                    print("Invalid keyword. Please enter one of the following:")
+                    print(", ".join(VALID_KEYWORDS))
 
+            elif query_choice == '3':
+                from handle_natural_language import plan_natural_language_query
 
-        elif query_choice == '3':
-            user_natural_language_query = input("Enter a natural language query: ")
+                user_natural_language_query = input("Enter a natural language query: ")
+                try:
+                    plan = plan_natural_language_query(connection, user_natural_language_query, table_name)
+                    if not plan:
+                        print("Failed to generate a query.")
+                except Exception as e:
+                    print(f"Failed to generate the query: {e}")
 
-            try:
-                query = natural_language_query(connection, user_natural_language_query, table_name)
-                if query:
-                    print(f"\nGenerated SQL Query: {query}")
-                    with connection.cursor() as cursor:
-                        cursor.execute(query)
-                        result = cursor.fetchall()
-                        print("\nQuery Results:")
-                        for row in result:
-                            print(row)
-                # else:
-                    # print("Failed to generate a query.")
-            except Exception as e:
-                print(f"Failed to generate or execute the query: {e}")
+            else:
+                print("Invalid choice. Please enter 1, 2, or 3.")
 
-        else:
-            print("Invalid choice. Please enter 1, 2, or 3.")
+            # Every query path ends here: the plan is executed exactly once and its rows printed
+            if plan:
+                try:
+                    result = run_plan(connection, plan, dict_rows=(plan.source == "natural_language"),
+                                      max_rows=MAX_RESULT_ROWS, page_size=RESULT_PAGE_SIZE,
+                                      approximate=APPROXIMATE_SAMPLE_ROWS is not None)
+                    if result.approximate and input("Run the exact query? (y/n): ").strip().lower() == "y":
+                        run_plan(connection, plan, dict_rows=(plan.source == "natural_language"),
+                                 max_rows=MAX_RESULT_ROWS, page_size=RESULT_PAGE_SIZE)
+                except pymysql.MySQLError as e:
+                    print(f"Failed to execute the query: {e}")
 
     except pymysql.MySQLError as e:
         print(f"Database error occurred: {e}")
@@ -0,0 +1,279 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import pymysql
+import duckdb_engine
+from column_stats import column_kind, column_statistics, value_keys
+from connection_pool import pool_aware
+from instrumentation import metrics
+from lazy_imports import lazy_import
+
+pd = lazy_import("pandas")
+
+# Snapshots are kept per source database under this directory: <table>.parquet plus <table>.json
+SNAPSHOT_DIR = os.path.expanduser(os.environ.get("CHATDB_SNAPSHOT_DIR", os.path.join("~", ".cache", "chatdb", "snapshots")))
+SNAPSHOT_FETCH_SIZE = 100000
+
+# Single-table SELECTs; joins, unions and subqueries always go to the database
+SNAPSHOT_QUERY_PATTERN = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+`?(?P<table>\w+)`?"
+    r"(?P<rest>\s+(?:WHERE|GROUP\s+BY|HAVING|ORDER\s+BY|LIMIT)\b.*?)?\s*;?\s*$", re.IGNORECASE | re.DOTALL)
+EXCLUDED_PATTERN = re.compile(r"\b(?:JOIN|UNION|INTO|FOR\s+UPDATE)\b|\(\s*SELECT\b", re.IGNORECASE)
+# Only queries with small results are answered locally: sample rows (a LIMIT) and aggregates
+SMALL_RESULT_PATTERN = re.compile(r"\bLIMIT\s+\d+|\bGROUP\s+BY\b|\b(?:SUM|COUNT|AVG|MIN|MAX)\s*\(", re.IGNORECASE)
+# String literals and LIKE; DuckDB compares text case-sensitively while MySQL's default collations do not
+TEXT_COMPARISON_PATTERN = re.compile(r"['\"]|\bLIKE\b", re.IGNORECASE)
+DECIMAL_PATTERN = re.compile(r"(?:decimal|numeric)\((\d+),\s*(\d+)\)", re.IGNORECASE)
+
+
+# The DuckDB type a snapshot stores a column as, from the type DESCRIBE reports
+def snapshot_type(column_type):
+    kind = column_kind(column_type)
+    if kind == "int":
+        return "BIGINT" if "bigint" in column_type.lower() or "unsigned" in column_type.lower() else "INTEGER"
+    if kind == "float":
+        match = DECIMAL_PATTERN.search(column_type)
+        return f"DECIMAL({match.group(1)},{match.group(2)})" if match and int(match.group(1)) <= 38 else "DOUBLE"
+    return {"date": "DATE", "time": "TIME", "datetime": "TIMESTAMP"}.get(kind, "VARCHAR")
+
+
+# Whether a query matched by SNAPSHOT_QUERY_PATTERN compares, groups, sorts or aggregates text: text
+# literals or parameters, text columns after FROM (WHERE, GROUP BY, HAVING, ORDER BY) and text columns
+# passed to functions or DISTINCT in the select list. Their results depend on the collation, which
+# differs between the snapshot (DuckDB, case-sensitive) and the database (e.g. MySQL's case-insensitive
+# defaults), so such queries always go to the database.
+def compares_text(match, params, describe_rows):
+    rest = match.group("rest") or ""
+    if TEXT_COMPARISON_PATTERN.search(match.group("select") + rest) or any(isinstance(param, str) for param in params or ()):
+        return True
+    text_columns = [re.escape(row[0]) for row in describe_rows if column_kind(row[1]) == "str"]
+    if not text_columns:
+        return False
+    names = "|".join(text_columns)
+    if re.search(rf"\b(?:{names})\b", rest, re.IGNORECASE):
+        return True
+    return re.search(rf"(?:\(|\bDISTINCT\b)\s*(?:DISTINCT\s+)?`?(?:{names})\b", match.group("select"), re.IGNORECASE) is not None
+
+
+# Identifies the database a connection reads from, so snapshots of same-named tables do not mix.
+# None for in-memory databases, which cannot outlive the process.
+def database_key(connection):
+    path = getattr(connection, "path", None)
+    if path is not None:
+        if path.startswith(":memory:"):
+            return None
+        source = os.path.realpath(path)
+    else:
+        database = connection.db.decode() if isinstance(connection.db, bytes) else connection.db
+        source = f"mysql://{connection.host}:{connection.port}/{database}"
+    return hashlib.sha1(source.encode("utf-8")).hexdigest()[:12]
+
+
+# The table's version stamp: its column statistics change whenever ChatDB loads rows into it
+def table_version(connection, table_name):
+    table_stats = column_statistics.get_table_stats(connection, table_name)
+    return table_stats.version if table_stats is not None else None
+
+
+# MySQL returns TIME columns as timedelta, which DuckDB cannot cast to TIME
+def time_text(values):
+    return pd.to_datetime(value_keys(values, "time"), unit="s").dt.strftime("%H:%M:%S")
+
+
+# Write table_name to a Parquet snapshot (dictionary-encoded strings, zstd-compressed column chunks)
+# by streaming it through an on-disk DuckDB database, then stamp it with the table's version. Returns
+# the snapshot's metadata, or None if the table has no version stamp yet. Snapshots go to the directory
+# the shared snapshot_cache reads from unless snapshot_dir is given.
+@pool_aware
+def write_snapshot(connection, table_name, snapshot_dir=None, fetch_size=SNAPSHOT_FETCH_SIZE):
+    if duckdb_engine.duckdb is None:
+        raise ImportError("Columnar snapshots need the duckdb package (pip install duckdb).")
+    snapshot_dir = snapshot_dir or snapshot_cache.snapshot_dir
+    key = database_key(connection)
+    version = table_version(connection, table_name)
+    if key is None or version is None:
+        print(f"'{table_name}' has no version stamp (column statistics) or lives in memory; no snapshot written.")
+        return None
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DESCRIBE {table_name}")
+        describe_rows = [list(row) for row in cursor.fetchall()]
+    columns = [row[0] for row in describe_rows]
+    types = {row[0]: snapshot_type(row[1]) for row in describe_rows}
+    directory = os.path.join(snapshot_dir, key)
+    os.makedirs(directory, exist_ok=True)
+    parquet_path = os.path.join(directory, f"{table_name.lower()}.parquet")
+
+    rows = 0
+    with tempfile.TemporaryDirectory(dir=directory) as work_dir:
+        local = duckdb_engine.duckdb.connect(os.path.join(work_dir, "snapshot.duckdb"))
+        try:
+            local.execute(f"CREATE TABLE snapshot ({', '.join(f'{col} {types[col]}' for col in columns)})")
+            with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+                cursor.execute(f"SELECT {', '.join(columns)} FROM {table_name};")
+                while True:
+                    batch = cursor.fetchmany(fetch_size)
+                    if not batch:
+                        break
+                    chunk = pd.DataFrame(list(batch), columns=columns)
+                    for col in columns:
+                        if types[col] == "TIME":
+                            chunk[col] = time_text(chunk[col])
+                    local.register("chunk", chunk)
+                    local.execute("INSERT INTO snapshot SELECT * FROM chunk")
+                    local.unregister("chunk")
+                    rows += len(chunk)
+            temporary_path = os.path.join(work_dir, "snapshot.parquet")
+            local.execute(f"COPY snapshot TO '{temporary_path}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+        finally:
+            local.close()
+        os.replace(temporary_path, parquet_path)
+
+    metadata = {"table": table_name, "version": version, "rows": rows, "columns": describe_rows,
+                "created": round(time.time(), 3)}
+    metadata_path = os.path.join(directory, f"{table_name.lower()}.json")
+    with open(metadata_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(metadata, f, default=str)
+    os.replace(metadata_path + ".tmp", metadata_path)
+    snapshot_cache.invalidate(table_name)
+    print(f"Wrote a columnar snapshot of '{table_name}' ({rows} rows, {os.path.getsize(parquet_path) / 1e6:.1f} MB) "
+          f"to {parquet_path} in {time.perf_counter() - start:.2f}s.")
+    return metadata
+
+
+# Answers read-only queries on tables that have an up-to-date snapshot from the Parquet file, with
+# embedded DuckDB reading only the column chunks a query needs, instead of going to the database.
+# A snapshot is used only while its version stamp matches the table's; stale ones are deleted.
+class SnapshotCache:
+    def __init__(self, snapshot_dir=SNAPSHOT_DIR):
+        self.snapshot_dir = snapshot_dir
+        self.enabled = True
+        # (database key, table) -> version the DuckDB view over the snapshot was created for
+        self._views = {}
+        self._metadata = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _paths(self, key, table_name):
+        base = os.path.join(self.snapshot_dir, key, table_name.lower())
+        return f"{base}.parquet", f"{base}.json"
+
+    # A snapshot's metadata, re-read only when its file changes
+    def metadata(self, key, table_name):
+        _, metadata_path = self._paths(key, table_name)
+        try:
+            modified = os.stat(metadata_path).st_mtime
+        except OSError:
+            return None
+        with self._lock:
+            entry = self._metadata.get(metadata_path)
+        if entry is None or entry[0] != modified:
+            with open(metadata_path, encoding="utf-8") as f:
+                entry = (modified, json.load(f))
+            with self._lock:
+                self._metadata[metadata_path] = entry
+        return entry[1]
+
+    # Whether table_name has a snapshot, up to date or not
+    def exists(self, connection, table_name):
+        key = database_key(connection)
+        return key is not None and self.metadata(key, table_name) is not None
+
+    # A DuckDB connection on which table_name is a view over its snapshot, or None without a fresh one
+    def connect(self, connection, table_name):
+        key = database_key(connection)
+        metadata = self.metadata(key, table_name) if key is not None else None
+        if metadata is None:
+            return None
+        if metadata["version"] != table_version(connection, table_name):
+            with self._lock:
+                self.stale += 1
+            self.remove(key, table_name)
+            return None
+        local = duckdb_engine.connect(f":memory:chatdb_snapshots_{key}")
+        view = (key, table_name.lower())
+        with self._lock:
+            if self._views.get(view) != metadata["version"]:
+                parquet_path = self._paths(key, table_name)[0].replace("'", "''")
+                with local.cursor() as cursor:
+                    cursor.execute(f"CREATE OR REPLACE VIEW {table_name} AS SELECT * FROM read_parquet('{parquet_path}')")
+                self._views[view] = metadata["version"]
+        return local
+
+    # Rows for query from the snapshot of its table, or None if the query is not a single-table
+    # sample or aggregate query, compares text or the table has no fresh snapshot
+    def answer(self, connection, query, params=None, dict_rows=False):
+        # The DuckDB backend already reads its own columnar storage
+        if not self.enabled or duckdb_engine.duckdb is None or isinstance(connection, duckdb_engine.DuckDBConnection):
+            return None
+        match = SNAPSHOT_QUERY_PATTERN.match(query)
+        if match is None or EXCLUDED_PATTERN.search(query) or not SMALL_RESULT_PATTERN.search(query):
+            return None
+        key = database_key(connection)
+        metadata = self.metadata(key, match.group("table")) if key is not None else None
+        if metadata is not None and compares_text(match, params, metadata["columns"]):
+            return None
+        local = self.connect(connection, match.group("table"))
+        if local is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            with local.cursor(pymysql.cursors.DictCursor if dict_rows else None) as cursor:
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+        except pymysql.MySQLError:
+            # Statements DuckDB does not accept still run on the database
+            return None
+        finally:
+            local.close()
+        with self._lock:
+            self.hits += 1
+        return rows
+
+    def remove(self, key, table_name):
+        for path in self._paths(key, table_name):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.invalidate(table_name)
+
+    # Forget the views over table_name's snapshot so they are re-created from the file
+    def invalidate(self, table_name=None):
+        with self._lock:
+            if table_name is None:
+                self._views.clear()
+            else:
+                self._views = {view: version for view, version in self._views.items()
+                               if view[1] != table_name.lower()}
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "stale": self.stale, "views": len(self._views)}
+
+
+# Shared cache consulted by query_executor before a query goes to the database
+snapshot_cache = SnapshotCache()
+
+
+# Write a table's snapshot on demand, e.g. python snapshot_cache.py costco --backend mysql
+if __name__ == "__main__":
+    from backends import add_backend_arguments, get_backend
+    parser = argparse.ArgumentParser(description="Write a columnar (Parquet) snapshot of a ChatDB table.")
+    parser.add_argument("table")
+    add_backend_arguments(parser)
+    args = parser.parse_args()
+    connection = get_backend(args.backend, args.database).connect()
+    try:
+        with metrics.request("snapshot"):
+            write_snapshot(connection, args.table)
+    finally:
+        connection.close()
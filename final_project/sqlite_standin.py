@@ -0,0 +1,136 @@
+import re
+import sqlite3
+import pymysql
+
+
+# A small SQLite-backed connection that behaves like a pymysql connection for the
+# statements ChatDB issues, so ingestion and queries can be exercised without a MySQL server.
+# MySQL metadata statements are rewritten to equivalent queries over SQLite's pragma functions.
+SHOW_TABLES_PATTERN = re.compile(r"^\s*SHOW\s+TABLES\s*;?\s*$", re.IGNORECASE)
+DESCRIBE_PATTERN = re.compile(r"^\s*(?:DESCRIBE|DESC)\s+`?(\w+)`?\s*;?\s*$", re.IGNORECASE)
+EXPLAIN_PATTERN = re.compile(r"^\s*EXPLAIN\s+(?!QUERY\s+PLAN)", re.IGNORECASE)
+ENUM_PATTERN = re.compile(r"\bENUM\((?:'(?:[^']|'')*'(?:,\s*)?)+\)", re.IGNORECASE)
+SHOW_INDEX_PATTERN = re.compile(r"^\s*SHOW\s+(?:INDEX|INDEXES|KEYS)\s+FROM\s+`?(\w+)`?\s*;?\s*$", re.IGNORECASE)
+
+
+def translate_metadata_statement(query):
+    if SHOW_TABLES_PATTERN.match(query):
+        return "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    match = DESCRIBE_PATTERN.match(query)
+    if match:
+        return (f"SELECT name AS Field, lower(type) AS Type, "
+                f"CASE WHEN \"notnull\" OR pk THEN 'NO' ELSE 'YES' END AS \"Null\", "
+                f"CASE WHEN pk THEN 'PRI' ELSE '' END AS \"Key\", dflt_value AS \"Default\", "
+                f"CASE WHEN pk THEN 'auto_increment' ELSE '' END AS Extra "
+                f"FROM pragma_table_info('{match.group(1)}') ORDER BY cid")
+    match = SHOW_INDEX_PATTERN.match(query)
+    if match:
+        return (f"SELECT '{match.group(1)}' AS \"Table\", NOT il.\"unique\" AS Non_unique, il.name AS Key_name, "
+                f"ii.seqno + 1 AS Seq_in_index, ii.name AS Column_name "
+                f"FROM pragma_index_list('{match.group(1)}') AS il, pragma_index_info(il.name) AS ii "
+                f"ORDER BY il.name, ii.seqno")
+    return None
+
+
+def translate_statement(query, has_params=True):
+    metadata_query = translate_metadata_statement(query)
+    if metadata_query:
+        return metadata_query
+    query = query.replace("INT AUTO_INCREMENT PRIMARY KEY", "INTEGER PRIMARY KEY AUTOINCREMENT")
+    query = EXPLAIN_PATTERN.sub("EXPLAIN QUERY PLAN ", query)
+    # SQLite has no ENUM type; the values are stored as text
+    query = ENUM_PATTERN.sub("TEXT", query)
+    if not has_params:
+        return query
+    # pymysql uses the 'format' paramstyle, sqlite3 uses 'qmark'
+    query = re.sub(r"(?<!%)%s", "?", query)
+    return query.replace("%%", "%")
+
+
+class StandInCursor:
+    def __init__(self, cursor, dict_rows=False):
+        self._cursor = cursor
+        self.dict_rows = dict_rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def execute(self, query, params=None):
+        try:
+            self._cursor.execute(translate_statement(query, params is not None), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise pymysql.err.DatabaseError(str(e))
+        return self._cursor.rowcount
+
+    def executemany(self, query, seq_of_params):
+        try:
+            self._cursor.executemany(translate_statement(query), seq_of_params)
+        except sqlite3.Error as e:
+            raise pymysql.err.DatabaseError(str(e))
+        return self._cursor.rowcount
+
+    # DictCursor/SSDictCursor return rows as {column: value}
+    def _convert(self, rows):
+        if not self.dict_rows:
+            return rows
+        names = [column[0] for column in self._cursor.description]
+        return [dict(zip(names, row)) for row in rows]
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._convert([row])[0] if row is not None else None
+
+    def fetchmany(self, size=1):
+        return self._convert(self._cursor.fetchmany(size))
+
+    def fetchall(self):
+        return self._convert(self._cursor.fetchall())
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandInConnection:
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self.open = True
+
+    def cursor(self, cursor_class=None):
+        dict_rows = cursor_class is not None and "Dict" in cursor_class.__name__
+        return StandInCursor(self._connection.cursor(), dict_rows)
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def ping(self, reconnect=False):
+        return self.open
+
+    # Stop the statement running on this connection (from another thread); it fails with "interrupted"
+    def interrupt(self):
+        self._connection.interrupt()
+
+    def close(self):
+        self._connection.close()
+        self.open = False
+
+
+def connect(path=":memory:"):
+    return StandInConnection(path)
@@ -0,0 +1,82 @@
+import os
+import sys
+from decimal import Decimal
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregate_cube import cube_registry
+from backends import get_backend
+from column_stats import column_statistics
+from index_advisor import query_usage_log
+from instrumentation import metrics
+from query_cache import result_cache, translation_cache
+from schema_catalog import schema_catalog
+from snapshot_cache import snapshot_cache
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "costco_dataset")
+BACKENDS = ["sqlite", "duckdb"]
+
+
+# Lines (without the header) of one of the costco_dataset files, e.g. dataset_lines("usa")
+def dataset_lines(country):
+    with open(os.path.join(DATASET_DIR, f"costco_sales_data_{country}.csv")) as csv_file:
+        lines = csv_file.read().splitlines()
+    return lines[0], lines[1:]
+
+
+# The shared caches are keyed by table name only, so every test starts from empty ones
+@pytest.fixture(autouse=True)
+def fresh_caches(tmp_path):
+    for catalog in (schema_catalog, column_statistics, snapshot_cache):
+        catalog.invalidate()
+    for cache in (result_cache, translation_cache, cube_registry, query_usage_log):
+        cache.clear()
+    metrics.reset()
+    snapshot_cache.snapshot_dir = str(tmp_path / "snapshots")
+    yield
+
+
+# A new database file on each embedded backend
+@pytest.fixture(params=BACKENDS)
+def backend(request, tmp_path):
+    if request.param == "duckdb":
+        pytest.importorskip("duckdb")
+    return get_backend(request.param, str(tmp_path / f"chatdb.{request.param}"))
+
+
+@pytest.fixture
+def connection(backend):
+    connection = backend.connect()
+    yield connection
+    connection.close()
+
+
+# Writes a CSV file with rows start..start+rows of a costco_dataset file and returns its path
+@pytest.fixture
+def make_csv(tmp_path):
+    def make(name, rows, country="usa", start=0):
+        header, lines = dataset_lines(country)
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("\n".join([header] + lines[start:start + rows]) + "\n")
+        return str(path)
+    return make
+
+
+def count_rows(connection, table_name):
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
+        return int(cursor.fetchone()[0])
+
+
+def append_rows(csv_path, rows, country="canada"):
+    _, lines = dataset_lines(country)
+    with open(csv_path, "a") as csv_file:
+        csv_file.write("\n".join(lines[:rows]) + "\n")
+
+
+# Backends differ in how they return DECIMAL (Decimal or float) and date (date or text) values
+def normalized(rows):
+    return [[round(float(value), 6) if isinstance(value, (float, Decimal)) else
+             str(value) if hasattr(value, "isoformat") else value for value in row] for row in rows]
@@ -0,0 +1,42 @@
+import pytest
+from aggregate_cube import cube_registry
+from conftest import normalized
+from query_executor import stream_query
+from simple_chatdb import upload_csv_to_database
+
+CUBE_QUERIES = [
+    "SELECT COUNT(*) FROM sales;",
+    "SELECT SUM(units_sold) AS total_units FROM sales;",
+    "SELECT MIN(price_per_unit), MAX(price_per_unit), SUM(price_per_unit) FROM sales;",
+    "SELECT units_sold, COUNT(*) FROM sales GROUP BY units_sold;",
+    "SELECT purchase_date, SUM(units_sold) FROM sales GROUP BY purchase_date LIMIT 5;",
+    "SELECT COUNT(product_id) FROM sales WHERE product_id IS NOT NULL;",
+]
+
+
+@pytest.fixture
+def sales(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("sales.csv", 400), "sales")
+    return connection
+
+
+# The cube returns the rows, and the Python types, the database returns
+@pytest.mark.parametrize("query", CUBE_QUERIES)
+def test_cube_matches_the_database(sales, query):
+    result = stream_query(sales, query, use_cache=False)
+    cube_rows = list(result)
+    database_rows = list(stream_query(sales, query, use_cache=False, use_cube=False, use_snapshot=False))
+    assert result.from_cube
+    assert normalized(cube_rows) == normalized(database_rows)
+    assert [type(value) for value in cube_rows[0] if isinstance(value, int)] == \
+           [type(value) for value in database_rows[0] if isinstance(value, int)]
+
+
+# MySQL groups text ignoring case and trailing spaces; such groupings run as SQL
+@pytest.mark.parametrize("query", ["SELECT currency, COUNT(*) FROM sales GROUP BY currency;",
+                                   "SELECT country_code, SUM(units_sold) FROM sales GROUP BY country_code;"])
+def test_text_groupings_go_to_the_database(sales, query):
+    assert not cube_registry.can_answer(query)
+    result = stream_query(sales, query, use_cache=False)
+    list(result)
+    assert not result.from_cube
@@ -0,0 +1,53 @@
+import asyncio
+import json
+from chatdb_service import MAX_BODY_BYTES, ChatDBService
+
+
+# Send raw requests on one keep-alive connection to a service started on the backend; returns each
+# response as (status, payload) and whether the service closed the connection after them
+def exchange(backend, requests):
+    async def run():
+        service = ChatDBService(backend.pool(max_size=2))
+        server = await service.start("127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        responses = []
+        try:
+            for request in requests:
+                writer.write(request)
+                await writer.drain()
+                status_line = await reader.readline()
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers["content-length"]))
+                responses.append((int(status_line.split()[1]), json.loads(body)))
+            closed = await reader.read() == b""
+        finally:
+            writer.close()
+            await service.stop()
+        return responses, closed
+    return asyncio.run(run())
+
+
+def post(path, body, length=None):
+    length = len(body) if length is None else length
+    return (f"POST {path} HTTP/1.1\r\nContent-Type: application/json\r\nContent-Length: {length}\r\n\r\n"
+            .encode("latin-1") + body)
+
+
+def test_json_bodies_must_be_objects(backend):
+    requests = [post("/query/random", body) for body in (b"[1, 2]", b'"sales"', b"3", b"not json")]
+    requests.append(b"GET /tables HTTP/1.1\r\nConnection: close\r\n\r\n")
+    responses, closed = exchange(backend, requests)
+    assert [status for status, _ in responses] == [400, 400, 400, 400, 200]
+    assert responses[0][1] == {"error": "Request body must be a JSON object."}
+    assert closed
+
+
+# Oversized or invalid bodies are refused from the headers alone, without waiting for the body
+def test_oversized_bodies_are_refused_before_they_are_read(backend):
+    responses, closed = exchange(backend, [post("/upload", b"", length=MAX_BODY_BYTES + 1)])
+    assert responses == [(413, {"error": "Request body too large."})] and closed
+    responses, closed = exchange(backend, [post("/upload", b"", length=-5)])
+    assert responses == [(400, {"error": "Invalid Content-Length."})] and closed
@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+import pytest
+from column_stats import ColumnStats, HyperLogLog, column_statistics
+from conftest import append_rows
+from incremental_ingest import incremental_load
+from simple_chatdb import upload_csv_to_database
+
+
+def sketch_of(values):
+    sketch = HyperLogLog()
+    sketch.add_hashes(pd.util.hash_array(np.asarray(values, dtype=object)))
+    return sketch
+
+
+# Equi-depth histograms merged chunk by chunk still give the quantiles of all values
+def test_histogram_quantiles_across_chunks():
+    values = np.random.default_rng(7).permutation(np.arange(100000))
+    stats = ColumnStats("units_sold", "int")
+    for chunk in np.array_split(values, 10):
+        stats.update(pd.Series(chunk))
+    assert (stats.min_value, stats.max_value) == (0, 99999)
+    for q in (0.1, 0.25, 0.5, 0.75, 0.9):
+        assert stats.quantile_value(q) == pytest.approx(q * 100000, abs=1500)
+
+
+@pytest.mark.parametrize("distinct", [100, 5000, 200000])
+def test_hyperloglog_distinct_count(distinct):
+    assert sketch_of([f"value {i}" for i in range(distinct)]).estimate() == pytest.approx(distinct, rel=0.05)
+
+
+def test_hyperloglog_merge_and_round_trip():
+    first, second = sketch_of([str(i) for i in range(30000)]), sketch_of([str(i) for i in range(20000, 50000)])
+    first.merge(second)
+    assert first.estimate() == pytest.approx(50000, rel=0.05)
+    assert HyperLogLog.from_text(first.to_text()).estimate() == first.estimate()
+
+
+def test_frequent_values_and_selectivity():
+    values = ["USD"] * 600 + ["CAD"] * 300 + [f"X{i}" for i in range(100)] + [None] * 50
+    stats = ColumnStats("currency", "str")
+    for chunk in np.array_split(np.array(values, dtype=object), 4):
+        stats.update(pd.Series(chunk))
+    assert (stats.row_count, stats.null_count) == (1050, 50)
+    assert stats.frequent_values()[:2] == ["USD", "CAD"]
+    assert (stats.frequent["USD"], stats.frequent["CAD"]) == (600, 300)
+    assert stats.equality_selectivity("USD") == pytest.approx(600 / 1050)
+    assert stats.equality_selectivity("X99") == pytest.approx(1 / 1050, rel=0.2)
+    assert stats.stored_value("cad") == "CAD" and stats.stored_value("eur") == "eur"
+
+
+# Loads update a copy of the cached statistics and swap it in when saved, so readers never see them change
+def test_loads_do_not_change_cached_stats(connection, make_csv):
+    csv_path = make_csv("usa.csv", 100)
+    upload_csv_to_database(connection, csv_path, "sales")
+    cached = column_statistics.get_table_stats(connection, "sales")
+    before = (cached.row_count, cached.version, cached.get("units_sold").histogram.copy())
+    append_rows(csv_path, 50)
+    incremental_load(connection, csv_path, "sales")
+    assert (cached.row_count, cached.version) == before[:2]
+    assert np.array_equal(cached.get("units_sold").histogram, before[2])
+    refreshed = column_statistics.get_table_stats(connection, "sales")
+    assert refreshed is not cached and refreshed.row_count == 150
@@ -0,0 +1,64 @@
+import pytest
+from conftest import count_rows, dataset_lines
+from csv_loader import build_insert_query, insert_batches, table_exists
+from incremental_ingest import incremental_load
+from schema_catalog import schema_catalog
+from simple_chatdb import upload_csv_to_database
+
+
+@pytest.mark.parametrize("use_local_infile", [True, False])
+def test_upload_loads_every_row(connection, make_csv, use_local_infile):
+    rows = len(dataset_lines("usa")[1])
+    csv_path = make_csv("sales.csv", rows)
+    assert upload_csv_to_database(connection, csv_path, "sales", batch_size=257,
+                                  use_local_infile=use_local_infile) == rows
+    assert count_rows(connection, "sales") == rows
+
+
+def test_upload_into_an_existing_table_appends(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("usa.csv", 120), "sales")
+    upload_csv_to_database(connection, make_csv("canada.csv", 80, country="canada"), "sales")
+    assert count_rows(connection, "sales") == 200
+
+
+def test_empty_and_missing_files_load_nothing(connection, tmp_path):
+    empty_path = tmp_path / "empty.csv"
+    empty_path.write_text("")
+    assert upload_csv_to_database(connection, str(empty_path), "sales") is None
+    assert upload_csv_to_database(connection, str(tmp_path / "missing.csv"), "sales") is None
+    assert not table_exists(connection, "sales")
+
+
+# A failing batch is retried row by row: only the bad rows are skipped
+def test_bad_rows_are_skipped(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE TABLE keyed (id INT PRIMARY KEY, name VARCHAR(10));")
+    batches = [[(1, "a"), (2, "b")], [(3, "c"), (2, "again"), (4, "d")], [(5, "e")]]
+    rows_inserted, failed_rows = insert_batches(connection, build_insert_query("keyed", ["id", "name"]), batches)
+    assert (rows_inserted, failed_rows) == (5, [(2, "again")])
+    assert count_rows(connection, "keyed") == 5
+
+
+# Numeric columns leave room for values larger than the first file's
+def test_appends_with_larger_values_fit(connection, make_csv, tmp_path):
+    upload_csv_to_database(connection, make_csv("sales.csv", 100), "sales")
+    column_types = schema_catalog.get_table_schema(connection, "sales").column_types
+    assert column_types["units_sold"].upper() in ("INT", "INTEGER")
+    assert column_types["price_per_unit"].upper().replace(" ", "") == "DECIMAL(12,2)"
+
+    header, lines = dataset_lines("usa")
+    larger = [line.split(",") for line in lines[:2]]
+    larger[0][5], larger[0][4] = "300", "1234.5"
+    larger[1][5], larger[1][4] = "3000000", "98765432.25"
+    larger_path = tmp_path / "larger.csv"
+    larger_path.write_text("\n".join([header] + [",".join(line) for line in larger]) + "\n")
+    assert upload_csv_to_database(connection, str(larger_path), "sales") == 2
+    csv_path = make_csv("more.csv", 1, start=500)
+    with open(csv_path, "a") as csv_file:
+        csv_file.write(",".join(larger[0][:5] + ["400"] + larger[0][6:]) + "\n")
+    assert incremental_load(connection, csv_path, "sales")["rows_failed"] == 0
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT units_sold, price_per_unit FROM sales WHERE units_sold >= 300 ORDER BY units_sold;")
+        rows = [(int(units), float(price)) for units, price in cursor.fetchall()]
+    assert rows == [(300, 1234.5), (400, 1234.5), (3000000, 98765432.25)]
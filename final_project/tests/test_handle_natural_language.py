@@ -0,0 +1,162 @@
+import json
+import os
+import pickle
+import random
+import subprocess
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import handle_natural_language
+from benchmarks import COSTCO_COLUMNS, SAMPLE_QUESTIONS, translate_to_sql_reference
+from column_stats import column_statistics
+from generate_sample_queries import generate_sample_queries
+from handle_natural_language import (FAST_TOKEN_PATTERN, FAST_TOKEN_UNSUPPORTED_PATTERN, CompiledTranslator,
+                                     get_translator, load_nltk_resources, translate_to_sql, word_tokenize)
+from query_cache import TranslationCache
+from simple_chatdb import upload_csv_to_database
+
+
+def test_compiled_translator_matches_reference():
+    translator = CompiledTranslator("costco", COSTCO_COLUMNS)
+    for question in SAMPLE_QUESTIONS:
+        assert translator.translate(question) == translate_to_sql_reference(question, COSTCO_COLUMNS, "costco"), question
+
+
+# Intended difference: with column statistics the compiled translator restores the stored spelling of
+# compared values, where the reference passes on the lower-cased token
+def test_statistics_restore_stored_values(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("usa.csv", 100), "costco")
+    table_stats = column_statistics.get_table_stats(connection, "costco")
+    question = "show all sales where currency is usd"
+    query, params = CompiledTranslator("costco", COSTCO_COLUMNS).translate(question, table_stats)
+    assert (query, params) == ("SELECT currency FROM costco WHERE currency = %s;", ["USD"])
+    assert translate_to_sql_reference(question, COSTCO_COLUMNS, "costco") == (query, ["usd"])
+
+
+# Carried over from the reference: the operator is looked up in the condition pattern, where the
+# "is" of "(?:is\s+)?" comes first, so every comparison phrase translates to "="
+def test_comparison_phrases_translate_to_equality():
+    translator = CompiledTranslator("costco", COSTCO_COLUMNS)
+    for question in ["price per unit higher than 900", "purchase date after 2022-01-01",
+                     "country code not equal to MX"]:
+        query, params = translator.translate(question)
+        assert " = %s" in query and (query, params) == translate_to_sql_reference(question, COSTCO_COLUMNS, "costco")
+
+
+# Generated queries and their descriptions, lowercased as questions are before they are tokenized
+def generated_texts(connection, count=200):
+    rng = random.Random(3)
+    texts = []
+    for _ in range(count):
+        generated = generate_sample_queries(connection, "costco", rng=rng, verbose=False)
+        if generated:
+            texts.extend(text.lower() for text in generated)
+    return texts
+
+
+def test_tokenizer_matches_nltk_on_generated_queries(connection, make_csv):
+    nltk = pytest.importorskip("nltk")
+    upload_csv_to_database(connection, make_csv("usa.csv", 500), "costco")
+    texts = generated_texts(connection) + [question.lower() for question in SAMPLE_QUESTIONS]
+    supported = [text for text in texts if not FAST_TOKEN_UNSUPPORTED_PATTERN.search(text)]
+    assert len(supported) > len(texts) / 3
+    try:
+        nltk.word_tokenize("warm up.")
+    except LookupError:
+        # Without the punkt data NLTK can only split single sentences, which every supported text is
+        for text in supported:
+            assert FAST_TOKEN_PATTERN.findall(text) == nltk.word_tokenize(text, preserve_line=True), text
+        return
+    for text in texts:
+        assert word_tokenize(text) == nltk.word_tokenize(text), text
+
+
+# Without NLTK (or its punkt data) every question is split by the built-in regex
+def test_tokenizer_falls_back_to_the_regex(monkeypatch):
+    monkeypatch.setattr(handle_natural_language, "nltk", None)
+    monkeypatch.setattr(handle_natural_language, "nltk_resources", None)
+    assert load_nltk_resources() is False
+    text = "select all columns from 'sales' where 'units_sold' > 5."
+    assert FAST_TOKEN_UNSUPPORTED_PATTERN.search(text)
+    assert word_tokenize(text) == FAST_TOKEN_PATTERN.findall(text)
+    assert word_tokenize("units sold by country?") == ["units", "sold", "by", "country", "?"]
+
+
+def test_missing_punkt_data_falls_back_to_the_regex(monkeypatch, tmp_path):
+    pytest.importorskip("nltk")
+
+    def missing_punkt():
+        raise LookupError("punkt")
+    monkeypatch.setattr(handle_natural_language, "nltk_resources", None)
+    monkeypatch.setattr(handle_natural_language, "build_nltk_resources", missing_punkt)
+    assert load_nltk_resources(str(tmp_path / "nltk_english.pickle")) is False
+    assert not (tmp_path / "nltk_english.pickle").exists()
+    text = "find the maximum value of the column 'units_sold'."
+    assert word_tokenize(text) == FAST_TOKEN_PATTERN.findall(text)
+
+
+@pytest.mark.parametrize("cache_contents", [b"not a pickle", pickle.dumps({"version": "0.0"}), pickle.dumps([1])])
+def test_corrupt_or_stale_nltk_cache_is_rebuilt(monkeypatch, tmp_path, cache_contents):
+    nltk = pytest.importorskip("nltk")
+    fresh = {"version": nltk.__version__, "built": True}
+    monkeypatch.setattr(handle_natural_language, "nltk_resources", None)
+    monkeypatch.setattr(handle_natural_language, "build_nltk_resources", lambda: fresh)
+    cache_path = tmp_path / "chatdb" / "nltk_english.pickle"
+    cache_path.parent.mkdir()
+    cache_path.write_bytes(cache_contents)
+    assert load_nltk_resources(str(cache_path)) == fresh
+    with open(cache_path, "rb") as cache_file:
+        assert pickle.load(cache_file) == fresh
+
+    # A current cache is used as is
+    monkeypatch.setattr(handle_natural_language, "nltk_resources", None)
+    monkeypatch.setattr(handle_natural_language, "build_nltk_resources", lambda: pytest.fail("cache was rebuilt"))
+    assert load_nltk_resources(str(cache_path)) == fresh
+
+
+def test_nltk_cache_path_can_be_set(tmp_path):
+    cache_path = str(tmp_path / "nltk.pickle")
+    output = subprocess.run([sys.executable, "-c", "import handle_natural_language as nl; print(nl.NLTK_CACHE_PATH)"],
+                            cwd=os.path.dirname(os.path.abspath(handle_natural_language.__file__)),
+                            env=dict(os.environ, CHATDB_NLTK_CACHE=cache_path), capture_output=True, text=True,
+                            check=True).stdout
+    assert output.strip() == cache_path
+
+
+def test_translators_are_kept_in_a_bounded_lru(monkeypatch):
+    monkeypatch.setattr(handle_natural_language, "translator_cache", OrderedDict())
+    monkeypatch.setattr(handle_natural_language, "MAX_TRANSLATORS", 2)
+    sales = get_translator("sales", COSTCO_COLUMNS)
+    get_translator("returns", COSTCO_COLUMNS)
+    assert get_translator("sales", COSTCO_COLUMNS) is sales
+    get_translator("stock", COSTCO_COLUMNS)
+    assert list(handle_natural_language.translator_cache) == [("sales", tuple(COSTCO_COLUMNS)),
+                                                              ("stock", tuple(COSTCO_COLUMNS))]
+
+
+def test_concurrent_lookups_share_one_translator(monkeypatch):
+    monkeypatch.setattr(handle_natural_language, "translator_cache", OrderedDict())
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        translators = list(executor.map(lambda _: get_translator("sales", COSTCO_COLUMNS), range(32)))
+    assert len({id(translator) for translator in translators}) == 1
+    assert len(handle_natural_language.translator_cache) == 1
+
+
+# Translations of new questions reach the persisted cache a batch at a time; repeats are cache hits
+def test_translations_are_persisted_in_batches(monkeypatch, tmp_path, connection, make_csv):
+    path = tmp_path / "translations.json"
+    cache = TranslationCache(persist_path=str(path), flush_entries=3, flush_seconds=3600)
+    monkeypatch.setattr(handle_natural_language, "translation_cache", cache)
+    upload_csv_to_database(connection, make_csv("usa.csv", 100), "costco")
+    translations = {question: translate_to_sql(question, connection, "costco") for question in SAMPLE_QUESTIONS[:5]}
+    assert len(json.loads(path.read_text())) == 3 and cache.stats()["unsaved"] == 2
+    translate_to_sql(SAMPLE_QUESTIONS[0], connection, "costco")
+    assert cache.stats()["hits"] == 1 and cache.stats()["unsaved"] == 2
+    cache.flush()
+    assert len(json.loads(path.read_text())) == 5 and cache.stats()["saves"] == 2
+    # A restarted process answers the saved questions from the file
+    reloaded = TranslationCache(persist_path=str(path))
+    monkeypatch.setattr(handle_natural_language, "translation_cache", reloaded)
+    assert translate_to_sql(SAMPLE_QUESTIONS[4], connection, "costco") == translations[SAMPLE_QUESTIONS[4]]
+    assert reloaded.stats()["hits"] == 1
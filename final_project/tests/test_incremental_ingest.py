@@ -0,0 +1,109 @@
+import pandas as pd
+from aggregate_cube import cube_registry
+from conftest import append_rows, count_rows, dataset_lines
+from incremental_ingest import incremental_load, is_tracked, table_column_profiles
+from multi_file_ingest import ingest_csv_files
+from query_executor import stream_query
+from simple_chatdb import upload_csv_to_database
+
+
+def test_incremental_load_after_upload_adds_only_appended_rows(connection, make_csv):
+    csv_path = make_csv("sales.csv", 1000)
+    assert upload_csv_to_database(connection, csv_path, "sales") == 1000
+    append_rows(csv_path, 3)
+
+    result = incremental_load(connection, csv_path, "sales")
+    assert result["mode"] == "append"
+    assert result["rows_inserted"] == 3
+    assert count_rows(connection, "sales") == 1003
+
+    assert incremental_load(connection, csv_path, "sales")["mode"] == "unchanged"
+    assert count_rows(connection, "sales") == 1003
+
+
+def test_rewritten_file_loads_only_rows_not_loaded_yet(connection, make_csv):
+    csv_path = make_csv("sales.csv", 500)
+    incremental_load(connection, csv_path, "sales")
+    rows = pd.read_csv(csv_path, dtype=str).sample(frac=1, random_state=1)
+    rows.to_csv(csv_path, index=False)
+    append_rows(csv_path, 2)
+
+    result = incremental_load(connection, csv_path, "sales")
+    assert result["mode"] == "rewrite"
+    assert (result["rows_inserted"], result["rows_skipped"]) == (2, 500)
+    assert count_rows(connection, "sales") == 502
+
+
+def test_upsert_replaces_rows_with_the_same_key(connection, make_csv):
+    csv_path = make_csv("sales.csv", 200)
+    upload_csv_to_database(connection, csv_path, "sales")
+    delta_path = make_csv("delta.csv", 5)
+    rows = pd.read_csv(delta_path, dtype=str)
+    rows["units_sold"] = "0"
+    rows.to_csv(delta_path, index=False)
+
+    result = incremental_load(connection, delta_path, "sales", key_columns=["product_id", "purchase_date", "purchase_time"])
+    assert (result["rows_inserted"], result["rows_replaced"]) == (5, 5)
+    assert count_rows(connection, "sales") == 200
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM sales WHERE units_sold = 0;")
+        assert cursor.fetchone()[0] == 5
+
+
+# Rows loaded from many files at once are not hashed, so the table cannot be loaded incrementally
+def test_incremental_load_refuses_tables_loaded_without_row_hashes(backend, connection, make_csv, tmp_path):
+    for country in ("usa", "canada"):
+        make_csv(f"files/sales_{country}.csv", 100, country)
+    ingest_csv_files(backend.connect_function, backend.connect_kwargs, str(tmp_path / "files"), "sales",
+                     use_threads=True)
+    assert count_rows(connection, "sales") == 200
+    assert not is_tracked(connection, "sales")
+
+    assert incremental_load(connection, make_csv("more.csv", 10), "sales") is None
+    assert count_rows(connection, "sales") == 200
+
+
+# Dates of the appended rows alone would also parse as month/day, and their amounts as integers; they
+# are converted with the day/month format and the DECIMAL type recorded for the table instead
+def test_appended_rows_are_converted_like_the_table(connection, tmp_path):
+    csv_path = tmp_path / "payments.csv"
+    csv_path.write_text("name,paid_on,amount\n" + "".join(f"a{day},{day}/01/2024,{day}.25\n" for day in range(13, 29)))
+    upload_csv_to_database(connection, str(csv_path), "payments")
+    with open(csv_path, "a") as csv_file:
+        csv_file.write("b,02/03/2024,2\nc,04/05/2024,3\n")
+
+    assert incremental_load(connection, str(csv_path), "payments")["rows_inserted"] == 2
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name, paid_on, amount FROM payments WHERE name IN ('b', 'c') ORDER BY name;")
+        rows = cursor.fetchall()
+    assert [(name, str(paid_on)[:10], float(amount)) for name, paid_on, amount in rows] == [
+        ("b", "2024-03-02", 2.0), ("c", "2024-05-04", 3.0)]
+    profiles = table_column_profiles(connection, "payments", ["paid_on", "amount"], {}, {"paid_on": "%d/%m/%Y"})
+    assert (profiles["paid_on"].kind, profiles["amount"].kind, profiles["amount"].scale) == ("date", "float", 2)
+
+
+# A row that cannot be inserted is not recorded as loaded: the cube and statistics match the table and
+# the next load of the file inserts it
+def test_partly_failed_append_is_retried(connection, make_csv):
+    csv_path = make_csv("sales.csv", 100)
+    upload_csv_to_database(connection, csv_path, "sales")
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE UNIQUE INDEX sales_purchase ON sales (product_id, purchase_date, purchase_time);")
+    connection.commit()
+    append_rows(csv_path, 2)
+    with open(csv_path, "a") as csv_file:
+        csv_file.write(dataset_lines("usa")[1][0] + "\n")
+
+    result = incremental_load(connection, csv_path, "sales")
+    assert (result["rows_inserted"], result["rows_failed"]) == (2, 1)
+    assert count_rows(connection, "sales") == 102
+    assert cube_registry.get("sales") is None
+    assert list(stream_query(connection, "SELECT COUNT(*) FROM sales;", use_cache=False)) == [(102,)]
+
+    with connection.cursor() as cursor:
+        cursor.execute("DROP INDEX sales_purchase;")
+    connection.commit()
+    result = incremental_load(connection, csv_path, "sales")
+    assert (result["mode"], result["rows_inserted"], result["rows_failed"]) == ("rewrite", 1, 0)
+    assert count_rows(connection, "sales") == 103
+    assert incremental_load(connection, csv_path, "sales")["mode"] == "unchanged"
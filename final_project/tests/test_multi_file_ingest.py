@@ -0,0 +1,63 @@
+from approximate_query import load_sample_info, sample_table, save_sample
+from column_stats import column_statistics
+from conftest import count_rows
+from incremental_ingest import table_column_definitions
+from multi_file_ingest import discriminator_values, ingest_csv_files
+from simple_chatdb import upload_csv_to_database
+from snapshot_cache import database_key, snapshot_cache, write_snapshot
+
+
+def test_discriminator_values_strip_the_shared_prefix_and_suffix():
+    labels = discriminator_values(["data/sales_usa.csv", "data/sales_canada.csv", "data/sales_mexico.csv"])
+    assert labels == {"data/sales_usa.csv": "usa", "data/sales_canada.csv": "canada", "data/sales_mexico.csv": "mexico"}
+
+
+def test_files_are_loaded_and_tagged_with_their_source(backend, connection, make_csv, tmp_path):
+    for country, rows in (("usa", 120), ("canada", 80), ("mexico", 50)):
+        make_csv(f"files/sales_{country}.csv", rows, country)
+    results = ingest_csv_files(backend.connect_function, backend.connect_kwargs, str(tmp_path / "files"), "sales",
+                               use_threads=True)
+    assert sorted(result[1] for result in results) == [50, 80, 120]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT source_name, COUNT(*) FROM sales GROUP BY source_name ORDER BY source_name;")
+        assert [tuple(row) for row in cursor.fetchall()] == [("canada", 80), ("mexico", 50), ("usa", 120)]
+
+
+# A second load into the table updates its sample's population and rewrites its snapshot
+def test_later_loads_refresh_the_sample_and_snapshot(backend, connection, make_csv, tmp_path):
+    make_csv("first/sales_usa.csv", 100, "usa")
+    make_csv("first/sales_canada.csv", 100, "canada")
+    ingest_csv_files(backend.connect_function, backend.connect_kwargs, str(tmp_path / "first"), "sales",
+                     use_threads=True)
+    columns = ["product_id", "purchase_date", "units_sold", "source_name"]
+    save_sample(connection, "sales", table_column_definitions(connection, "sales"), columns,
+                sample_table(connection, "sales", columns, 50))
+    write_snapshot(connection, "sales")
+
+    make_csv("second/sales_mexico.csv", 60, "mexico")
+    ingest_csv_files(backend.connect_function, backend.connect_kwargs, str(tmp_path / "second"), "sales",
+                     use_threads=True)
+    assert count_rows(connection, "sales") == 260
+    assert int(load_sample_info(connection, "sales")[2]) == 260
+    assert snapshot_cache.metadata(database_key(connection), "sales")["rows"] == 260
+
+
+
+# Files added to an existing table are converted with its recorded day/month date format and its
+# DECIMAL type, not as month/day dates and integers as the new files alone would suggest
+def test_files_added_to_a_table_are_converted_like_the_table(backend, connection, tmp_path):
+    csv_path = tmp_path / "payments.csv"
+    csv_path.write_text("name,paid_on,amount\n" + "".join(f"a{day},{day}/01/2024,{day}.25\n" for day in range(13, 29)))
+    upload_csv_to_database(connection, str(csv_path), "payments")
+    (tmp_path / "more").mkdir()
+    (tmp_path / "more" / "payments_march.csv").write_text("name,paid_on,amount\nb,02/03/2024,2\nc,04/05/2024,3\n")
+
+    results = ingest_csv_files(backend.connect_function, backend.connect_kwargs, str(tmp_path / "more"), "payments",
+                               discriminator_column=None, use_threads=True)
+    assert [result[1:3] for result in results] == [(2, 0)]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name, paid_on, amount FROM payments WHERE name IN ('b', 'c') ORDER BY name;")
+        rows = cursor.fetchall()
+    assert [(name, str(paid_on)[:10], float(amount)) for name, paid_on, amount in rows] == [
+        ("b", "2024-03-02", 2.0), ("c", "2024-05-04", 3.0)]
+    assert column_statistics.get_table_stats(connection, "payments").get("amount").kind == "float"
@@ -0,0 +1,80 @@
+import json
+import threading
+from query_cache import QueryResultCache, TranslationCache
+from query_executor import stream_query
+from simple_chatdb import upload_csv_to_database
+
+
+def test_cached_rows_cannot_be_changed():
+    cache = QueryResultCache()
+    key = cache.make_key("SELECT * FROM sales")
+    rows = [(1, "USD"), (2, "CAD")]
+    cache.put(key, rows)
+    rows.append((3, "MXN"))
+    assert list(cache.get(key)) == [(1, "USD"), (2, "CAD")]
+    dict_key = cache.make_key("SELECT * FROM sales", cursor_class=dict)
+    cache.put(dict_key, [{"id": 1}])
+    cache.get(dict_key)[0]["id"] = 99
+    assert cache.get(dict_key)[0] == {"id": 1}
+
+
+def test_invalidation_ignores_case():
+    cache = QueryResultCache()
+    key = cache.make_key("SELECT COUNT(*) FROM Sales")
+    cache.put(key, [(10,)])
+    cache.invalidate_table("SALES")
+    assert cache.get(key) is None
+
+
+def test_uploads_invalidate_cached_results(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("usa.csv", 100), "sales")
+    query = "SELECT COUNT(*) FROM SALES WHERE units_sold >= 0;"
+    assert list(stream_query(connection, query)) == [(100,)]
+    cached = stream_query(connection, query)
+    assert list(cached) == [(100,)] and cached.from_cache
+    upload_csv_to_database(connection, make_csv("canada.csv", 50, country="canada"), "Sales")
+    reloaded = stream_query(connection, query)
+    assert list(reloaded) == [(150,)] and not reloaded.from_cache
+
+
+def test_translations_are_written_in_batches(tmp_path):
+    path = tmp_path / "translations.json"
+    cache = TranslationCache(persist_path=str(path), flush_entries=3, flush_seconds=3600)
+    cache.put("total units", "fp", "SELECT SUM(units_sold) FROM sales", [])
+    cache.put("count rows", "fp", "SELECT COUNT(*) FROM sales", [])
+    assert not path.exists()
+    cache.put("max price", "fp", "SELECT MAX(price_per_unit) FROM sales", [])
+    assert len(json.loads(path.read_text())) == 3
+    cache.put("min price", "fp", "SELECT MIN(price_per_unit) FROM sales", [])
+    assert cache.stats()["unsaved"] == 1
+    cache.flush()
+    assert cache.stats()["saves"] == 2
+    assert TranslationCache(persist_path=str(path)).get("Min  Price", "fp") == ("SELECT MIN(price_per_unit) FROM sales", [])
+
+
+def test_translations_are_written_after_flush_seconds(tmp_path):
+    path = tmp_path / "translations.json"
+    cache = TranslationCache(persist_path=str(path), flush_entries=100, flush_seconds=0)
+    cache.put("total units", "fp", "SELECT SUM(units_sold) FROM sales", [])
+    assert path.exists()
+    cache.flush()
+    assert cache.stats()["saves"] == 1
+
+
+# Threads that fill a batch together write it once between them, and every translation reaches the file
+def test_concurrent_translations_are_written_in_batches(tmp_path):
+    path = tmp_path / "translations.json"
+    cache = TranslationCache(persist_path=str(path), flush_entries=10, flush_seconds=3600)
+
+    def translate(thread):
+        for question in range(25):
+            cache.put(f"question {thread} {question}", "fp", f"SELECT {thread}, {question}", [])
+    threads = [threading.Thread(target=translate, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Each of the 10 batches is written at most once by each thread that found it due
+    assert 0 < cache.stats()["saves"] <= 40
+    cache.flush()
+    assert len(json.loads(path.read_text())) == 100 and cache.stats()["unsaved"] == 0
@@ -0,0 +1,83 @@
+import pytest
+from aggregate_cube import cube_registry
+from conftest import normalized
+from query_executor import QueryPlan, execute_plan, stream_query
+from simple_chatdb import upload_csv_to_database
+from snapshot_cache import write_snapshot
+
+GROUPED_COUNT = "SELECT units_sold, COUNT(*) FROM sales GROUP BY units_sold;"
+ESTIMATED = ("SELECT country_code, SUM(units_sold) AS units, COUNT(*) AS sales, AVG(price_per_unit) AS price "
+             "FROM sales GROUP BY country_code;")
+
+
+def database_rows(connection, query):
+    return normalized(stream_query(connection, query, use_cache=False, use_cube=False, use_snapshot=False))
+
+
+def test_cube_answers_before_the_sample(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("sales.csv", 400), "sales", sample_rows=50)
+    plan = QueryPlan("SELECT SUM(units_sold) FROM sales;")
+    result = execute_plan(connection, plan, approximate=True)
+    rows = list(result)
+    assert result.from_cube and not result.approximate
+    assert rows == list(execute_plan(connection, plan, use_cube=False, use_cache=False))
+
+
+def test_sample_answers_without_the_cube(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("sales.csv", 400), "sales", sample_rows=50)
+    cube_registry.drop("sales")
+    result = execute_plan(connection, QueryPlan("SELECT SUM(units_sold) FROM sales;"), approximate=True)
+    list(result)
+    assert result.approximate and result.estimate.sample_rows == 50
+
+
+# The cube answers the aggregates it holds; other queries go to the database once and then come
+# from the result cache. Each returns the rows the database does.
+def test_cube_and_cache_return_the_database_rows(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("sales.csv", 400), "sales", sample_rows=100)
+    listing = "SELECT product_id, units_sold FROM sales WHERE units_sold > 40 ORDER BY product_id, id LIMIT 20;"
+
+    result = execute_plan(connection, QueryPlan(GROUPED_COUNT), approximate=True)
+    assert sorted(normalized(result)) == sorted(database_rows(connection, GROUPED_COUNT))
+    assert (result.from_cube, result.from_cache, result.approximate) == (True, False, False)
+
+    first, second = execute_plan(connection, QueryPlan(listing)), execute_plan(connection, QueryPlan(listing))
+    assert normalized(first) == normalized(second) == database_rows(connection, listing)
+    assert (first.from_cube, first.from_snapshot, first.from_cache, second.from_cache) == (False, False, False, True)
+
+
+# Without the cube, an up-to-date snapshot answers on the backends that are not DuckDB itself
+def test_snapshot_returns_the_database_rows(backend, connection, make_csv):
+    pytest.importorskip("duckdb")
+    upload_csv_to_database(connection, make_csv("sales.csv", 400), "sales")
+    write_snapshot(connection, "sales")
+    result = stream_query(connection, GROUPED_COUNT, use_cache=False, use_cube=False)
+    assert sorted(normalized(result)) == sorted(database_rows(connection, GROUPED_COUNT))
+    assert result.from_snapshot == (backend.name != "duckdb")
+
+
+# Estimates from a sample of the whole table are exact, with intervals of no width
+def test_estimates_from_a_full_sample_are_exact(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("sales.csv", 400), "sales", sample_rows=1000)
+    result = execute_plan(connection, QueryPlan(ESTIMATED), use_cube=False, approximate=True)
+    rows = normalized(result)
+    assert result.approximate and result.estimate.sample_rows == result.estimate.population_rows == 400
+    assert [[row[0]] + row[1::3] for row in rows] == database_rows(connection, ESTIMATED)
+    assert all(row[1::3] == row[2::3] == row[3::3] for row in rows)
+
+
+# Estimates from a partial sample: every group gets an estimate inside its 95% interval, and the
+# database's value lies within a few standard errors of it
+def test_estimates_from_a_partial_sample_bracket_the_database(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("usa.csv", 400), "sales", sample_rows=150)
+    upload_csv_to_database(connection, make_csv("canada.csv", 400, country="canada"), "sales", sample_rows=150)
+    result = execute_plan(connection, QueryPlan(ESTIMATED), dict_rows=True, use_cube=False, approximate=True)
+    estimates = {row["country_code"]: row for row in result}
+    assert result.approximate and (result.estimate.sample_rows, result.estimate.population_rows) == (150, 800)
+    for country, units, sales, price in database_rows(connection, ESTIMATED):
+        row = estimates[country]
+        for name, exact in (("units", units), ("sales", sales), ("price", price)):
+            low, estimate, high = row[f"{name}_low"], row[name], row[f"{name}_high"]
+            assert low <= estimate <= high and low < high
+            # The interval is 1.96 standard errors either side, so this allows about 5 standard errors
+            assert abs(exact - estimate) <= 2.5 * (high - low) / 2, (name, exact, row)
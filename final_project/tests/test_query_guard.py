@@ -0,0 +1,73 @@
+import pytest
+from query_executor import stream_query
+from query_guard import QueryGuard, QueryRejected, QueryTimeout, query_guard
+from simple_chatdb import upload_csv_to_database
+
+
+@pytest.fixture
+def sales(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("sales.csv", 300), "sales")
+    return connection
+
+
+# Thresholds well below the table's 300 rows
+@pytest.fixture
+def guard():
+    return QueryGuard(limit_rows=50, reject_rows=100, auto_limit=10, timeout=None, log_path=None)
+
+
+@pytest.mark.parametrize("query, action", [
+    ("SELECT * FROM sales LIMIT 5;", "allowed"),
+    ("SELECT COUNT(*) FROM sales;", "allowed"),
+    ("SELECT SUM(units_sold) FROM sales WHERE units_sold > 1;", "allowed"),
+    ("SELECT units_sold, COUNT(*) FROM sales GROUP BY units_sold;", "limited"),
+    ("SELECT units_sold, COUNT(*) FROM sales GROUP BY units_sold LIMIT 20;", "allowed"),
+])
+def test_guard_actions(sales, guard, query, action):
+    assert guard.check(sales, query).action == action
+
+
+def test_full_scans_are_rejected(sales, guard):
+    with pytest.raises(QueryRejected):
+        guard.check(sales, "SELECT * FROM sales ORDER BY units_sold;")
+    assert guard.counts["rejected"] == 1
+
+
+def test_full_scans_are_limited_without_a_reject_threshold(sales, guard):
+    guard.reject_rows = None
+    decision = guard.check(sales, "SELECT * FROM sales;")
+    assert (decision.action, decision.row_cap) == ("limited", 10)
+
+
+def test_executor_applies_the_guard(sales, monkeypatch):
+    monkeypatch.setattr(query_guard, "limit_rows", 50)
+    monkeypatch.setattr(query_guard, "reject_rows", 100)
+    monkeypatch.setattr(query_guard, "auto_limit", 10)
+    assert list(stream_query(sales, "SELECT COUNT(*) FROM sales;", use_cache=False, use_cube=False)) == [(300,)]
+    assert len(list(stream_query(sales, "SELECT id FROM sales GROUP BY id;", use_cache=False))) == 10
+    with pytest.raises(QueryRejected):
+        list(stream_query(sales, "SELECT * FROM sales;", use_cache=False))
+
+
+# A rejected or timed-out query leaves its pooled connection healthy; the pool keeps it
+def test_pool_keeps_connections_after_guard_errors(backend, make_csv, monkeypatch):
+    monkeypatch.setattr(query_guard, "limit_rows", 50)
+    monkeypatch.setattr(query_guard, "reject_rows", 100)
+    pool = backend.pool(max_size=1)
+    try:
+        with pool.connection() as connection:
+            upload_csv_to_database(connection, make_csv("sales.csv", 300), "sales")
+        with pytest.raises(QueryRejected):
+            with pool.connection() as connection:
+                list(stream_query(connection, "SELECT * FROM sales;", use_cache=False))
+        monkeypatch.setattr(query_guard, "timeout", 0.05)
+        with pytest.raises(QueryTimeout):
+            with pool.connection() as connection:
+                list(stream_query(connection, "SELECT SUM(a.units_sold * b.units_sold * c.price_per_unit) "
+                                              "FROM sales a, sales b, sales c, sales d;", use_cache=False))
+        monkeypatch.setattr(query_guard, "timeout", None)
+        with pool.connection() as connection:
+            assert list(stream_query(connection, "SELECT COUNT(*) FROM sales;", use_cache=False)) == [(300,)]
+        assert (pool.created, pool.discarded) == (1, 0)
+    finally:
+        pool.close()
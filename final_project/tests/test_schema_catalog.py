@@ -0,0 +1,44 @@
+from approximate_query import SAMPLE_TABLE_SUFFIX, SAMPLES_TABLE
+from chatdb_service import ChatDBService
+from column_stats import STATS_TABLE
+from conftest import append_rows
+from incremental_ingest import MANIFEST_TABLE, ROW_HASHES_SUFFIX, STAGING_SUFFIX, incremental_load
+from schema_catalog import INTERNAL_TABLE_SUFFIXES, INTERNAL_TABLES, SchemaCatalog, visible_tables
+from simple_chatdb import list_tables_and_select, upload_csv_to_database
+
+
+def test_internal_tables_are_listed():
+    assert {SAMPLES_TABLE, STATS_TABLE, MANIFEST_TABLE} <= set(INTERNAL_TABLES)
+    assert {SAMPLE_TABLE_SUFFIX, ROW_HASHES_SUFFIX, STAGING_SUFFIX} <= set(INTERNAL_TABLE_SUFFIXES)
+
+
+def test_visible_tables():
+    tables = ["Sales", "sales_sample", "SALES_row_hashes", "chatdb_samples", "chatdb_column_stats",
+              "chatdb_ingest_manifest", "free_sample", "returns_row_hashes"]
+    assert visible_tables(tables) == ["Sales", "free_sample", "returns_row_hashes"]
+
+
+def test_listings_leave_out_internal_tables(backend, make_csv, monkeypatch):
+    connection = backend.connect()
+    csv_path = make_csv("sales.csv", 200)
+    upload_csv_to_database(connection, csv_path, "sales", sample_rows=20)
+    append_rows(csv_path, 5)
+    incremental_load(connection, csv_path, "sales")
+    monkeypatch.setattr("builtins.input", lambda prompt: "1")
+    assert list_tables_and_select(connection) == "sales"
+    connection.close()
+    pool = backend.pool()
+    try:
+        assert ChatDBService(pool).list_tables({}) == {"tables": ["sales"]}
+    finally:
+        pool.close()
+
+
+def test_invalidation_ignores_case(connection, make_csv):
+    upload_csv_to_database(connection, make_csv("sales.csv", 10), "sales")
+    catalog = SchemaCatalog()
+    catalog.get_table_schema(connection, "Sales")
+    catalog.get_table_schema(connection, "sales")
+    catalog.invalidate("SALES")
+    catalog.get_table_schema(connection, "Sales")
+    assert (catalog.hits, catalog.misses, catalog.stats()["cached_tables"]) == (0, 3, 1)
@@ -0,0 +1,72 @@
+import pytest
+from backends import get_backend
+from conftest import append_rows
+from incremental_ingest import incremental_load
+from query_executor import stream_query
+from simple_chatdb import upload_csv_to_database
+from snapshot_cache import SNAPSHOT_QUERY_PATTERN, compares_text, snapshot_cache
+
+pytest.importorskip("duckdb")
+
+COLUMNS = [["id", "int"], ["country_code", "char(2)"], ["units_sold", "tinyint"], ["purchase_date", "date"],
+           ["currency", "enum('CAD','USD')"]]
+
+
+# Snapshots answer queries on the other backends; the DuckDB backend reads its own storage
+@pytest.fixture
+def sqlite_connection(tmp_path):
+    connection = get_backend("sqlite", str(tmp_path / "chatdb.sqlite")).connect()
+    yield connection
+    connection.close()
+
+
+@pytest.mark.parametrize("query, params, expected", [
+    ("SELECT * FROM sales LIMIT 5;", None, False),
+    ("SELECT AVG(units_sold) FROM sales WHERE units_sold > %s", [5], False),
+    ("SELECT purchase_date, SUM(units_sold) FROM sales GROUP BY purchase_date LIMIT 3", None, False),
+    ("SELECT currency, units_sold FROM sales LIMIT 3", None, False),
+    ("SELECT SUM(units_sold) FROM sales WHERE country_code = 'us'", None, True),
+    ("SELECT AVG(units_sold) FROM sales WHERE purchase_date > %s", ["2021-01-01"], True),
+    ("SELECT country_code, COUNT(*) FROM sales GROUP BY country_code", None, True),
+    ("SELECT COUNT(DISTINCT currency) FROM sales", None, True),
+    ("SELECT MAX(currency) FROM sales", None, True),
+])
+def test_compares_text(query, params, expected):
+    assert compares_text(SNAPSHOT_QUERY_PATTERN.match(query), params, COLUMNS) is expected
+
+
+# Rows with numbers as floats, and whether the snapshot answered; the cube would answer some aggregates first
+def run(connection, query, params=None):
+    result = stream_query(connection, query, params, use_cache=False, use_cube=False)
+    return [tuple(float(value) if isinstance(value, (int, float)) or type(value).__name__ == "Decimal" else str(value)
+                  for value in row) for row in result], result.from_snapshot
+
+
+def test_snapshot_answers_like_the_database(sqlite_connection, make_csv):
+    upload_csv_to_database(sqlite_connection, make_csv("sales.csv", 500), "sales", snapshot=True)
+    for query in ("SELECT COUNT(*), SUM(units_sold), MIN(price_per_unit) FROM sales;",
+                  "SELECT units_sold, COUNT(*) FROM sales GROUP BY units_sold ORDER BY units_sold LIMIT 10;",
+                  "SELECT product_id, purchase_date, units_sold FROM sales ORDER BY id LIMIT 5;"):
+        snapshot_rows, from_snapshot = run(sqlite_connection, query)
+        snapshot_cache.enabled = False
+        try:
+            database_rows, _ = run(sqlite_connection, query)
+        finally:
+            snapshot_cache.enabled = True
+        assert from_snapshot
+        assert snapshot_rows == database_rows
+
+
+def test_text_comparisons_go_to_the_database(sqlite_connection, make_csv):
+    upload_csv_to_database(sqlite_connection, make_csv("sales.csv", 200), "sales", snapshot=True)
+    assert run(sqlite_connection, "SELECT COUNT(*) FROM sales WHERE country_code = 'US';") == ([(200.0,)], False)
+
+
+# A load changes the table's version stamp; the snapshot is rewritten with the new rows
+def test_snapshot_follows_loads(sqlite_connection, make_csv):
+    csv_path = make_csv("sales.csv", 300)
+    upload_csv_to_database(sqlite_connection, csv_path, "sales", snapshot=True)
+    append_rows(csv_path, 20)
+    incremental_load(sqlite_connection, csv_path, "sales")
+    assert run(sqlite_connection, "SELECT COUNT(*) FROM sales;") == ([(320.0,)], True)
+    assert snapshot_cache.stats()["stale"] == 0